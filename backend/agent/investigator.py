@@ -1,18 +1,75 @@
 import os
 import json
+import time
+import asyncio
+import functools
 from typing import Dict, List, Optional
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from integrations.github import get_github_client
 from integrations.parallel_ai import parallel_client
+from logscan import excerpt_logs
+from agent.prompt import Section, fit_sections, estimate_tokens, truncate_to_tokens, PROMPT_TOKEN_BUDGET
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+# Forward streamed analysis to WebSockets at most this often
+STREAM_FLUSH_INTERVAL = float(os.getenv("ANALYSIS_STREAM_FLUSH_INTERVAL", "0.25"))
+# Context gathering timeouts in seconds (per source, and for the whole stage)
+GITHUB_CONTEXT_TIMEOUT = float(os.getenv("GITHUB_CONTEXT_TIMEOUT", "10"))
+SEARCH_CONTEXT_TIMEOUT = float(os.getenv("SEARCH_CONTEXT_TIMEOUT", "15"))
+CONTEXT_DEADLINE = float(os.getenv("CONTEXT_DEADLINE", "20"))
+# Relative claim of each prompt section on the token budget
+SECTION_RELEVANCE = {"logs": 3.0, "diff": 2.0, "docs": 1.0, "web": 1.0, "commits": 0.5}
+# Anthropic prompt caching of the per-repository prefix (commits, docs); the
+# prefix gets this fixed share of the budget so it is identical across incidents
+PROMPT_CACHE = os.getenv("ANTHROPIC_PROMPT_CACHE", "true").lower() == "true"
+PROMPT_PREFIX_SHARE = float(os.getenv("PROMPT_PREFIX_SHARE", "0.35"))
+
+# Two-stage analysis: a fast model triages and answers confident, simple cases;
+# everything else escalates to the analysis model with the triage notes
+ANALYSIS_MODEL = os.getenv("ANALYSIS_MODEL", "claude-sonnet-4-20250514")
+ANALYSIS_MAX_TOKENS = int(os.getenv("ANALYSIS_MAX_TOKENS", "2000"))
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() == "true"
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "claude-3-5-haiku-20241022")
+TRIAGE_MAX_TOKENS = int(os.getenv("TRIAGE_MAX_TOKENS", "1000"))
+TRIAGE_CONFIDENCE_THRESHOLD = float(os.getenv("TRIAGE_CONFIDENCE_THRESHOLD", "0.85"))
+TRIAGE_ESCALATE_CATEGORIES = {
+    c.strip() for c in os.getenv("TRIAGE_ESCALATE_CATEGORIES", "code,unknown").split(",") if c.strip()
+}
+
+SYSTEM_PROMPT = """You are an on-call engineer investigating a deployment failure. Analyze the information you are given about the repository and the incident and provide:
+
+1. Root cause analysis
+2. Specific problematic code (if any)
+3. Suggested fix with code
+4. Whether to revert the commit or patch the code
+
+Provide your analysis in JSON format:
+{
+    "root_cause": "Brief explanation",
+    "problematic_code": "Code snippet if applicable",
+    "suggested_fix": "Specific fix with code",
+    "action": "revert" or "patch",
+    "confidence": "high" or "medium" or "low"
+}"""
+
+TRIAGE_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+
+Before the analysis, classify the failure. Add these fields to the JSON:
+    "category": "config" (missing/invalid env var or setting), "dependency" (package install/version),
+                "build" (compile/build step), "resource" (memory, disk, port, timeouts),
+                "code" (a bug in application code) or "unknown",
+    "confidence_score": probability from 0.0 to 1.0 that your root cause and fix are correct and complete,
+    "notes": one or two sentences of observations for a senior engineer who may take over
+
+Only give a high confidence_score when the logs state the cause explicitly."""
+LOG_FALLBACK_CHARS = 2000  # Raw log tail used if the scanner does not finish by the deadline
 
 class OnCallInvestigator:
     def __init__(self, anthropic_api_key: Optional[str] = None):
         self.anthropic_key = anthropic_api_key or ANTHROPIC_API_KEY
         if not self.anthropic_key:
             raise ValueError("Anthropic API key not found")
-        self.client = Anthropic(api_key=self.anthropic_key)
+        self.client = AsyncAnthropic(api_key=self.anthropic_key)
     
     async def investigate(
         self,
@@ -22,7 +79,7 @@ class OnCallInvestigator:
         error_message: str,
         deployment_logs: str = "",
         commit_sha: str = "",
-        documents: List[str] = None,
+        documents: List[Dict] = None,
         websocket_manager = None
     ) -> Dict:
         """
@@ -30,24 +87,10 @@ class OnCallInvestigator:
         """
         documents = documents or []
         
-        # Step 1: Gather GitHub context
+        # Steps 1 & 2: Gather GitHub context and search the web concurrently
         await self._send_step(investigation_id, websocket_manager, 
                              "Fetching repository context from GitHub...", 
                              {"step": "github_context"})
-        
-        github_client = get_github_client()
-        recent_commits = []
-        commit_diff = ""
-        
-        if github_client:
-            try:
-                recent_commits = github_client.get_recent_commits(repo_owner, repo_name, limit=5)
-                if commit_sha:
-                    commit_diff = github_client.get_commit_diff(repo_owner, repo_name, commit_sha)
-            except Exception as e:
-                print(f"Error fetching GitHub data: {e}")
-        
-        # Step 2: Web search
         await self._send_step(investigation_id, websocket_manager,
                              f"Searching web for: {error_message[:100]}...",
                              {"step": "web_search"})
@@ -57,9 +100,31 @@ class OnCallInvestigator:
             f"{error_message} solution",
         ]
         
-        web_results = []
+        github_client = get_github_client()
+        sources = {}
+        if github_client:
+            # Commits, target commit and relevant patches in one or two round-trips
+            sources["github"] = self._fetch(
+                "GitHub context", GITHUB_CONTEXT_TIMEOUT,
+                github_client.get_investigation_context, repo_owner, repo_name, commit_sha,
+                f"{error_message}\n{deployment_logs[-4000:]}"
+            )
         if parallel_client:
-            web_results = parallel_client.search_multiple(search_queries)
+            sources["web_results"] = self._fetch_async(
+                "web search", SEARCH_CONTEXT_TIMEOUT,
+                parallel_client.search_multiple_async(search_queries)
+            )
+        
+        # Scanning a large log is CPU bound; do it while the fetches are in flight
+        if deployment_logs:
+            sources["log_excerpt"] = self._fetch("log scan", CONTEXT_DEADLINE, excerpt_logs, deployment_logs)
+        
+        context = await self._gather_context(sources)
+        github_context = context.get("github") or {}
+        recent_commits = github_context.get("recent_commits") or []
+        diff_parts = github_context.get("diff_parts") or []
+        web_results = context.get("web_results") or []
+        log_excerpt = context.get("log_excerpt") or deployment_logs[-LOG_FALLBACK_CHARS:]
         
         # Step 3: Analyze with Claude
         await self._send_step(investigation_id, websocket_manager,
@@ -67,10 +132,14 @@ class OnCallInvestigator:
                              {"step": "claude_analysis"})
         
         analysis = await self._analyze_with_claude(
+            investigation_id=investigation_id,
+            websocket_manager=websocket_manager,
+            repo_owner=repo_owner,
+            repo_name=repo_name,
             error_message=error_message,
-            deployment_logs=deployment_logs,
+            deployment_logs=log_excerpt,
             recent_commits=recent_commits,
-            commit_diff=commit_diff,
+            diff_parts=diff_parts,
             documents=documents,
             web_results=web_results
         )
@@ -83,101 +152,272 @@ class OnCallInvestigator:
     
     async def _analyze_with_claude(
         self,
+        investigation_id: str,
+        websocket_manager,
+        repo_owner: str,
+        repo_name: str,
         error_message: str,
-        deployment_logs: str,
+        deployment_logs: str,  # Ranked excerpt from logscan, not the raw log
         recent_commits: List[Dict],
-        commit_diff: str,
-        documents: List[str],
+        diff_parts: List[str],
+        documents: List[Dict],
         web_results: List[Dict]
     ) -> Dict:
         """
         Use Claude AI to analyze the incident and suggest fixes
         """
         
-        # Build context
-        commits_summary = "\n".join([
-            f"- {c['sha'][:7]}: {c['message']}" for c in recent_commits[:5]
-        ])
-        
-        web_search_summary = "\n".join([
-            f"- {r['title']}: {r['snippet'][:200]}" for r in web_results[:3]
-        ])
-        
-        docs_summary = "\n".join(documents[:3]) if documents else "No documentation provided."
+        prefix, suffix, report = self._build_prompt(repo_owner, repo_name, error_message, deployment_logs,
+                                                    recent_commits, diff_parts, documents, web_results)
+        print(f"Prompt for investigation {investigation_id}: " + ", ".join(
+            f"{title.lower()} {r['used']}/{r['demand']}" for title, r in report.items()
+        ) + " tokens")
         
-        prompt = f"""You are an on-call engineer investigating a deployment failure. Analyze the following information and provide:
-
-1. Root cause analysis
-2. Specific problematic code (if any)
-3. Suggested fix with code
-4. Whether to revert the commit or patch the code
-
-INCIDENT DETAILS:
-Error: {error_message}
-
-DEPLOYMENT LOGS:
-{deployment_logs[:1000] if deployment_logs else "No logs provided"}
+        # Stable per-repository context first, marked as cache breakpoints
+        prefix_blocks = [self._text_block(block, cache=PROMPT_CACHE) for block in prefix]
+        usages = []
+        routing = None
 
-RECENT COMMITS:
-{commits_summary}
+        # API errors propagate so the job queue retries the investigation
+        if TRIAGE_ENABLED:
+            triage, routing = await self._triage(prefix_blocks, suffix, usages)
+            await self._send_step(investigation_id, websocket_manager,
+                                 f"Triage ({routing['category']}, confidence {routing['confidence']}): {routing['decision']}",
+                                 {"step": "triage", "routing": routing})
+            if routing["decision"] == "answered":
+                triage["usage"] = self._total_usage(usages)
+                triage["routing"] = routing
+                return triage
+            if triage.get("notes"):
+                suffix += f"\n\nTRIAGE NOTES (from a faster model; verify before relying on them):\n{triage['notes']}"
 
-COMMIT DIFF:
-{commit_diff[:1000] if commit_diff else "No diff available"}
-
-UPLOADED DOCUMENTATION:
-{docs_summary[:1000]}
+        text = await self._stream_claude(
+            investigation_id, websocket_manager, ANALYSIS_MODEL, ANALYSIS_MAX_TOKENS,
+            SYSTEM_PROMPT, prefix_blocks + [self._text_block(suffix)], usages
+        )
+        analysis = self._parse_analysis(text)
+        analysis["usage"] = self._total_usage(usages)
+        analysis["routing"] = routing
+        return analysis
+    
+    async def _triage(self, prefix_blocks: List[Dict], suffix: str, usages: List[Dict]) -> tuple:
+        """Ask the fast model first; returns (its analysis, routing decision)"""
+        routing = {"triage_model": TRIAGE_MODEL, "category": "unknown", "confidence": 0.0}
+        try:
+            response = await self.client.messages.create(
+                model=TRIAGE_MODEL,
+                max_tokens=TRIAGE_MAX_TOKENS,
+                system=[self._text_block(TRIAGE_SYSTEM_PROMPT)],
+                messages=[{"role": "user", "content": prefix_blocks + [self._text_block(suffix)]}]
+            )
+        except Exception as e:
+            print(f"Triage model error, escalating: {e}")
+            return {}, dict(routing, decision="escalated", reason="triage_error")
+        usages.append(self._usage(response, None, None))
+        triage = self._parse_analysis("".join(b.text for b in response.content if b.type == "text"))
+        try:
+            confidence = max(0.0, min(1.0, float(triage.pop("confidence_score", 0))))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        category = str(triage.get("category") or "unknown").lower()
+        routing.update(category=category, confidence=round(confidence, 2))
+        if category in TRIAGE_ESCALATE_CATEGORIES:
+            routing.update(decision="escalated", reason="category")
+        elif confidence < TRIAGE_CONFIDENCE_THRESHOLD:
+            routing.update(decision="escalated", reason="low_confidence")
+        elif not triage.get("root_cause") or not triage.get("suggested_fix"):
+            routing.update(decision="escalated", reason="incomplete")
+        else:
+            routing.update(decision="answered", reason="confident")
+        return triage, routing
+    
+    async def _stream_claude(self, investigation_id: str, websocket_manager, model: str, max_tokens: int,
+                             system: str, content: List[Dict], usages: List[Dict]) -> str:
+        """Stream a response, forwarding text to WebSockets; returns the full text"""
+        chunks = []
+        pending = []
+        started = time.monotonic()
+        first_token_at = None
+        last_flush = started
+        
+        # Stream tokens so the event loop stays free and viewers see output immediately
+        async with self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            system=[self._text_block(system)],
+            messages=[{"role": "user", "content": content}]
+        ) as stream:
+            async for text in stream.text_stream:
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                chunks.append(text)
+                pending.append(text)
+                if time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    await self._send_delta(investigation_id, websocket_manager, "".join(pending))
+                    pending = []
+                    last_flush = time.monotonic()
+            message = await stream.get_final_message()
+        
+        if pending:
+            await self._send_delta(investigation_id, websocket_manager, "".join(pending))
+        usages.append(self._usage(message, started, first_token_at))
+        return "".join(chunks)
+    
+    @staticmethod
+    def _text_block(text: str, cache: bool = False) -> Dict:
+        block = {"type": "text", "text": text}
+        if cache:
+            block["cache_control"] = {"type": "ephemeral"}
+        return block
+    
+    @staticmethod
+    def _total_usage(usages: List[Dict]) -> Dict:
+        """Token totals across the triage and analysis calls, attributed to the final model"""
+        total = {"model": usages[-1]["model"] if usages else None, "time_to_first_token_ms": None}
+        for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            total[key] = sum(u[key] for u in usages)
+        if usages:
+            total["time_to_first_token_ms"] = usages[-1]["time_to_first_token_ms"]
+        return total
+    
+    @staticmethod
+    def _usage(message, started: Optional[float], first_token_at: Optional[float]) -> Dict:
+        """Token and prompt cache accounting for one Claude call"""
+        usage = message.usage
+        return {
+            "model": message.model,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            "time_to_first_token_ms": round((first_token_at - started) * 1000) if first_token_at else None,
+        }
+    
+    @staticmethod
+    def _build_prompt(
+        repo_owner: str,
+        repo_name: str,
+        error_message: str,
+        deployment_logs: str,
+        recent_commits: List[Dict],
+        diff_parts: List[str],
+        documents: List[Dict],
+        web_results: List[Dict],
+        budget: int = PROMPT_TOKEN_BUDGET
+    ) -> tuple:
+        """Fit the context into the token budget as a cacheable prefix and an incident suffix.
 
-WEB SEARCH RESULTS:
-{web_search_summary}
+        Returns (prefix blocks, suffix, report). The prefix (repository
+        summary, documentation) gets a fixed share of the budget that does not
+        depend on the incident, so it stays byte-identical, and therefore
+        cache-hits, across incidents that retrieve the same docs.
+        """
+        budget -= estimate_tokens(SYSTEM_PROMPT)
+        # Strongly matching docs get more of the prefix; the same retrieved
+        # chunks give the same split, so the prefix still caches
+        best_doc = max((d.get("score", 0) for d in documents), default=0)
+        docs_relevance = SECTION_RELEVANCE["docs"] * (1 + min(best_doc / 10, 1))
+        prefix_sections = [
+            Section("RECENT COMMITS", [
+                f"- {c['sha'][:7]}: {c['message']}" for c in recent_commits
+            ], SECTION_RELEVANCE["commits"]),
+            # Documents arrive as the top-k retrieved chunks, best first
+            Section("UPLOADED DOCUMENTATION", [
+                f"[{d['filename']}]\n{d['text']}" for d in documents
+            ], docs_relevance, empty="No documentation provided."),
+        ]
+        prefix_blocks, report = fit_sections(prefix_sections, int(budget * PROMPT_PREFIX_SHARE))
+        prefix = [f"REPOSITORY: {repo_owner}/{repo_name}\n\n{prefix_blocks[0]}", prefix_blocks[1]]
 
-Provide your analysis in JSON format:
-{{
-    "root_cause": "Brief explanation",
-    "problematic_code": "Code snippet if applicable",
-    "suggested_fix": "Specific fix with code",
-    "action": "revert" or "patch",
-    "confidence": "high" or "medium" or "low"
-}}"""
+        # Patches touching a file the error mentions are worth more of the budget
+        haystack = f"{error_message}\n{deployment_logs}"
+        diff_relevance = SECTION_RELEVANCE["diff"]
+        for part in diff_parts[:3]:
+            path = part.split("\n", 1)[0].rsplit(" b/", 1)[-1]
+            if path.rsplit("/", 1)[-1] in haystack:
+                diff_relevance *= 1.5
+                break
 
+        header = f"INCIDENT DETAILS:\nError: {truncate_to_tokens(error_message, budget // 8)}"
+        footer = "Provide your analysis of this incident in the JSON format described."
+        suffix_sections = [
+            Section("DEPLOYMENT LOGS", [deployment_logs], SECTION_RELEVANCE["logs"],
+                    keep="end", empty="No logs provided"),
+            Section("COMMIT DIFF", diff_parts, diff_relevance, empty="No diff available"),
+            Section("WEB SEARCH RESULTS", [
+                f"- {r['title']}: {r['snippet']}" for r in web_results
+            ], SECTION_RELEVANCE["web"]),
+        ]
+        remaining = budget - estimate_tokens("\n\n".join(prefix))
+        suffix_blocks, suffix_report = fit_sections(
+            suffix_sections, remaining - estimate_tokens(header) - estimate_tokens(footer)
+        )
+        report.update(suffix_report)
+        return prefix, "\n\n".join([header] + suffix_blocks + [footer]), report
+    
+    async def _fetch(self, label: str, timeout: float, fn, *args):
+        """Run a blocking context fetch off the event loop with its own timeout"""
+        loop = asyncio.get_running_loop()
+        return await self._fetch_async(label, timeout, loop.run_in_executor(None, functools.partial(fn, *args)))
+    
+    async def _fetch_async(self, label: str, timeout: float, awaitable):
+        """Await a context fetch with its own timeout"""
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            content = response.content[0].text
-            
-            # Try to parse JSON from response
-            try:
-                # Extract JSON from markdown code blocks if present
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0].strip()
-                
-                result = json.loads(content)
-            except:
-                # Fallback: treat entire response as result
-                result = {
-                    "root_cause": content,
-                    "problematic_code": "",
-                    "suggested_fix": "",
-                    "action": "manual_review",
-                    "confidence": "low"
-                }
-            
-            return result
-            
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            print(f"Context fetch timed out after {timeout}s: {label}")
         except Exception as e:
-            print(f"Claude API error: {e}")
-            return {
-                "root_cause": f"Error analyzing: {str(e)}",
-                "problematic_code": "",
-                "suggested_fix": "",
-                "action": "manual_review",
-                "confidence": "low"
-            }
+            print(f"Error fetching {label}: {e}")
+        return None
+    
+    async def _gather_context(self, sources: Dict) -> Dict:
+        """Await all context sources together, keeping whatever is ready by the deadline"""
+        if not sources:
+            return {}
+        tasks = {name: asyncio.ensure_future(coro) for name, coro in sources.items()}
+        done, pending = await asyncio.wait(tasks.values(), timeout=CONTEXT_DEADLINE)
+        for task in pending:
+            task.cancel()
+        if pending:
+            missing = [name for name, task in tasks.items() if task in pending]
+            print(f"Context deadline hit, continuing without: {', '.join(missing)}")
+        return {name: task.result() for name, task in tasks.items() if task in done}
+    
+    @staticmethod
+    def _parse_analysis(content: str) -> Dict:
+        """Parse the JSON analysis out of Claude's response text"""
+        # Extract JSON from markdown code blocks if present
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        
+        # Decode the first JSON object, ignoring any prose around it
+        start = content.find("{")
+        if start != -1:
+            try:
+                result, _ = json.JSONDecoder().raw_decode(content, start)
+                if isinstance(result, dict):
+                    return result
+            except ValueError:
+                pass
+        
+        # Fallback: treat entire response as result
+        return {
+            "root_cause": content,
+            "problematic_code": "",
+            "suggested_fix": "",
+            "action": "manual_review",
+            "confidence": "low"
+        }
+    
+    async def _send_delta(self, investigation_id: str, websocket_manager, text: str):
+        """Forward a chunk of streamed analysis via WebSocket"""
+        if websocket_manager and text:
+            await websocket_manager.send_message(investigation_id, {
+                "type": "analysis_delta",
+                "text": text
+            })
     
     async def _send_step(self, investigation_id: str, websocket_manager, message: str, data: Dict):
         """Send step update via WebSocket"""
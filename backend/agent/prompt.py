@@ -0,0 +1,98 @@
+import os
+import re
+from typing import Dict, List, Tuple
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+MIN_PARTIAL_TOKENS = 40  # Don't bother truncating an item below this
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: ~4 characters per word piece, one per symbol"""
+    if not text:
+        return 0
+    return sum((len(m) + 3) // 4 if m[0].isalnum() or m[0] == "_" else 1 for m in _TOKEN.findall(text))
+
+def truncate_to_tokens(text: str, tokens: int, keep: str = "start") -> str:
+    """Cut text to about `tokens` tokens, keeping its start or its end"""
+    total = estimate_tokens(text)
+    if total <= tokens:
+        return text
+    chars = max(0, int(len(text) * tokens / total) - 4)
+    while True:
+        part = "..." + text[len(text) - chars:] if keep == "end" else text[:chars] + "..."
+        # The proportional cut is an estimate; shave until it fits
+        if chars == 0 or estimate_tokens(part) <= tokens:
+            return part
+        chars = max(0, chars - max(4, chars // 20))
+
+class Section:
+    """A block of prompt context: ordered items (best first) and a relevance weight"""
+    def __init__(self, title: str, items: List[str], relevance: float = 1.0,
+                 keep: str = "start", empty: str = "None available"):
+        self.title = title
+        self.items = [item for item in items if item]
+        self.relevance = relevance
+        self.keep = keep  # Which end of a truncated item to keep
+        self.empty = empty
+        self.costs = [estimate_tokens(item) + 1 for item in self.items]
+
+    @property
+    def demand(self) -> int:
+        return sum(self.costs)
+
+    def fit(self, tokens: int) -> Tuple[str, int]:
+        """Render the items that fit in `tokens`, truncating the first one that doesn't"""
+        kept, used = [], 0
+        for item, cost in zip(self.items, self.costs):
+            if used + cost <= tokens:
+                kept.append(item)
+                used += cost
+                continue
+            left = tokens - used
+            if left >= MIN_PARTIAL_TOKENS or not kept:
+                part = truncate_to_tokens(item, max(left - 1, 0), self.keep)
+                if part.strip(". "):
+                    kept.append(part)
+                    used += estimate_tokens(part) + 1
+            break
+        return "\n".join(kept), used
+
+def allocate(sections: List[Section], budget: int) -> List[int]:
+    """Split a token budget across sections in proportion to relevance.
+
+    Sections that need less than their share get exactly what they need and
+    the surplus is re-split among the rest (water-filling), so small
+    incidents aren't padded and large ones use the whole budget.
+    """
+    grants = [0] * len(sections)
+    active = [i for i, s in enumerate(sections) if s.demand > 0 and s.relevance > 0]
+    remaining = max(budget, 0)
+    while active and remaining > 0:
+        weight = sum(sections[i].relevance for i in active)
+        shares = {i: remaining * sections[i].relevance / weight for i in active}
+        satisfied = [i for i in active if sections[i].demand - grants[i] <= shares[i]]
+        if not satisfied:
+            for i in active:
+                grants[i] += int(shares[i])
+            break
+        for i in satisfied:
+            need = sections[i].demand - grants[i]
+            grants[i] += need
+            remaining -= need
+            active.remove(i)
+    return grants
+
+def fit_sections(sections: List[Section], budget: int) -> Tuple[List[str], Dict]:
+    """Render sections as titled blocks sharing `budget` estimated tokens.
+
+    Returns the blocks and a report of {title: {"demand", "granted", "used"}}.
+    """
+    budget -= sum(estimate_tokens(s.title) + 2 for s in sections)
+    grants = allocate(sections, budget)
+    blocks, report = [], {}
+    for section, granted in zip(sections, grants):
+        body, used = section.fit(granted)
+        blocks.append(f"{section.title}:\n{body or section.empty}")
+        report[section.title] = {"demand": section.demand, "granted": granted, "used": used}
+    return blocks, report
@@ -0,0 +1,153 @@
+import os
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+
+# Consecutive messages of these types are merged into one by concatenating "text"
+COALESCE_TYPES = {"analysis_delta"}
+
+class ClientConnection:
+    """One WebSocket with a bounded outbound queue drained by its own writer task.
+
+    Publishing only appends to the queue, so a slow browser never holds up
+    the sender. When the queue is full the oldest message is dropped and
+    the client is told how many it missed; streamed text deltas are merged
+    rather than queued one by one.
+    """
+    def __init__(self, hub: "BroadcastHub", websocket: WebSocket, channel: str,
+                 max_queue: int = WS_QUEUE_SIZE):
+        self.hub = hub
+        self.websocket = websocket
+        self.channel = channel
+        self.max_queue = max(1, max_queue)
+        self.queue: Deque[dict] = deque()
+        self.dropped = 0
+        self.sent = 0
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self, history: List[dict] = ()):
+        """Start sending, first replaying `history` (messages with a "seq" and "origin").
+
+        Live messages queued while the history was loaded are kept only if
+        they are newer than the last replayed one of the process that sent
+        them (each process writes its events in order), and are merged into
+        the history by sequence number.
+        """
+        if history:
+            last: Dict[Optional[str], int] = {}
+            for message in history:
+                origin = message.get("origin")
+                last[origin] = max(last.get(origin, 0), message.get("seq") or 0)
+            live = [m for m in self.queue if m.get("seq") is None or m["seq"] > last.get(m.get("origin"), 0)]
+            ordered = sorted(list(history) + [m for m in live if m.get("seq") is not None],
+                             key=lambda m: m.get("seq") or 0)
+            self.queue = deque(ordered + [m for m in live if m.get("seq") is None])
+            self._ready.set()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: dict):
+        if self.closed:
+            return
+        last = self.queue[-1] if self.queue else None
+        if (last is not None and message.get("type") in COALESCE_TYPES
+                and last.get("type") == message["type"] and set(last) == set(message)):
+            self.queue[-1] = dict(message, text=last.get("text", "") + message.get("text", ""))
+        else:
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.dropped += 1
+                self.hub.dropped += 1
+            self.queue.append(message)
+        self._ready.set()
+
+    async def _send(self, message: dict):
+        await asyncio.wait_for(self.websocket.send_json(message), WS_SEND_TIMEOUT)
+        self.sent += 1
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    try:
+                        await asyncio.wait_for(self._ready.wait(), WS_HEARTBEAT_INTERVAL)
+                    except asyncio.TimeoutError:
+                        await self._send({"type": "ping"})  # Also detects half-open sockets
+                        continue
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    await self._send({"type": "messages_dropped", "count": dropped})
+                if self.queue:
+                    await self._send(self.queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Evicting WebSocket on {self.channel}: {e.__class__.__name__}: {e}")
+            self.hub.evicted += 1
+            await self.close()
+            self.hub.remove(self)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+class BroadcastHub:
+    """Channel-based WebSocket fan-out over per-connection send queues"""
+    def __init__(self, max_queue: int = WS_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self.channels: Dict[str, Set[ClientConnection]] = {}
+        self.dropped = 0
+        self.evicted = 0
+
+    async def connect(self, websocket: WebSocket, channel: str, paused: bool = False) -> ClientConnection:
+        """Accept and subscribe a socket; a paused one buffers until start() is called"""
+        await websocket.accept()
+        connection = ClientConnection(self, websocket, channel, self.max_queue)
+        self.channels.setdefault(channel, set()).add(connection)
+        if not paused:
+            connection.start()
+        return connection
+
+    def remove(self, connection: ClientConnection):
+        connections = self.channels.get(connection.channel)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.channels[connection.channel]
+
+    async def disconnect(self, connection: ClientConnection):
+        self.remove(connection)
+        await connection.close()
+
+    def publish(self, channel: str, message: dict) -> int:
+        """Queue a message for every socket on a channel; returns the number of recipients"""
+        connections: List[ClientConnection] = list(self.channels.get(channel, ()))
+        for connection in connections:
+            connection.enqueue(message)
+        return len(connections)
+
+    def stats(self) -> Dict:
+        connections = [c for group in self.channels.values() for c in group]
+        return {
+            "channels": len(self.channels),
+            "connections": len(connections),
+            "queued": sum(len(c.queue) for c in connections),
+            "max_queue": max((len(c.queue) for c in connections), default=0),
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -29,10 +29,26 @@ class Document(Base):
     file_path = Column(String, nullable=False)
     content = Column(Text)
     file_type = Column(String)  # pdf, md, txt
+    size_bytes = Column(Integer)
+    status = Column(String, default="ready")  # pending, processing, ready, failed (NULL on older rows = ready)
+    error = Column(Text)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    ingested_at = Column(DateTime)
+    lease_owner = Column(String)  # API process extracting the document, while status is processing
+    lease_expires_at = Column(DateTime)
     
     repository = relationship("Repository", back_populates="documents")
 
+class DocumentChunk(Base):
+    """Retrieval unit of an uploaded document, indexed for BM25 search"""
+    __tablename__ = "document_chunks"
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    repository_id = Column(Integer, ForeignKey("repositories.id"), index=True)
+    ordinal = Column(Integer)  # Position of the chunk within its document
+    text = Column(Text)
+
 class Investigation(Base):
     __tablename__ = "investigations"
     
@@ -47,10 +63,47 @@ class Investigation(Base):
     suggested_fix = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
+    error_fingerprint = Column(String, nullable=True, index=True)  # Hash of the normalized error signature
+    error_signature = Column(Text, nullable=True)  # Normalized "type|message|top frame"
+    coalesce_key = Column(String, nullable=True, index=True)  # Identity for single-flight dedup
+    coalesced_into_id = Column(Integer, ForeignKey("investigations.id"), nullable=True)  # Leader this duplicate follows
+    prior_match_id = Column(Integer, ForeignKey("investigations.id"), nullable=True)  # Similar completed investigation
+    prior_match_score = Column(Float, nullable=True)  # 1.0 = identical fingerprint, result reused
+    llm_model = Column(String, nullable=True)  # Model that produced the analysis
+    input_tokens = Column(Integer, nullable=True)  # Uncached prompt tokens
+    output_tokens = Column(Integer, nullable=True)
+    cache_read_tokens = Column(Integer, nullable=True)  # Prompt tokens served from Anthropic's prompt cache
+    cache_write_tokens = Column(Integer, nullable=True)  # Prompt tokens written to the cache
+    first_token_ms = Column(Integer, nullable=True)  # Time to first streamed token
+    routing_decision = Column(String, nullable=True)  # answered (by the triage model) or escalated
+    routing_reason = Column(String, nullable=True)  # confident, low_confidence, category, incomplete, triage_error
+    triage_category = Column(String, nullable=True)  # config, dependency, build, resource, code, unknown
+    triage_confidence = Column(Float, nullable=True)
+    priority = Column(Integer, nullable=True)  # Job queue priority it was submitted with (jobs.PRIORITY_*)
     
     repository = relationship("Repository", back_populates="investigations")
+    prior_match = relationship("Investigation", remote_side=[id], foreign_keys=[prior_match_id])
     steps = relationship("InvestigationStep", back_populates="investigation")
 
+class InvestigationJob(Base):
+    """Durable queue entry for an investigation, claimed by workers under a lease"""
+    __tablename__ = "investigation_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    investigation_id = Column(Integer, ForeignKey("investigations.id"), unique=True)
+    priority = Column(Integer, default=10)  # Lower runs first
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    available_at = Column(DateTime, default=datetime.utcnow)  # Not claimable before (retry backoff)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    investigation = relationship("Investigation")
+
 class InvestigationStep(Base):
     __tablename__ = "investigation_steps"
     
@@ -64,6 +117,52 @@ class InvestigationStep(Base):
     
     investigation = relationship("Investigation", back_populates="steps")
 
+class SearchCacheEntry(Base):
+    __tablename__ = "search_cache"
+    
+    key = Column(String, primary_key=True)  # Hash of normalized query + options
+    query = Column(Text)
+    results = Column(Text)  # JSON list of search results
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class CommitDiffCache(Base):
+    """Commit diffs keyed on repo + SHA; a SHA's diff never changes, so entries never expire"""
+    __tablename__ = "commit_diff_cache"
+    
+    key = Column(String, primary_key=True)  # owner/name@sha
+    diff = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BusEvent(Base):
+    """Event published on the SQLite event bus, read by every other API process"""
+    __tablename__ = "bus_events"
+    # Never reuse IDs: readers skip anything at or below their cursor
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    id = Column(Integer, primary_key=True)  # Readers keep a cursor on this
+    topic = Column(String, nullable=False)
+    payload = Column(Text)  # JSON
+    origin = Column(String, nullable=False)  # Publishing process
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class BusClaim(Base):
+    """Cross-process "first one wins" marker (e.g. a failed deployment already handled)"""
+    __tablename__ = "bus_claims"
+    
+    key = Column(String, primary_key=True)
+    owner = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class BusLease(Base):
+    """Named leadership lease held by one API process at a time (e.g. the Railway monitor)"""
+    __tablename__ = "bus_leases"
+    
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
 # Database setup
 engine = create_engine("sqlite:///./oncall.db", connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -77,3 +176,26 @@ def get_db():
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+def add_missing_columns():
+    """Add columns introduced after a table was first created.
+
+    create_all() only creates missing tables, so existing oncall.db files
+    get new nullable columns (and their indexes) added in place.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                if column.index:
+                    conn.execute(text(
+                        f'CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ("{column.name}")'
+                    ))
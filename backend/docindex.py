@@ -0,0 +1,175 @@
+import os
+import re
+import math
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Document, DocumentChunk
+from fingerprint import top_frame
+
+DOC_CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", "800"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "100"))
+DOC_RETRIEVAL_K = int(os.getenv("DOC_RETRIEVAL_K", "4"))
+MAX_QUERY_TERMS = 32
+
+FTS_TABLE = "document_chunks_fts"
+_TERM = re.compile(r"[a-z_][a-z0-9_]{2,}")
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "are", "was", "not", "but", "you", "your",
+    "have", "has", "had", "can", "could", "will", "would", "into", "when", "then", "than", "there",
+    "error", "failed", "railway", "deployment", "line", "file", "traceback", "most", "recent", "call", "last",
+}
+
+_fts_available = None
+
+def _has_fts(db: Session) -> bool:
+    """Create the FTS5 index if this SQLite build supports it"""
+    global _fts_available
+    if _fts_available is None:
+        try:
+            db.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(text, repository_id UNINDEXED)"
+            ))
+            db.commit()
+            _fts_available = True
+        except Exception as e:
+            print(f"SQLite FTS5 unavailable, using in-process BM25: {e}")
+            db.rollback()
+            _fts_available = False
+    return _fts_available
+
+def chunk_text(content: str, size: int = DOC_CHUNK_CHARS, overlap: int = DOC_CHUNK_OVERLAP) -> List[str]:
+    """Split text into ~size character chunks on paragraph/line boundaries, with overlap"""
+    content = (content or "").strip()
+    chunks = []
+    start = 0
+    while start < len(content):
+        end = min(start + size, len(content))
+        if end < len(content):
+            # Break at the last paragraph, line or sentence boundary in the window
+            window = content[start:end]
+            for sep in ("\n\n", "\n", ". "):
+                cut = window.rfind(sep)
+                if cut > size // 2:
+                    end = start + cut + len(sep)
+                    break
+        chunk = content[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(content):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def index_document(db: Session, doc: Document) -> int:
+    """(Re)build the chunks of one document; returns the chunk count"""
+    remove_document(db, doc.id)
+    fts = _has_fts(db)
+    chunks = chunk_text(doc.content or "")
+    for ordinal, chunk in enumerate(chunks):
+        row = DocumentChunk(document_id=doc.id, repository_id=doc.repository_id, ordinal=ordinal, text=chunk)
+        db.add(row)
+        db.flush()
+        if fts:
+            db.execute(
+                text(f"INSERT INTO {FTS_TABLE} (rowid, text, repository_id) VALUES (:id, :text, :repo)"),
+                {"id": row.id, "text": chunk, "repo": doc.repository_id}
+            )
+    db.commit()
+    return len(chunks)
+
+def remove_document(db: Session, document_id: int):
+    ids = [row.id for row in db.query(DocumentChunk.id).filter(DocumentChunk.document_id == document_id)]
+    if not ids:
+        return
+    if _has_fts(db):
+        db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({','.join(str(i) for i in ids)})"))
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete(synchronize_session=False)
+    db.commit()
+
+def backfill():
+    """Index documents uploaded before the chunk index existed"""
+    db = SessionLocal()
+    try:
+        docs = db.query(Document).outerjoin(
+            DocumentChunk, DocumentChunk.document_id == Document.id
+        ).filter(DocumentChunk.id.is_(None), Document.content.isnot(None)).all()
+        for doc in docs:
+            index_document(db, doc)
+        if docs:
+            print(f"📚 Indexed {len(docs)} existing documents")
+    finally:
+        db.close()
+
+def query_terms(error_message: str, deployment_logs: str = "") -> List[str]:
+    """Distinctive terms of an error, its stack frame and the end of its logs"""
+    tail = (deployment_logs or "")[-4000:]
+    frame = top_frame(tail + "\n" + (error_message or "")) or ""
+    terms = []
+    for term in _TERM.findall(f"{error_message}\n{frame}\n{tail}".lower()):
+        if term not in _STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+def _bm25(chunks: List[DocumentChunk], terms: List[str], k: int) -> List[tuple]:
+    """In-process BM25 for SQLite builds without FTS5"""
+    k1, b = 1.2, 0.75
+    docs = [Counter(_TERM.findall(chunk.text.lower())) for chunk in chunks]
+    if not docs:
+        return []
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1
+    df = {term: sum(1 for d in docs if term in d) for term in terms}
+    scored = []
+    for chunk, counts in zip(chunks, docs):
+        length = sum(counts.values())
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if tf:
+                idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        if score > 0:
+            scored.append((chunk.id, score))
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:k]
+
+def retrieve(repository_id: int, error_message: str, deployment_logs: str = "",
+             k: int = DOC_RETRIEVAL_K) -> List[Dict]:
+    """Top-k documentation chunks for an incident, best first"""
+    terms = query_terms(error_message, deployment_logs)
+    if not terms:
+        return []
+    db = SessionLocal()
+    try:
+        if _has_fts(db):
+            match = " OR ".join(f'"{term}"' for term in terms)
+            rows = db.execute(text(
+                f"SELECT rowid, bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH :match AND repository_id = :repo "
+                f"ORDER BY bm25({FTS_TABLE}) LIMIT :k"
+            ), {"match": match, "repo": repository_id, "k": k}).fetchall()
+            ranked = [(row[0], -row[1]) for row in rows]  # FTS5 bm25() is lower-is-better
+        else:
+            chunks = db.query(DocumentChunk).filter(DocumentChunk.repository_id == repository_id).all()
+            ranked = _bm25(chunks, terms, k)
+        if not ranked:
+            return []
+
+        by_id = {
+            chunk.id: chunk for chunk in
+            db.query(DocumentChunk).filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in ranked]))
+        }
+        filenames = dict(db.query(Document.id, Document.filename).filter(
+            Document.id.in_({chunk.document_id for chunk in by_id.values()})
+        ).all())
+        return [{
+            "document_id": by_id[chunk_id].document_id,
+            "filename": filenames.get(by_id[chunk_id].document_id, ""),
+            "text": by_id[chunk_id].text,
+            "score": round(score, 4),
+        } for chunk_id, score in ranked if chunk_id in by_id]
+    finally:
+        db.close()
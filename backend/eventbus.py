@@ -0,0 +1,245 @@
+import os
+import json
+import socket
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, text
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, BusEvent, BusClaim, BusLease
+
+# "local" for a single API process, "sqlite" when running several uvicorn workers
+EVENT_BUS = os.getenv("EVENT_BUS", "local").lower()
+EVENT_BUS_POLL_INTERVAL = float(os.getenv("EVENT_BUS_POLL_INTERVAL", "0.1"))
+EVENT_BUS_RETENTION = float(os.getenv("EVENT_BUS_RETENTION", "300"))  # Seconds events stay readable
+EVENT_BUS_LEASE_SECONDS = float(os.getenv("EVENT_BUS_LEASE_SECONDS", "90"))
+CLAIM_RETENTION_DAYS = 7
+LOCAL_CLAIM_LIMIT = 5000
+PRUNE_EVERY = 300  # Poll cycles between clean-ups
+
+# handler(payload) runs on the event loop and must not block
+EventHandler = Callable[[Dict], None]
+
+class InProcessBus:
+    """Event bus for a single API process.
+
+    publish() delivers to this process's subscribers synchronously; claims
+    and leadership are trivially held by the only process there is. The
+    multi-process backend keeps the same interface.
+    """
+    shared = False  # Whether other API processes publish on this bus
+
+    def __init__(self):
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, List[EventHandler]] = {}
+        self._claims: "OrderedDict[str, bool]" = OrderedDict()
+        self.published = 0
+        self.received = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topic: str, handler: EventHandler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, payload: Dict):
+        """Deliver an event to every subscriber of the topic (in all processes)"""
+        self.published += 1
+        self._dispatch(topic, payload)
+
+    def _dispatch(self, topic: str, payload: Dict):
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"Event bus handler error on {topic}: {e}")
+
+    def claim(self, key: str) -> bool:
+        """Return True for the first caller to claim a key, False afterwards"""
+        if key in self._claims:
+            return False
+        self._claims[key] = True
+        if len(self._claims) > LOCAL_CLAIM_LIMIT:
+            self._claims.popitem(last=False)
+        return True
+
+    def acquire_leadership(self, name: str) -> bool:
+        """Take or renew a named lease; True while this process holds it"""
+        return True
+
+    def release_leadership(self, name: str):
+        pass
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "local",
+            "origin": self.origin,
+            "published": self.published,
+            "received": self.received,
+        }
+
+class SQLiteBus(InProcessBus):
+    """Event bus shared by the API processes on one host through oncall.db.
+
+    Published events are delivered locally at once and appended to the
+    bus_events table by a background task, which also reads the events of
+    the other processes past its cursor every EVENT_BUS_POLL_INTERVAL and
+    dispatches them here. Claims are primary-key inserts and leadership is
+    a lease row taken with a conditional UPDATE, so exactly one process
+    wins either across workers.
+    """
+    shared = True
+
+    def __init__(self):
+        super().__init__()
+        self._outbox: Deque[Tuple[str, str]] = deque()
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self._cycles = 0
+        self._leases = set()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._cursor = await loop.run_in_executor(None, self._prepare)
+        self._task = asyncio.create_task(self._run())
+        print(f"📡 SQLite event bus started as {self.origin}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._exchange)
+        for name in list(self._leases):
+            self.release_leadership(name)
+
+    @staticmethod
+    def _prepare() -> int:
+        """Switch the database to WAL (readers don't block the writer) and find the newest event"""
+        db = SessionLocal()
+        try:
+            db.execute(text("PRAGMA journal_mode=WAL"))
+            return db.query(func.max(BusEvent.id)).scalar() or 0
+        finally:
+            db.close()
+
+    def publish(self, topic: str, payload: Dict):
+        super().publish(topic, payload)
+        self._outbox.append((topic, json.dumps(payload)))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(EVENT_BUS_POLL_INTERVAL)
+            try:
+                events = await loop.run_in_executor(None, self._exchange)
+            except Exception as e:
+                print(f"Event bus error: {e}")
+                continue
+            for topic, payload in events:
+                self.received += 1
+                self._dispatch(topic, payload)
+
+    def _exchange(self) -> List[Tuple[str, Dict]]:
+        """Write our pending events and read everyone else's since the cursor"""
+        batch = []
+        while self._outbox:
+            batch.append(self._outbox.popleft())
+        db = SessionLocal()
+        try:
+            if batch:
+                db.add_all([BusEvent(topic=topic, payload=payload, origin=self.origin) for topic, payload in batch])
+                db.commit()
+            rows = db.query(BusEvent).filter(BusEvent.id > self._cursor).order_by(BusEvent.id).all()
+            events = []
+            for row in rows:
+                self._cursor = row.id
+                if row.origin != self.origin:
+                    events.append((row.topic, json.loads(row.payload)))
+            self._cycles += 1
+            if self._cycles % PRUNE_EVERY == 0:
+                now = datetime.utcnow()
+                # Keep the newest row: tables created before AUTOINCREMENT would reuse its ID
+                newest = db.query(func.max(BusEvent.id)).scalar() or 0
+                db.query(BusEvent).filter(
+                    BusEvent.created_at < now - timedelta(seconds=EVENT_BUS_RETENTION),
+                    BusEvent.id < newest
+                ).delete(synchronize_session=False)
+                db.query(BusClaim).filter(
+                    BusClaim.created_at < now - timedelta(days=CLAIM_RETENTION_DAYS)
+                ).delete(synchronize_session=False)
+                db.commit()
+            return events
+        finally:
+            db.close()
+
+    def claim(self, key: str) -> bool:
+        db = SessionLocal()
+        try:
+            db.add(BusClaim(key=key, owner=self.origin))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def acquire_leadership(self, name: str) -> bool:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=EVENT_BUS_LEASE_SECONDS)
+            # Renew our own lease or take over an expired one
+            taken = db.query(BusLease).filter(
+                BusLease.name == name,
+                or_(BusLease.owner == self.origin, BusLease.expires_at < now)
+            ).update({"owner": self.origin, "expires_at": expires_at}, synchronize_session=False)
+            db.commit()
+            if not taken:
+                try:
+                    db.add(BusLease(name=name, owner=self.origin, expires_at=expires_at))
+                    db.commit()
+                    taken = True
+                except IntegrityError:
+                    db.rollback()  # Held by another process
+            if taken:
+                self._leases.add(name)
+            else:
+                self._leases.discard(name)
+            return bool(taken)
+        finally:
+            db.close()
+
+    def release_leadership(self, name: str):
+        db = SessionLocal()
+        try:
+            db.query(BusLease).filter(
+                BusLease.name == name, BusLease.owner == self.origin
+            ).update({"expires_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            self._leases.discard(name)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        return dict(super().stats(), backend="sqlite", cursor=self._cursor,
+                    outbox=len(self._outbox), leases=sorted(self._leases))
+
+def create_event_bus(kind: str = EVENT_BUS) -> InProcessBus:
+    if kind == "sqlite":
+        return SQLiteBus()
+    if kind == "local":
+        return InProcessBus()
+    raise ValueError(f"Unknown EVENT_BUS backend: {kind}")
+
+# Global bus instance
+event_bus = create_event_bus()
@@ -0,0 +1,100 @@
+import re
+import hashlib
+from typing import Dict, Optional
+
+# Only the end of a log is scanned; failures are reported last
+LOG_TAIL_BYTES = 64 * 1024
+MAX_ERROR_CHARS = 4096
+
+# Volatile tokens, masked in this order (most specific first)
+_VOLATILE = [
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:z|[+-]\d{2}:?\d{2})?", re.I), "<ts>"),
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b"), "<ts>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.I), "<uuid>"),
+    (re.compile(r"\bhttps?://[^\s'\"<>]+", re.I), "<url>"),
+    (re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"), "<email>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b0x[0-9a-f]+\b", re.I), "<hex>"),
+    (re.compile(r"\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{7,}\b", re.I), "<hex>"),
+    (re.compile(r"(?:[a-z]:)?(?:[\\/][\w.@~-]+){2,}[\\/]?", re.I), "<path>"),
+    (re.compile(r":\d{2,5}\b"), ":<port>"),
+    (re.compile(r"(?<![\w<])\d+(?:\.\d+)?"), "<n>"),  # Also "512mb", not "ipv4"
+]
+_WHITESPACE = re.compile(r"\s+")
+
+# Stack frames: Python, JS/Node, JVM, Go/Rust-style "file.ext:line"
+_PY_FRAME = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+_JS_FRAME = re.compile(r"^\s*at (?:(\S+)(?: \[as \S+\])? \()?([^\s()]+?):(\d+)(?::\d+)?\)?\s*$", re.M)
+_JVM_FRAME = re.compile(r"^\s*at ([\w$.<>]+)\(([\w$.]+):(\d+)\)", re.M)
+_FILE_LINE = re.compile(r"([\w./\\-]+\.(?:go|rs|rb|py|js|ts|java|kt|cs|cpp|c|php)):(\d+)")
+
+# Lines that state the failure itself
+_ERROR_LINE = re.compile(
+    r"(?:\b[A-Z]\w*(?:Error|Exception|Exit)\b|\berror\b|\bfatal\b|\bpanic\b|\bfailed\b|\bcannot\b|\bkilled\b|\boom\b)",
+    re.I
+)
+_ERROR_TYPE = re.compile(r"\b([A-Z]\w*(?:Error|Exception))\b")
+
+def mask_volatile(text: str) -> str:
+    """Replace timestamps, IDs, addresses, paths and numbers with placeholders"""
+    text = text.lower() if text else ""
+    for pattern, placeholder in _VOLATILE:
+        text = pattern.sub(placeholder, text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+def _basename(path: str) -> str:
+    return re.split(r"[\\/]", path)[-1]
+
+def top_frame(text: str) -> Optional[str]:
+    """Innermost application frame as "file:function" (line numbers dropped)"""
+    frames = _PY_FRAME.findall(text)
+    if frames:
+        path, _, function = frames[-1]  # Python prints innermost last
+        return f"{_basename(path)}:{function}"
+    match = _JVM_FRAME.search(text)
+    if match:
+        return f"{match.group(2)}:{match.group(1).rsplit('.', 1)[-1]}"
+    match = _JS_FRAME.search(text)
+    if match:
+        return f"{_basename(match.group(2))}:{match.group(1) or '<anonymous>'}"
+    match = _FILE_LINE.search(text)
+    if match:
+        return _basename(match.group(1))
+    return None
+
+def _error_line(text: str) -> Optional[str]:
+    """Last line that looks like the failure itself"""
+    for line in reversed(text.splitlines()):
+        if _ERROR_LINE.search(line):
+            return line.strip()
+    return None
+
+def fingerprint(error_message: str, deployment_logs: str = "") -> Dict:
+    """Canonical signature and hash identifying an error.
+
+    Returns {"signature", "hash", "error_type", "top_frame", "informative"}.
+    The error message and the tail of the logs are masked so the same
+    failure fingerprints identically across deploys, hosts and days.
+    informative is False when there is no error type, stack frame or error
+    line in the logs, i.e. only a bare status message such as "Railway
+    deployment failed"; such fingerprints don't identify a failure and must
+    not be used to merge or reuse investigations.
+    """
+    error_message = (error_message or "")[:MAX_ERROR_CHARS]
+    logs_tail = (deployment_logs or "")[-LOG_TAIL_BYTES:]
+    haystack = f"{logs_tail}\n{error_message}"
+
+    logs_error = _error_line(logs_tail)
+    error_line = logs_error or error_message
+    type_match = _ERROR_TYPE.search(error_line) or _ERROR_TYPE.search(haystack)
+    error_type = type_match.group(1) if type_match else ""
+    frame = top_frame(haystack) or ""
+
+    signature = "|".join([error_type, mask_volatile(error_line), frame])
+    return {
+        "signature": signature,
+        "hash": hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16],
+        "error_type": error_type,
+        "top_frame": frame,
+        "informative": bool(error_type or frame or logs_error),
+    }
@@ -0,0 +1,299 @@
+import os
+import re
+import uuid
+import socket
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Set, Tuple
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import or_
+from starlette.responses import JSONResponse
+
+from database import SessionLocal, Document
+import docindex
+
+UPLOAD_DIR = "uploads"
+DOC_MAX_UPLOAD_MB = float(os.getenv("DOC_MAX_UPLOAD_MB", "50"))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+INGEST_WORKERS = int(os.getenv("DOC_INGEST_WORKERS", "2"))
+INGEST_LEASE_SECONDS = int(os.getenv("DOC_INGEST_LEASE_SECONDS", "60"))
+DOC_MAX_BULK_UPLOAD_MB = float(os.getenv("DOC_MAX_BULK_UPLOAD_MB", "200"))  # Whole request of a bulk upload
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # Boundaries and part headers around a single file
+
+_UPLOAD_ROUTE = re.compile(r"^/api/repositories/\d+/documents(/bulk)?$")
+
+class UploadTooLarge(Exception):
+    pass
+
+def upload_path(repository_id: int, filename: str) -> str:
+    """A new, unique path for an upload (the client's directory components are dropped).
+
+    Each upload gets its own file, so re-uploading a filename never
+    overwrites a file an earlier Document row points to and concurrent
+    uploads never share a ".part" file.
+    """
+    name = os.path.basename(filename or "upload")
+    return os.path.join(UPLOAD_DIR, f"{repository_id}_{uuid.uuid4().hex[:12]}_{name}")
+
+async def save_upload(file: UploadFile, path: str, max_bytes: Optional[int] = None) -> int:
+    """Stream an upload to disk in chunks without holding it in memory; returns its size.
+
+    Writes go to a ".part" file that is renamed into place once complete, so
+    a document being re-ingested never sees a half-written file. Raises
+    UploadTooLarge (and removes the partial file) past max_bytes.
+    """
+    max_bytes = max_bytes or int(DOC_MAX_UPLOAD_MB * 1024 * 1024)
+    loop = asyncio.get_running_loop()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.part"
+    size = 0
+    out = await loop.run_in_executor(None, open, partial, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"{file.filename} exceeds the {DOC_MAX_UPLOAD_MB:g} MB upload limit")
+            await loop.run_in_executor(None, out.write, chunk)
+    except BaseException:
+        out.close()
+        os.remove(partial)
+        raise
+    out.close()
+    os.replace(partial, path)
+    return size
+
+def upload_request_limit(path: str) -> Optional[int]:
+    """Largest request body accepted by a document upload route, None for other routes"""
+    match = _UPLOAD_ROUTE.match(path)
+    if not match:
+        return None
+    if match.group(1):
+        return int(DOC_MAX_BULK_UPLOAD_MB * 1024 * 1024)
+    return int(DOC_MAX_UPLOAD_MB * 1024 * 1024) + MULTIPART_OVERHEAD_BYTES
+
+class UploadSizeLimit:
+    """ASGI middleware capping the body of document uploads as it is received.
+
+    The multipart parser spools the whole body before an endpoint runs, so
+    save_upload()'s check alone would only reject an oversized file after
+    receiving all of it. A declared Content-Length over the limit is
+    answered with 413 before reading anything; otherwise the body is
+    counted as it arrives and the request fails with 413 at the limit.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = upload_request_limit(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Upload exceeds the {limit / (1024 * 1024):g} MB request limit"
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def extract_text(file_path: str, file_type: str) -> str:
+    """Text content of a stored upload (runs in a worker process)"""
+    if file_type == "pdf":
+        import PyPDF2
+        pdf_reader = PyPDF2.PdfReader(file_path)
+        return "\n".join([page.extract_text() or "" for page in pdf_reader.pages])
+    if file_type in ("md", "txt"):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    return ""
+
+class DocumentIngestor:
+    """Background text extraction and indexing of uploaded documents.
+
+    Extraction (PyPDF2 is pure Python and CPU bound) runs in a process pool
+    so large manuals never stall the event loop; the database work runs in
+    the default thread pool. Progress is tracked in Document.status, and
+    documents left pending by a restart are picked up again by resume().
+
+    A document is extracted under a lease renewed while it runs, like
+    investigation jobs: with several API processes, resume() in one of
+    them waits for documents another is still processing and only takes
+    over those whose lease expired.
+    """
+    def __init__(self, num_workers: int = INGEST_WORKERS):
+        self.num_workers = max(1, num_workers)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.num_workers)
+        return self._pool
+
+    def submit(self, document_id: int):
+        """Schedule ingestion of a document (call from the running event loop)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.num_workers)
+        task = asyncio.create_task(self._ingest(document_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def resume(self) -> int:
+        """Re-submit documents whose ingestion was interrupted (or is running in another process)"""
+        db = SessionLocal()
+        try:
+            ids = [row.id for row in db.query(Document.id).filter(Document.status.in_(["pending", "processing"]))]
+        finally:
+            db.close()
+        for document_id in ids:
+            self.submit(document_id)
+        if ids:
+            print(f"📄 Resuming ingestion of {len(ids)} documents")
+        return len(ids)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _ingest(self, document_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._semaphore:
+                doc, waiting = await loop.run_in_executor(None, self._claim, document_id)
+                if doc is not None:
+                    await self._extract(document_id, *doc)
+                    return
+            if not waiting:
+                return
+            # Leased by another process: take over only if its lease runs out
+            await asyncio.sleep(INGEST_LEASE_SECONDS / 3)
+
+    async def _extract(self, document_id: int, file_path: str, file_type: str):
+        loop = asyncio.get_running_loop()
+        heartbeat = asyncio.create_task(self._keep_lease(document_id))
+        try:
+            content = await loop.run_in_executor(self._get_pool(), extract_text, file_path, file_type)
+            chunks = await loop.run_in_executor(None, self._store, document_id, content)
+            print(f"📄 Ingested document {document_id} ({len(content)} chars, {chunks} chunks)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Document ingestion error for {document_id}: {e}")
+            await loop.run_in_executor(None, self._set_status, document_id, "failed", str(e) or e.__class__.__name__)
+        finally:
+            heartbeat.cancel()
+
+    def _claim(self, document_id: int) -> Tuple[Optional[Tuple[str, str]], bool]:
+        """Lease a pending document, or one whose lease expired.
+
+        Returns ((file_path, file_type), False) when claimed, and (None,
+        True) while another process holds a live lease on it.
+        """
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            # Conditional update: only one process (and task) wins the document
+            claimed = db.query(Document).filter(
+                Document.id == document_id,
+                or_(
+                    Document.status == "pending",
+                    (Document.status == "processing") & or_(
+                        Document.lease_expires_at.is_(None), Document.lease_expires_at < now
+                    )
+                )
+            ).update({
+                "status": "processing",
+                "error": None,
+                "lease_owner": self.owner,
+                "lease_expires_at": now + timedelta(seconds=INGEST_LEASE_SECONDS),
+            }, synchronize_session=False)
+            db.commit()
+            doc = db.query(Document).filter(Document.id == document_id).first()
+            if claimed:
+                return (doc.file_path, doc.file_type), False
+            return None, bool(doc) and doc.status == "processing"
+        finally:
+            db.close()
+
+    def _renew_lease(self, document_id: int):
+        db = SessionLocal()
+        try:
+            db.query(Document).filter(
+                Document.id == document_id,
+                Document.lease_owner == self.owner
+            ).update({
+                "lease_expires_at": datetime.utcnow() + timedelta(seconds=INGEST_LEASE_SECONDS)
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _keep_lease(self, document_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(INGEST_LEASE_SECONDS / 3)
+            await loop.run_in_executor(None, self._renew_lease, document_id)
+
+    @staticmethod
+    def _set_status(document_id: int, status: str, error: Optional[str]):
+        db = SessionLocal()
+        try:
+            doc = db.query(Document).filter(Document.id == document_id).first()
+            if doc is None:
+                return None
+            doc.status = status
+            doc.error = error
+            doc.lease_owner = doc.lease_expires_at = None
+            db.commit()
+            return doc.file_path, doc.file_type
+        finally:
+            db.close()
+
+    @staticmethod
+    def _store(document_id: int, content: str) -> int:
+        db = SessionLocal()
+        try:
+            doc = db.query(Document).filter(Document.id == document_id).first()
+            if doc is None:
+                return 0
+            doc.content = content
+            db.commit()
+            chunks = docindex.index_document(db, doc)
+            doc.status = "ready"
+            doc.error = None
+            doc.lease_owner = doc.lease_expires_at = None
+            doc.ingested_at = datetime.utcnow()
+            db.commit()
+            return chunks
+        finally:
+            db.close()
+
+# Global ingestor instance
+document_ingestor = DocumentIngestor()
@@ -1,17 +1,153 @@
 import os
-from typing import Optional, List, Dict
+import re
+import json
+import threading
+import requests
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
 from github import Github
 
+from database import SessionLocal, CommitDiffCache
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+GITHUB_HTTP_TIMEOUT = float(os.getenv("GITHUB_HTTP_TIMEOUT", "15"))
+DIFF_MEMORY_ENTRIES = int(os.getenv("GITHUB_DIFF_MEMORY_ENTRIES", "128"))
+CONTEXT_DIFF_BUDGET = int(os.getenv("GITHUB_CONTEXT_DIFF_BUDGET", "20000"))
+
+CONTEXT_QUERY = """
+query($owner: String!, $name: String!, $limit: Int!, $sha: String!, $hasSha: Boolean!, $withHistory: Boolean!) {
+    repository(owner: $owner, name: $name) {
+        defaultBranchRef @include(if: $withHistory) {
+            target {
+                ... on Commit {
+                    history(first: $limit) {
+                        nodes { oid message committedDate url author { name } }
+                    }
+                }
+            }
+        }
+        object(expression: $sha) @include(if: $hasSha) {
+            ... on Commit { oid message committedDate url author { name } additions deletions }
+        }
+    }
+}
+"""
+
+# Files whose diffs rarely explain a failure
+_NOISE_FILES = re.compile(
+    r"(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Pipfile\.lock|Cargo\.lock|go\.sum|composer\.lock)$"
+    r"|(^|/)(dist|build|vendor|node_modules|__snapshots__)/|\.min\.(js|css)$|\.map$",
+    re.I
+)
+# Files that commonly break deployments
+_DEPLOY_FILES = re.compile(
+    r"(^|/)(Dockerfile|Procfile|railway\.(json|toml)|nixpacks\.toml|package\.json|requirements[\w-]*\.txt|"
+    r"pyproject\.toml|go\.mod|Gemfile|\.env\.example|docker-compose\.ya?ml)$",
+    re.I
+)
+
+def rank_changed_files(files: List[Dict], error_text: str) -> List[Dict]:
+    """Order a commit's changed files by how likely they explain the error"""
+    error_text = (error_text or "").lower()
+
+    def score(f: Dict) -> float:
+        path = f.get("filename", "")
+        base = path.rsplit("/", 1)[-1].lower()
+        stem = base.rsplit(".", 1)[0]
+        value = 0.0
+        if base and base in error_text:
+            value += 10
+        elif len(stem) > 2 and stem in error_text:
+            value += 5
+        if _DEPLOY_FILES.search(path):
+            value += 3
+        if _NOISE_FILES.search(path):
+            value -= 10
+        if not f.get("patch"):
+            value -= 5  # Binary or too large for GitHub to inline
+        # Prefer focused changes among otherwise equal files
+        value -= min(f.get("changes", 0), 500) / 500
+        return value
+
+    return sorted(files, key=score, reverse=True)
+
+# Full or abbreviated commit SHAs are immutable; branch names and tags are not
+_SHA = re.compile(r"[0-9a-f]{7,40}", re.I)
+
+class DiffCache:
+    """Content-addressed commit diff cache: in-memory LRU over a SQLite table"""
+    def __init__(self, memory_entries: int = DIFF_MEMORY_ENTRIES):
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        db = SessionLocal()
+        try:
+            entry = db.query(CommitDiffCache).filter(CommitDiffCache.key == key).first()
+            diff = entry.diff if entry else None
+        except Exception as e:
+            print(f"Diff cache read error: {e}")
+            diff = None
+        finally:
+            db.close()
+        if diff is not None:
+            self._remember(key, diff)
+        return diff
+
+    def put(self, key: str, diff: str):
+        self._remember(key, diff)
+        db = SessionLocal()
+        try:
+            db.merge(CommitDiffCache(key=key, diff=diff))
+            db.commit()
+        except Exception as e:
+            print(f"Diff cache write error: {e}")
+        finally:
+            db.close()
+
+    def _remember(self, key: str, diff: str):
+        with self._lock:
+            self._memory[key] = diff
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
 class GitHubClient:
     def __init__(self, access_token: Optional[str] = None):
         self.access_token = access_token or os.getenv("GITHUB_ACCESS_TOKEN")
         if not self.access_token:
             raise ValueError("GitHub access token not found")
         self.github = Github(self.access_token)
+        # Keep-alive session for the REST calls made outside PyGithub
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.access_token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        })
+        self._repos: Dict[str, object] = {}
+        self.diff_cache = DiffCache()
+        # full name -> (ETag, head SHA) of the default branch, and the history read at that head
+        self._heads: Dict[str, Tuple[str, str]] = {}
+        self._history: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
     
     def get_repo(self, owner: str, name: str):
-        """Get repository by owner and name"""
-        return self.github.get_repo(f"{owner}/{name}")
+        """Get repository by owner and name (cached, lazily loaded handle)"""
+        full_name = f"{owner}/{name}"
+        with self._lock:
+            repo = self._repos.get(full_name)
+            if repo is None:
+                # lazy=True skips the metadata round-trip until an attribute is needed
+                repo = self.github.get_repo(full_name, lazy=True)
+                self._repos[full_name] = repo
+        return repo
     
     def get_recent_commits(self, owner: str, name: str, limit: int = 5) -> List[Dict]:
         """Get recent commits from the repository"""
@@ -31,15 +167,171 @@ class GitHubClient:
             return []
     
     def get_commit_diff(self, owner: str, name: str, sha: str) -> str:
-        """Get diff for a specific commit"""
+        """Get diff for a specific commit (cached permanently per SHA)"""
+        cacheable = bool(_SHA.fullmatch(sha or ""))
+        key = f"{owner}/{name}@{sha.lower()}"
+        if cacheable:
+            cached = self.diff_cache.get(key)
+            if cached is not None:
+                return cached
         try:
-            repo = self.get_repo(owner, name)
-            commit = repo.get_commit(sha)
-            return commit.patch or ""
+            response = self.session.get(
+                f"{GITHUB_API_URL}/repos/{owner}/{name}/commits/{sha}",
+                headers={"Accept": "application/vnd.github.diff"},
+                timeout=GITHUB_HTTP_TIMEOUT
+            )
+            response.raise_for_status()
+            diff = response.text
+            if cacheable:
+                self.diff_cache.put(key, diff)
+            return diff
         except Exception as e:
             print(f"Error fetching commit diff: {e}")
             return ""
     
+    def get_default_branch_head(self, owner: str, name: str) -> Optional[str]:
+        """SHA at the tip of the default branch, revalidated with If-None-Match.
+
+        An unchanged head answers 304 Not Modified, which doesn't count
+        against the rate limit.
+        """
+        full_name = f"{owner}/{name}"
+        try:
+            branch = self.get_repo(owner, name).default_branch
+            with self._lock:
+                etag, head = self._heads.get(full_name, (None, None))
+            headers = {"Accept": "application/vnd.github.sha"}
+            if etag:
+                headers["If-None-Match"] = etag
+            response = self.session.get(
+                f"{GITHUB_API_URL}/repos/{owner}/{name}/commits/{branch}",
+                headers=headers,
+                timeout=GITHUB_HTTP_TIMEOUT
+            )
+            if response.status_code == 304 and head:
+                return head
+            response.raise_for_status()
+            head = response.text.strip()
+            if response.headers.get("ETag"):
+                with self._lock:
+                    self._heads[full_name] = (response.headers["ETag"], head)
+            return head
+        except Exception as e:
+            print(f"Error fetching default branch head: {e}")
+            return None
+    
+    def _cached_history(self, full_name: str, head: Optional[str], limit: int) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._history.get(full_name)
+        if head and entry and entry["head"] == head and entry["limit"] >= limit:
+            return entry["commits"][:limit]
+        return None
+    
+    def _graphql(self, query: str, variables: Dict) -> Optional[Dict]:
+        response = self.session.post(
+            GITHUB_GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            timeout=GITHUB_HTTP_TIMEOUT
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data.get("errors"):
+            print(f"GitHub GraphQL errors: {data['errors']}")
+        return data.get("data")
+    
+    def _get_commit_files(self, owner: str, name: str, sha: str) -> List[Dict]:
+        """Changed files (with inline patches) of a commit, cached permanently per SHA"""
+        cacheable = bool(_SHA.fullmatch(sha))
+        key = f"{owner}/{name}@{sha.lower()}:files"
+        if cacheable:
+            cached = self.diff_cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        response = self.session.get(
+            f"{GITHUB_API_URL}/repos/{owner}/{name}/commits/{sha}",
+            timeout=GITHUB_HTTP_TIMEOUT
+        )
+        response.raise_for_status()
+        files = [{
+            "filename": f.get("filename", ""),
+            "status": f.get("status", ""),
+            "changes": f.get("changes", 0),
+            "patch": f.get("patch", "")
+        } for f in response.json().get("files", [])]
+        if cacheable:
+            self.diff_cache.put(key, json.dumps(files))
+        return files
+    
+    def get_investigation_context(self, owner: str, name: str, sha: str = "", error_text: str = "",
+                                  limit: int = 5, diff_budget: int = CONTEXT_DIFF_BUDGET) -> Dict:
+        """Recent commits, target commit metadata and relevant patches in one or two round-trips.
+
+        A single GraphQL query returns the recent history and the target
+        commit; its changed files come from one REST call (GraphQL doesn't
+        expose them). The history is kept per default-branch head and reused
+        while a conditional request finds the head unchanged. Patches are
+        included only for the files most likely to explain the error, up to
+        diff_budget characters.
+        """
+        context = {"recent_commits": [], "target_commit": None, "changed_files": [], "commit_diff": "", "diff_parts": []}
+        full_name = f"{owner}/{name}"
+        head = self.get_default_branch_head(owner, name)
+        cached = self._cached_history(full_name, head, limit)
+        try:
+            data = {}
+            if cached is None or sha:
+                data = self._graphql(CONTEXT_QUERY, {
+                    "owner": owner, "name": name, "limit": limit, "sha": sha or "HEAD", "hasSha": bool(sha),
+                    "withHistory": cached is None
+                }) or {}
+            repository = data.get("repository") or {}
+            if cached is None:
+                history = (((repository.get("defaultBranchRef") or {}).get("target") or {}).get("history") or {})
+                cached = [{
+                    "sha": node["oid"],
+                    "message": node.get("message", ""),
+                    "author": (node.get("author") or {}).get("name", ""),
+                    "date": node.get("committedDate", ""),
+                    "url": node.get("url", "")
+                } for node in history.get("nodes", [])]
+                if head and cached and cached[0]["sha"] == head:
+                    with self._lock:
+                        self._history[full_name] = {"head": head, "limit": limit, "commits": cached}
+            context["recent_commits"] = cached
+            target = repository.get("object")
+            if target:
+                context["target_commit"] = {
+                    "sha": target["oid"],
+                    "message": target.get("message", ""),
+                    "author": (target.get("author") or {}).get("name", ""),
+                    "additions": target.get("additions", 0),
+                    "deletions": target.get("deletions", 0)
+                }
+        except Exception as e:
+            print(f"Error fetching GitHub context: {e}")
+        
+        if not sha:
+            return context
+        try:
+            files = rank_changed_files(self._get_commit_files(owner, name, sha), error_text)
+            context["changed_files"] = [f["filename"] for f in files]
+            parts, used = [], 0
+            for f in files:
+                if not f["patch"]:
+                    continue
+                part = f"diff --git a/{f['filename']} b/{f['filename']}\n{f['patch']}\n"
+                if used + len(part) > diff_budget:
+                    if parts:
+                        continue
+                    part = part[:diff_budget]  # Always show the top file, truncated if needed
+                parts.append(part)
+                used += len(part)
+            context["diff_parts"] = parts  # One patch per file, most relevant first
+            context["commit_diff"] = "".join(parts)
+        except Exception as e:
+            print(f"Error fetching commit files: {e}")
+        return context
+    
     def get_file_content(self, owner: str, name: str, path: str) -> Optional[str]:
         """Get content of a file"""
         try:
@@ -56,7 +348,6 @@ class GitHubClient:
     def search_code(self, owner: str, name: str, query: str, limit: int = 5) -> List[Dict]:
         """Search code in the repository"""
         try:
-            repo = self.get_repo(owner, name)
             results = self.github.search_code(f"{query} repo:{owner}/{name}")[:limit]
             
             return [{
@@ -68,9 +359,16 @@ class GitHubClient:
             print(f"Error searching code: {e}")
             return []
 
+# Process-wide clients, one per access token
+_clients: Dict[str, GitHubClient] = {}
+_clients_lock = threading.Lock()
+
 # For demo purposes, we'll handle None access token
 def get_github_client(access_token: Optional[str] = None) -> Optional[GitHubClient]:
-    try:
-        return GitHubClient(access_token)
-    except ValueError:
+    token = access_token or os.getenv("GITHUB_ACCESS_TOKEN")
+    if not token:
         return None
+    with _clients_lock:
+        if token not in _clients:
+            _clients[token] = GitHubClient(token)
+        return _clients[token]
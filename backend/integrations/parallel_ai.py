@@ -1,61 +1,160 @@
 import os
+import asyncio
 import requests
+import httpx
 from typing import Optional, List, Dict
+from urllib.parse import urlsplit, urlunsplit
+from search_cache import SearchCache, search_cache
 
 PARALLEL_API_KEY = os.getenv("PARALLEL_AI_API_KEY")
 PARALLEL_API_URL = "https://api.parallel.ai/v1/search"
+PARALLEL_HTTP_TIMEOUT = float(os.getenv("PARALLEL_HTTP_TIMEOUT", "30"))
+PARALLEL_SEARCH_CONCURRENCY = int(os.getenv("PARALLEL_SEARCH_CONCURRENCY", "4"))
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a result URL for de-duplication"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+def merge_results(result_lists: List[List[Dict]]) -> List[Dict]:
+    """Merge per-query results, dropping duplicate URLs.
+
+    Results found by more queries rank first, then by their best position
+    in any single query.
+    """
+    merged: Dict[str, Dict] = {}
+    scores: Dict[str, List[int]] = {}  # url -> [hits, best rank]
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            key = normalize_url(result.get("url", "")) or f"untitled:{result.get('title', '')}"
+            if key not in merged:
+                merged[key] = dict(result)
+                scores[key] = [0, rank]
+            else:
+                # Keep the richest snippet/content seen for this URL
+                for field in ("snippet", "content"):
+                    if len(result.get(field) or "") > len(merged[key].get(field) or ""):
+                        merged[key][field] = result[field]
+            scores[key][0] += 1
+            scores[key][1] = min(scores[key][1], rank)
+    ordered = sorted(merged, key=lambda k: (-scores[k][0], scores[k][1]))
+    return [merged[k] for k in ordered]
 
 class ParallelAIClient:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, cache: Optional[SearchCache] = search_cache):
         self.api_key = api_key or PARALLEL_API_KEY
+        self.cache = cache
         if not self.api_key:
             raise ValueError("Parallel AI API key not found")
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-    
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Persistent keep-alive session for async searches"""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=PARALLEL_HTTP_TIMEOUT,
+                limits=httpx.Limits(max_keepalive_connections=PARALLEL_SEARCH_CONCURRENCY * 2)
+            )
+        return self._async_client
+
+    async def aclose(self):
+        """Close the async session"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    @staticmethod
+    def _format_results(data: Dict) -> List[Dict]:
+        results = data.get("results", [])
+        return [{
+            "title": r.get("title", ""),
+            "url": r.get("url", ""),
+            "snippet": r.get("snippet", ""),
+            "content": r.get("content", "")
+        } for r in results]
+
     def search(self, query: str, max_results: int = 5) -> List[Dict]:
         """
         Search the web using Parallel AI
         """
+        if self.cache:
+            cached = self.cache.get(query, max_results)
+            if cached is not None:
+                return cached
         try:
             payload = {
                 "query": query,
                 "max_results": max_results
             }
-            
+
             response = requests.post(
                 PARALLEL_API_URL,
                 json=payload,
                 headers=self.headers,
-                timeout=30
+                timeout=PARALLEL_HTTP_TIMEOUT
             )
             response.raise_for_status()
-            
-            data = response.json()
-            results = data.get("results", [])
-            
-            return [{
-                "title": r.get("title", ""),
-                "url": r.get("url", ""),
-                "snippet": r.get("snippet", ""),
-                "content": r.get("content", "")
-            } for r in results]
-            
+
+            results = self._format_results(response.json())
+            if self.cache:
+                self.cache.put(query, max_results, results)
+            return results
+
         except Exception as e:
             print(f"Parallel AI search error: {e}")
             return []
-    
+
+    async def search_async(self, query: str, max_results: int = 5) -> List[Dict]:
+        """
+        Search the web using Parallel AI without blocking the event loop
+        """
+        if self.cache:
+            cached = await self.cache.get_async(query, max_results)
+            if cached is not None:
+                return cached
+        try:
+            response = await self._get_async_client().post(
+                PARALLEL_API_URL,
+                json={"query": query, "max_results": max_results}
+            )
+            response.raise_for_status()
+            results = self._format_results(response.json())
+            if self.cache:
+                await self.cache.put_async(query, max_results, results)
+            return results
+
+        except Exception as e:
+            print(f"Parallel AI search error: {e}")
+            return []
+
     def search_multiple(self, queries: List[str]) -> List[Dict]:
         """
-        Execute multiple searches and return combined results
+        Execute multiple searches and return combined, de-duplicated results
+        """
+        return merge_results([self.search(query) for query in queries])
+
+    async def search_multiple_async(self, queries: List[str], max_results: int = 5,
+                                    concurrency: int = PARALLEL_SEARCH_CONCURRENCY) -> List[Dict]:
         """
-        all_results = []
-        for query in queries:
-            results = self.search(query)
-            all_results.extend(results)
-        return all_results
+        Execute searches concurrently and return combined, de-duplicated results
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(query: str) -> List[Dict]:
+            async with semaphore:
+                return await self.search_async(query, max_results)
+
+        unique_queries = list(dict.fromkeys(q.strip() for q in queries if q.strip()))
+        return merge_results(await asyncio.gather(*[run(q) for q in unique_queries]))
 
 # Global client instance
 parallel_client = ParallelAIClient() if PARALLEL_API_KEY else None
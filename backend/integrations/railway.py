@@ -1,10 +1,66 @@
 import os
-import requests
-from typing import Optional, Dict
+import asyncio
+import httpx
+from typing import Optional, Dict, List
 import time
 
 RAILWAY_API_KEY = os.getenv("RAILWAY_API_KEY")
 RAILWAY_API_URL = "https://backboard.railway.com/graphql/v2"
+RAILWAY_HTTP_TIMEOUT = float(os.getenv("RAILWAY_HTTP_TIMEOUT", "30"))
+RAILWAY_MAX_CONNECTIONS = int(os.getenv("RAILWAY_MAX_CONNECTIONS", "20"))
+RAILWAY_PROJECT_CACHE_TTL = int(os.getenv("RAILWAY_PROJECT_CACHE_TTL", "600"))
+RAILWAY_PROJECT_MISS_REFRESH_INTERVAL = int(os.getenv("RAILWAY_PROJECT_MISS_REFRESH_INTERVAL", "60"))
+RAILWAY_DEPLOYMENTS_PER_SERVICE = int(os.getenv("RAILWAY_DEPLOYMENTS_PER_SERVICE", "1"))
+RAILWAY_STATUS_BATCH_SIZE = int(os.getenv("RAILWAY_STATUS_BATCH_SIZE", "25"))
+RAILWAY_RATE_LIMIT_BACKOFF = float(os.getenv("RAILWAY_RATE_LIMIT_BACKOFF", "60"))
+
+PROJECTS_QUERY = """
+query {
+    projects {
+        edges {
+            node {
+                id
+                name
+            }
+        }
+    }
+}
+"""
+
+class ProjectDirectory:
+    """Name -> project index built from one projects query.
+
+    Refreshed when older than the TTL, or on a lookup miss. Refresh attempts
+    are spaced by the miss interval so a misconfigured project name or a
+    Railway outage can't trigger a full listing on every lookup.
+    """
+    def __init__(self, ttl: int = RAILWAY_PROJECT_CACHE_TTL,
+                 miss_refresh_interval: int = RAILWAY_PROJECT_MISS_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self.projects_by_name: Dict[str, Dict] = {}
+        self.loaded_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+        self.refresh_count = 0
+
+    def load(self, nodes: List[Dict]):
+        self.projects_by_name = {node["name"]: node for node in nodes}
+        self.loaded_at = time.monotonic()
+        self.refresh_count += 1
+
+    def needs_refresh(self, name: Optional[str] = None) -> bool:
+        now = time.monotonic()
+        if self.attempted_at is not None and now - self.attempted_at < self.miss_refresh_interval:
+            return False
+        if self.loaded_at is None or now - self.loaded_at > self.ttl:
+            return True
+        return name is not None and name not in self.projects_by_name
+
+    def get(self, name: str) -> Optional[Dict]:
+        return self.projects_by_name.get(name)
+
+    def names(self) -> List[str]:
+        return list(self.projects_by_name)
 
 class RailwayClient:
     def __init__(self, api_key: Optional[str] = None):
@@ -16,194 +72,201 @@ class RailwayClient:
             }
         else:
             self.headers = None
-    
-    def get_project_by_name(self, project_name: str) -> Optional[Dict]:
-        """Get Railway project by name"""
-        if not self.api_key:
-            return None
-            
-        try:
-            # First, get all projects
-            query = """
-            query {
-                projects {
-                    edges {
-                        node {
-                            id
-                            name
-                        }
-                    }
-                }
-            }
-            """
-            
-            response = requests.post(
-                RAILWAY_API_URL,
-                json={"query": query},
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self.rate_limited_until = 0.0  # time.monotonic() deadline from the last 429
+        self.project_directory = ProjectDirectory()
+        self._directory_lock = asyncio.Lock()
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Shared keep-alive connection pool for async requests"""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
                 headers=self.headers,
-                timeout=30
+                timeout=RAILWAY_HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=RAILWAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=RAILWAY_MAX_CONNECTIONS
+                )
             )
-            
-            # Debug response
-            if response.status_code != 200:
-                print(f"❌ Railway API HTTP error: {response.status_code}")
-                print(f"Response: {response.text[:500]}")
-                try:
-                    error_data = response.json()
-                    print(f"Error details: {error_data}")
-                except:
-                    pass
-                return None
-                
-            data = response.json()
-            
-            # Check for errors
-            if "errors" in data:
-                print(f"Railway API GraphQL errors: {data['errors']}")
+        return self._async_client
+
+    async def aclose(self):
+        """Close the async connection pool"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _note_rate_limit(self, status_code: int, headers) -> None:
+        """Remember how long Railway asked us to back off"""
+        if status_code != 429:
+            return
+        try:
+            retry_after = float(headers.get("Retry-After", RAILWAY_RATE_LIMIT_BACKOFF))
+        except ValueError:
+            retry_after = RAILWAY_RATE_LIMIT_BACKOFF
+        self.rate_limited_until = max(self.rate_limited_until, time.monotonic() + retry_after)
+        print(f"⏳ Railway rate limited, backing off {retry_after:.0f}s")
+
+    def _parse_response(self, status_code: int, text: str, data_fn, label: str,
+                        allow_partial: bool = False) -> Optional[Dict]:
+        """Check HTTP and GraphQL errors, returning the `data` payload.
+
+        With allow_partial, GraphQL errors are logged but whatever data came
+        back is still returned (one bad alias shouldn't sink a whole batch).
+        """
+        if status_code != 200:
+            print(f"❌ Railway {label} HTTP error: {status_code}")
+            print(f"Response: {text[:500]}")
+            return None
+
+        data = data_fn()
+
+        if "errors" in data:
+            print(f"❌ Railway {label} GraphQL errors: {data['errors']}")
+            if not allow_partial or not data.get("data"):
                 return None
-            
-            # Debug: print available projects
-            print(f"Debug: Railway API response keys: {data.keys()}")
-            
-            # Find project by name
-            edges = data.get("data", {}).get("projects", {}).get("edges", [])
-            print(f"DEBUG: Found {len(edges)} projects")
-            for edge in edges:
-                print(f"DEBUG: Project: {edge['node']['name']} (ID: {edge['node']['id']})")
-                if edge["node"]["name"] == project_name:
-                    print(f"✅ Found project '{project_name}' with ID: {edge['node']['id']}")
-                    return edge["node"]
-            
-            print(f"⚠️  Railway project '{project_name}' not found")
-            print(f"Available projects: {[e['node']['name'] for e in edges]}")
+
+        return data.get("data") or {}
+
+    async def _post_async(self, query: str, label: str, variables: Optional[Dict] = None,
+                          allow_partial: bool = False) -> Optional[Dict]:
+        """Run a GraphQL query on the shared async connection pool"""
+        response = await self._get_async_client().post(
+            RAILWAY_API_URL,
+            json={"query": query, "variables": variables or {}}
+        )
+        self._note_rate_limit(response.status_code, response.headers)
+        return self._parse_response(response.status_code, response.text, response.json, label, allow_partial)
+
+    @staticmethod
+    def _project_nodes(data: Optional[Dict]) -> Optional[list]:
+        if data is None:
             return None
-            
+        edges = data.get("projects", {}).get("edges", [])
+        return [edge["node"] for edge in edges]
+
+    async def refresh_projects_async(self) -> bool:
+        """Rebuild the project directory without blocking the event loop"""
+        self.project_directory.attempted_at = time.monotonic()
+        try:
+            nodes = self._project_nodes(await self._post_async(PROJECTS_QUERY, "projects"))
         except Exception as e:
             print(f"Railway API error: {e}")
+            return False
+        if nodes is None:
+            return False
+        self.project_directory.load(nodes)
+        return True
+
+    async def get_project_by_name_async(self, project_name: str) -> Optional[Dict]:
+        """Get Railway project by name without blocking the event loop"""
+        if not self.api_key:
             return None
-    
-    def list_all_projects(self) -> list:
-        """List all Railway projects for debugging"""
+
+        # Concurrent pollers wait on one refresh instead of each listing projects
+        async with self._directory_lock:
+            if self.project_directory.needs_refresh(project_name):
+                await self.refresh_projects_async()
+        return self.project_directory.get(project_name)
+
+    async def list_all_projects_async(self) -> list:
+        """List all Railway projects from the directory without blocking the event loop"""
         if not self.api_key:
             return []
-            
-        try:
-            query = """
-            query {
-                projects {
-                    edges {
-                        node {
+
+        async with self._directory_lock:
+            if self.project_directory.needs_refresh():
+                await self.refresh_projects_async()
+        return self.project_directory.names()
+
+    @staticmethod
+    def _deployment_query(project_ids: List[str], per_service: int) -> str:
+        """One aliased document fetching the latest deployments of every project"""
+        variables = ", ".join(f"$p{i}: String!" for i in range(len(project_ids)))
+        selections = "\n".join(f"""
+            p{i}: project(id: $p{i}) {{
+                services {{
+                    edges {{
+                        node {{
                             id
                             name
-                        }
-                    }
-                }
-            }
-            """
-            
-            response = requests.post(
-                RAILWAY_API_URL,
-                json={"query": query},
-                headers=self.headers,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f"Railway list_all_projects HTTP error: {response.status_code}")
-                print(f"Response: {response.text}")
-                return []
-                
-            data = response.json()
-            
-            if "errors" in data:
-                print(f"Railway GraphQL errors: {data['errors']}")
-                return []
-            
-            edges = data.get("data", {}).get("projects", {}).get("edges", [])
-            return [edge["node"]["name"] for edge in edges]
-            
-        except Exception as e:
-            print(f"Railway API error: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
-    
-    def get_deployment_status(self, project_id: str) -> Optional[Dict]:
-        """Get latest deployment status for a project"""
-        if not self.api_key:
-            return None
-            
-        try:
-            query = f"""
-            query {{
-                project(id: "{project_id}") {{
-                    services {{
-                        edges {{
-                            node {{
-                                id
-                                name
-                                deployments {{
-                                    edges {{
-                                        node {{
-                                            id
-                                            status
-                                            createdAt
-                                        }}
+                            deployments(first: {per_service}) {{
+                                edges {{
+                                    node {{
+                                        id
+                                        status
+                                        createdAt
+                                        meta
                                     }}
                                 }}
                             }}
                         }}
                     }}
                 }}
-            }}
-            """
-            
-            response = requests.post(
-                RAILWAY_API_URL,
-                json={"query": query},
-                headers=self.headers,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f"❌ Get deployments HTTP error: {response.status_code}")
-                print(f"Response: {response.text[:500]}")
-                return None
-                
-            data = response.json()
-            
-            if "errors" in data:
-                print(f"❌ Railway GraphQL deployment errors: {data['errors']}")
-                return None
-            
-            # Get deployments from all services
-            services = data.get("data", {}).get("project", {}).get("services", {}).get("edges", [])
-            all_deployments = []
-            
-            for service_edge in services:
-                service = service_edge["node"]
-                deployments = service.get("deployments", {}).get("edges", [])
-                for deployment_edge in deployments:
-                    deployment = deployment_edge["node"]
-                    deployment["service_name"] = service.get("name")
-                    deployment["service_id"] = service.get("id")
-                    all_deployments.append(deployment)
-            
-            # Sort by creation date (newest first)
-            all_deployments.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-            
-            print(f"DEBUG: Found {len(all_deployments)} total deployments across all services")
-            if all_deployments:
-                latest = all_deployments[0]
-                print(f"DEBUG: Latest deployment - Status: {latest.get('status')}, ID: {latest.get('id')}, Service: {latest.get('service_name')}")
-                return latest
-            return None
-            
-        except Exception as e:
-            print(f"Railway API error: {e}")
-            import traceback
-            traceback.print_exc()
+            }}""" for i in range(len(project_ids)))
+        return f"query ({variables}) {{{selections}\n}}"
+
+    @staticmethod
+    def _latest_deployment(project: Optional[Dict]) -> Optional[Dict]:
+        if not project:
             return None
 
+        # Newest deployment across all services
+        latest = None
+        for service_edge in project.get("services", {}).get("edges", []):
+            service = service_edge["node"]
+            for deployment_edge in service.get("deployments", {}).get("edges", []):
+                deployment = deployment_edge["node"]
+                if latest is None or deployment.get("createdAt", "") > latest.get("createdAt", ""):
+                    latest = dict(deployment, service_name=service.get("name"), service_id=service.get("id"))
+        return latest
+
+    def _batch_results(self, project_ids: List[str], data: Optional[Dict]) -> Dict[str, Optional[Dict]]:
+        if data is None:
+            return {}
+        return {
+            project_id: self._latest_deployment(data.get(f"p{i}"))
+            for i, project_id in enumerate(project_ids)
+        }
+
+    @staticmethod
+    def _batches(project_ids: List[str]) -> List[List[str]]:
+        unique_ids = list(dict.fromkeys(project_ids))
+        return [unique_ids[i:i + RAILWAY_STATUS_BATCH_SIZE]
+                for i in range(0, len(unique_ids), RAILWAY_STATUS_BATCH_SIZE)]
+
+    async def get_deployment_statuses_async(self, project_ids: List[str],
+                                            per_service: int = RAILWAY_DEPLOYMENTS_PER_SERVICE,
+                                            concurrency: int = 4) -> Dict[str, Optional[Dict]]:
+        """Get the latest deployment of many projects in concurrent batched queries.
+
+        Returns a map of project ID -> latest deployment (or None). Projects
+        whose batch failed are missing from the map.
+        """
+        if not self.api_key:
+            return {}
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(batch: List[str]) -> Dict[str, Optional[Dict]]:
+            async with semaphore:
+                try:
+                    query = self._deployment_query(batch, per_service)
+                    variables = {f"p{i}": project_id for i, project_id in enumerate(batch)}
+                    data = await self._post_async(query, "deployments", variables=variables, allow_partial=True)
+                    return self._batch_results(batch, data)
+                except Exception as e:
+                    print(f"Railway API error: {e}")
+                    return {}
+
+        results = {}
+        for batch_result in await asyncio.gather(*[fetch(batch) for batch in self._batches(project_ids)]):
+            results.update(batch_result)
+        return results
+
+    async def get_deployment_status_async(self, project_id: str) -> Optional[Dict]:
+        """Get latest deployment status for a project without blocking the event loop"""
+        return (await self.get_deployment_statuses_async([project_id])).get(project_id)
+
 # Global client instance
 railway_client = RailwayClient() if RAILWAY_API_KEY else None
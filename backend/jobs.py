@@ -0,0 +1,290 @@
+import os
+import asyncio
+import socket
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Investigation, InvestigationJob
+
+INVESTIGATION_WORKERS = int(os.getenv("INVESTIGATION_WORKERS", "4"))  # Per API process, all claiming from one table
+JOB_MAX_ATTEMPTS = int(os.getenv("INVESTIGATION_JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = int(os.getenv("INVESTIGATION_JOB_LEASE_SECONDS", "60"))
+JOB_RETRY_BACKOFF = float(os.getenv("INVESTIGATION_JOB_RETRY_BACKOFF", "15"))
+JOB_POLL_INTERVAL = float(os.getenv("INVESTIGATION_JOB_POLL_INTERVAL", "2"))
+
+# Lower runs first
+PRIORITY_AUTO = 0  # Failures detected in production by the Railway monitor/webhook
+PRIORITY_MANUAL = 10  # Investigations started from the UI/API
+PRIORITY_BACKGROUND = 20  # Re-analysis of incidents already answered from a similar prior one
+
+# handler(investigation_id, final_attempt) runs one investigation
+JobHandler = Callable[[int, bool], Awaitable[None]]
+
+class InvestigationQueue:
+    """Durable priority job queue backed by the investigation_jobs table.
+
+    Workers claim the next due job with an atomic conditional UPDATE and hold
+    a lease that is renewed while the job runs. A job whose lease expires
+    (the process died or restarted) is claimable again, failed jobs are
+    retried with exponential backoff, and submitting never blocks: jobs wait
+    in the table until one of the fixed number of workers is free.
+    """
+    def __init__(self, num_workers: int = INVESTIGATION_WORKERS):
+        self.num_workers = max(1, num_workers)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handler: Optional[JobHandler] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._waits = deque(maxlen=200)  # Seconds spent queued by recent jobs
+
+    def start(self, handler: JobHandler):
+        """Recover orphaned work and start the workers (call from the running event loop)"""
+        if self._workers:
+            return
+        self.handler = handler
+        self._wakeup = asyncio.Event()
+        recovered = self.recover()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        print(f"👷 Investigation queue started with {self.num_workers} workers ({recovered} jobs recovered)")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def recover(self) -> int:
+        """Queue jobs for investigations left behind by older versions or lost jobs"""
+        db = SessionLocal()
+        try:
+            orphans = db.query(Investigation).outerjoin(
+                InvestigationJob, InvestigationJob.investigation_id == Investigation.id
+            ).filter(
+                Investigation.status.in_(["queued", "investigating"]),
+                Investigation.coalesced_into_id.is_(None),  # Duplicates ride on their leader
+                InvestigationJob.id.is_(None)
+            ).all()
+            for investigation in orphans:
+                investigation.status = "queued"
+                db.add(InvestigationJob(
+                    investigation_id=investigation.id,
+                    priority=self._recovered_priority(investigation),
+                    max_attempts=JOB_MAX_ATTEMPTS
+                ))
+            db.commit()
+            # Expired leases are reclaimed by _claim(); count them for the log line
+            expired = db.query(InvestigationJob).filter(
+                InvestigationJob.status == "running",
+                InvestigationJob.lease_expires_at < datetime.utcnow()
+            ).count()
+            return len(orphans) + expired
+        finally:
+            db.close()
+
+    @staticmethod
+    def _recovered_priority(investigation: Investigation) -> int:
+        if investigation.priority is not None:
+            return investigation.priority
+        # Stored before priorities were: auto-investigations are titled by the Railway monitor
+        if (investigation.error_message or "").startswith("Railway deployment "):
+            return PRIORITY_AUTO
+        return PRIORITY_MANUAL
+
+    def submit(self, investigation_id: int, priority: int = PRIORITY_MANUAL,
+               db: Optional[Session] = None) -> int:
+        """Persist a job for an investigation and return the number of queued jobs.
+
+        The priority is also kept on the investigation, so recover() re-creates
+        a lost job with it.
+        """
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            exists = db.query(InvestigationJob).filter(
+                InvestigationJob.investigation_id == investigation_id
+            ).first()
+            if not exists:
+                db.query(Investigation).filter(Investigation.id == investigation_id).update(
+                    {"priority": priority}, synchronize_session=False
+                )
+                db.add(InvestigationJob(
+                    investigation_id=investigation_id,
+                    priority=priority,
+                    max_attempts=JOB_MAX_ATTEMPTS
+                ))
+                db.commit()
+            depth = self._count(db, "queued")
+        finally:
+            if own_session:
+                db.close()
+        if self._wakeup:
+            self._wakeup.set()
+        return depth
+
+    @staticmethod
+    def _count(db: Session, status: str) -> int:
+        return db.query(func.count(InvestigationJob.id)).filter(InvestigationJob.status == status).scalar()
+
+    @property
+    def depth(self) -> int:
+        db = SessionLocal()
+        try:
+            return self._count(db, "queued")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        waits = sorted(self._waits)
+        return {
+            "workers": self.num_workers,
+            "active": self.active,
+            "queued": self.depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "wait_seconds": {
+                "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                "max": round(waits[-1], 3) if waits else 0.0,
+            }
+        }
+
+    def _claim(self) -> Optional[InvestigationJob]:
+        """Atomically lease the next due job, or return None if there is none"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            # Jobs whose worker died become claimable again
+            db.query(InvestigationJob).filter(
+                InvestigationJob.status == "running",
+                InvestigationJob.lease_expires_at < now
+            ).update({"status": "queued", "lease_owner": None}, synchronize_session=False)
+            db.commit()
+
+            while True:
+                candidate = db.query(InvestigationJob).filter(
+                    InvestigationJob.status == "queued",
+                    InvestigationJob.available_at <= now
+                ).order_by(InvestigationJob.priority, InvestigationJob.id).first()
+                if candidate is None:
+                    return None
+
+                # Conditional update: only one worker (in any process) wins the row
+                claimed = db.query(InvestigationJob).filter(
+                    InvestigationJob.id == candidate.id,
+                    InvestigationJob.status == "queued"
+                ).update({
+                    "status": "running",
+                    "attempts": InvestigationJob.attempts + 1,
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now,
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    db.refresh(candidate)
+                    db.expunge(candidate)
+                    self._waits.append((now - candidate.available_at).total_seconds())
+                    return candidate
+        finally:
+            db.close()
+
+    def _renew_lease(self, job_id: int):
+        db = SessionLocal()
+        try:
+            db.query(InvestigationJob).filter(
+                InvestigationJob.id == job_id,
+                InvestigationJob.lease_owner == self.owner
+            ).update({
+                "lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish(self, job: InvestigationJob, error: Optional[str] = None) -> Optional[str]:
+        """Mark a job done, or schedule a retry with backoff / give up after max attempts.
+
+        Returns the new status, or None if the lease was lost to another worker
+        (which now owns the job, so nothing was recorded).
+        """
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            values = {"lease_owner": None, "lease_expires_at": None, "updated_at": now}
+            if error is None:
+                values["status"] = "done"
+            elif job.attempts < job.max_attempts:
+                values["status"] = "queued"
+                values["last_error"] = error
+                values["available_at"] = now + timedelta(seconds=JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+            else:
+                values["status"] = "failed"
+                values["last_error"] = error
+            updated = db.query(InvestigationJob).filter(
+                InvestigationJob.id == job.id,
+                InvestigationJob.lease_owner == self.owner
+            ).update(values, synchronize_session=False)
+            db.commit()
+            return values["status"] if updated else None
+        finally:
+            db.close()
+
+    async def _keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            self._renew_lease(job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Investigation queue claim error: {e}")
+                job = None
+            if job is None:
+                # Nothing due; wait for a submit or the next backoff timer
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.active += 1
+            heartbeat = asyncio.create_task(self._keep_lease(job.id))
+            error = None
+            try:
+                await self.handler(job.investigation_id, job.attempts >= job.max_attempts)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                print(f"Investigation job {job.investigation_id} attempt {job.attempts} error: {error}")
+            finally:
+                heartbeat.cancel()
+                self.active -= 1
+
+            try:
+                status = self._finish(job, error)
+            except Exception as e:
+                print(f"Investigation queue finish error: {e}")
+                continue
+            if status is None:
+                print(f"Investigation job {job.investigation_id} lease was lost to another worker")
+            elif status == "done":
+                self.completed += 1
+            elif status == "queued":
+                self.retried += 1
+            else:
+                self.failed += 1
+
+# Global queue instance
+investigation_queue = InvestigationQueue()
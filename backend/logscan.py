@@ -0,0 +1,200 @@
+import os
+import re
+import heapq
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Tuple, Union
+
+LOG_EXCERPT_BYTES = int(os.getenv("LOG_EXCERPT_BYTES", "6000"))
+MAX_LINE_CHARS = 400
+TAIL_LINES = 60
+MAX_TRACES = 3
+MAX_TRACE_LINES = 40  # Longer traces keep their first and last frames
+MAX_ERROR_LINES = 20
+ERROR_CONTEXT_LINES = 2
+
+_DIGITS = re.compile(r"\d+")
+_TRACE_START = re.compile(r"Traceback \(most recent call last\)|^goroutine \d+ \[|^panic: |^Exception in thread ")
+_FRAME = re.compile(
+    r'File "[^"]+", line \d+'  # Python
+    r"|\bat (?:\S+ \()?[^\s()]+:\d+(?::\d+)?\)?\s*$"  # Node
+    r"|\bat [\w$.<>]+\([\w$.]+(?::\d+)?\)"  # JVM
+    r"|^\s+\S+\.(?:go|rs|rb|py|js|ts|java|kt|cs|cpp|c|php):\d+"  # Go/Rust/Ruby-style
+    r"|^\s*(?:Caused by:|During handling of the above exception|The above exception was the direct cause)"
+)
+_FATAL = re.compile(r"\b(?:fatal|panic|killed|oom|out of memory|segmentation fault|exited with code [1-9])", re.I)
+_ERROR = re.compile(r"\b(?:[A-Z]\w*(?:Error|Exception)\b|error\b|failed\b|failure\b|cannot\b|unable to\b|refused\b|denied\b)", re.I)
+_WARNING = re.compile(r"\b(?:warn(?:ing)?|deprecat\w*)\b", re.I)
+
+# (line number, text, times repeated)
+Record = Tuple[int, str, int]
+
+def line_severity(line: str) -> int:
+    """0 for noise, 1 warning, 2 error, 3 fatal"""
+    if _FATAL.search(line):
+        return 3
+    if _ERROR.search(line):
+        return 2
+    if _WARNING.search(line):
+        return 1
+    return 0
+
+def iter_lines(text: str) -> Iterable[str]:
+    """Lines of a string without building a list of all of them"""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+class LogScanner:
+    """Single-pass, bounded-memory extraction of the useful parts of a log.
+
+    Consecutive lines that differ only in numbers (progress bars, retries,
+    timestamps) collapse into one "[repeated N times]" record. The scanner
+    keeps the last few stack traces, the most severe error lines with a
+    little leading context, and a tail window; excerpt() ranks them and
+    renders as many as fit in a byte budget, in log order.
+    """
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.collapsed = 0
+        self._records = 0
+        self._run: Optional[List] = None  # [first line no, text, key, count]
+        self._context: Deque[Record] = deque(maxlen=ERROR_CONTEXT_LINES)
+        self._tail: Deque[Record] = deque(maxlen=TAIL_LINES)
+        self._errors: List[Tuple[int, int, List[Record]]] = []  # min-heap of (severity, line no, records)
+        self._traces: Deque[List[Record]] = deque(maxlen=MAX_TRACES)
+        self._trace: Optional[List[Record]] = None
+        self._trace_frames: Deque[Record] = deque(maxlen=MAX_TRACE_LINES // 2)
+
+    def feed(self, line: str):
+        self.lines += 1
+        self.bytes += len(line) + 1
+        line = line.rstrip("\r\n")
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + "..."
+        key = _DIGITS.sub("#", line)
+        if self._run is not None and self._run[2] == key:
+            self._run[3] += 1
+            self.collapsed += 1
+            return
+        self._flush_run()
+        self._run = [self.lines, line, key, 1]
+
+    def feed_all(self, lines: Iterable[Union[str, bytes]]) -> "LogScanner":
+        for line in lines:
+            self.feed(line.decode("utf-8", "replace") if isinstance(line, bytes) else line)
+        self._flush_run()
+        self._close_trace()
+        return self
+
+    def _flush_run(self):
+        if self._run is None:
+            return
+        number, text, _, count = self._run
+        self._run = None
+        self._records += 1
+        self._process((number, text, count))
+
+    def _process(self, record: Record):
+        _, text, _ = record
+        is_frame = bool(_FRAME.search(text))
+        if self._trace is not None:
+            if is_frame or text[:1] in (" ", "\t"):
+                self._add_frame(record)
+            else:
+                # Python ends a trace with the exception line itself
+                if line_severity(text) >= 2:
+                    self._add_frame(record)
+                self._close_trace()
+        if self._trace is None and (_TRACE_START.search(text) or is_frame):
+            # A frame with no open trace: the line before it is the exception header (JS/JVM)
+            self._trace = list(self._context)[-1:] if is_frame and self._context else []
+            self._trace.append(record)
+
+        severity = line_severity(text)
+        if severity >= 2:
+            entry = (severity, record[0], list(self._context) + [record])
+            if len(self._errors) < MAX_ERROR_LINES:
+                heapq.heappush(self._errors, entry)
+            elif entry[:2] > self._errors[0][:2]:
+                heapq.heapreplace(self._errors, entry)
+        self._context.append(record)
+        self._tail.append(record)
+
+    def _add_frame(self, record: Record):
+        if len(self._trace) < MAX_TRACE_LINES // 2:
+            self._trace.append(record)
+        else:
+            self._trace_frames.append(record)
+
+    def _close_trace(self):
+        if self._trace is not None:
+            self._traces.append(self._trace + list(self._trace_frames))
+            self._trace = None
+            self._trace_frames.clear()
+
+    def _segments(self) -> List[Tuple[float, str, List[Record]]]:
+        """Candidate excerpt segments as (score, kind, records)"""
+        total = max(self.lines, 1)
+        segments = []
+        for trace in self._traces:
+            severity = max(line_severity(text) for _, text, _ in trace)
+            segments.append((100 + 10 * severity + 10 * trace[-1][0] / total, "trace", trace))
+        for severity, number, records in self._errors:
+            segments.append((40 * severity + 10 * number / total, "error", records))
+        segments.append((70, "tail", list(self._tail)))
+        return sorted(segments, key=lambda s: -s[0])
+
+    @staticmethod
+    def _render(record: Record) -> str:
+        number, text, count = record
+        suffix = f"  [repeated {count} times]" if count > 1 else ""
+        return f"{number:>7} | {text}{suffix}"
+
+    def excerpt(self, budget_bytes: int = LOG_EXCERPT_BYTES) -> str:
+        """Highest ranked segments that fit in budget_bytes, in original order"""
+        if not self.lines:
+            return ""
+        chosen = {}
+        used = 0
+        for _, kind, records in self._segments():
+            fresh = [r for r in records if r[0] not in chosen]
+            cost = sum(len(self._render(r).encode("utf-8")) + 1 for r in fresh)
+            if used + cost > budget_bytes:
+                if kind not in ("tail", "trace"):
+                    continue
+                # Keep the end of the tail (or trace) that still fits
+                kept = []
+                for record in reversed(fresh):
+                    size = len(self._render(record).encode("utf-8")) + 1
+                    if used + size > budget_bytes:
+                        break
+                    used += size
+                    kept.append(record)
+                fresh, cost = kept, 0
+            for record in fresh:
+                chosen[record[0]] = record
+            used += cost
+
+        lines = [
+            f"[log excerpt: {len(chosen)} of {self.lines} lines ({self.bytes} bytes), "
+            f"{self.collapsed} repeated lines collapsed]"
+        ]
+        previous = 0
+        for number in sorted(chosen):
+            if number > previous + 1 and previous:
+                lines.append("    ...")
+            lines.append(self._render(chosen[number]))
+            previous = number + chosen[number][2] - 1
+        return "\n".join(lines)
+
+def excerpt_logs(logs: Union[str, Iterable[Union[str, bytes]]], budget_bytes: int = LOG_EXCERPT_BYTES) -> str:
+    """Ranked excerpt of a log string or line iterable (e.g. an open file)"""
+    if not logs:
+        return ""
+    lines = iter_lines(logs) if isinstance(logs, str) else logs
+    return LogScanner().feed_all(lines).excerpt(budget_bytes)
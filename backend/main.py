@@ -1,11 +1,15 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, File, UploadFile, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
+import json
 import asyncio
 import uuid
+import time
+import hmac
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -15,9 +19,24 @@ load_dotenv()
 from database import init_db, get_db, Repository, Investigation, InvestigationStep, Document
 from agent.investigator import investigator
 from integrations.railway import railway_client
+from integrations.parallel_ai import parallel_client
+from search_cache import search_cache
+from scheduler import PollScheduler
+from jobs import investigation_queue, PRIORITY_AUTO, PRIORITY_MANUAL, PRIORITY_BACKGROUND
+from singleflight import coalesce_key, follower_registry
+from fingerprint import fingerprint
+from similarity import similarity_index
+from broadcast import BroadcastHub
+from steplog import step_log
+from eventbus import event_bus
+import docindex
+from ingest import document_ingestor, save_upload, upload_path, UploadTooLarge, UploadSizeLimit
 
 app = FastAPI(title="On-Call Agent API")
 
+# Caps document uploads while they are received, before the multipart parser spools them
+app.add_middleware(UploadSizeLimit)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -28,24 +47,22 @@ app.add_middleware(
 )
 
 # WebSocket connections manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, list[WebSocket]] = {}
+class ConnectionManager(BroadcastHub):
+    async def send_message(self, investigation_id: str, message: dict):
+        self.post(investigation_id, message)
 
-    async def connect(self, websocket: WebSocket, investigation_id: str):
-        await websocket.accept()
-        if investigation_id not in self.active_connections:
-            self.active_connections[investigation_id] = []
-        self.active_connections[investigation_id].append(websocket)
+    def post(self, investigation_id: str, message: dict):
+        """Log an update for replay and queue it for viewers in every API process"""
+        if investigation_id.isdigit():
+            message = step_log.record(int(investigation_id), message)
+        # Viewers of coalesced duplicates see the leader's updates too
+        targets = [investigation_id] + follower_registry.followers(investigation_id)
+        event_bus.publish("websocket", {"targets": targets, "message": message})
 
-    def disconnect(self, websocket: WebSocket, investigation_id: str):
-        if investigation_id in self.active_connections:
-            self.active_connections[investigation_id].remove(websocket)
-
-    async def send_message(self, investigation_id: str, message: dict):
-        if investigation_id in self.active_connections:
-            for connection in self.active_connections[investigation_id]:
-                await connection.send_json(message)
+    def deliver(self, event: dict):
+        """Event bus handler: queue a message for the sockets this process holds"""
+        for target_id in event["targets"]:
+            self.publish(target_id, event["message"])
 
 manager = ConnectionManager()
 
@@ -53,113 +70,281 @@ manager = ConnectionManager()
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    event_bus.subscribe("websocket", manager.deliver)
+    event_bus.subscribe("followers", apply_follower_event)
+    event_bus.subscribe("monitor", apply_monitor_event)
+    await event_bus.start()
+    load_followers()
+    similarity_index.load()
+    # With several workers, one re-indexes at a time; whoever is next finds nothing left to do
+    if event_bus.acquire_leadership("startup-maintenance"):
+        try:
+            docindex.backfill()
+        finally:
+            event_bus.release_leadership("startup-maintenance")
+    # Safe in every worker: documents another worker is extracting are leased
+    document_ingestor.resume()
+    step_log.shared = event_bus.shared
+    step_log.start()
+    # Resumes jobs left queued or running by a previous process
+    investigation_queue.start(execute_investigation_job)
     # Start Railway monitoring task
     asyncio.create_task(monitor_railway_deployments())
 
+def load_followers():
+    """Rebuild the WebSocket follower routing for duplicates of unfinished investigations"""
+    db = next(get_db())
+    try:
+        followers = db.query(Investigation).filter(
+            Investigation.coalesced_into_id.isnot(None),
+            Investigation.status.in_(["queued", "investigating"])
+        ).all()
+        for follower in followers:
+            follower_registry.attach(follower.coalesced_into_id, follower.id)
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await investigation_queue.stop()
+    await document_ingestor.shutdown()
+    await step_log.stop()
+    await event_bus.stop()
+    if railway_client:
+        await railway_client.aclose()
+    if parallel_client:
+        await parallel_client.aclose()
+
+# Answer identical recurring failures from the prior analysis instead of calling the LLM
+SIMILARITY_REUSE_EXACT = os.getenv("SIMILARITY_REUSE_EXACT", "true").lower() == "true"
+
+RAILWAY_POLL_CONCURRENCY = int(os.getenv("RAILWAY_POLL_CONCURRENCY", "10"))
+RAILWAY_REPO_REFRESH_INTERVAL = float(os.getenv("RAILWAY_REPO_REFRESH_INTERVAL", "30"))
+RAILWAY_RECONCILE_INTERVAL = float(os.getenv("RAILWAY_RECONCILE_INTERVAL", "900"))
+RAILWAY_RECONCILE_TTL = float(os.getenv("RAILWAY_RECONCILE_TTL", "3600"))  # Back to normal polling after webhooks stop
+# Shared secret Railway must send (?token=... in the webhook URL, or an X-Webhook-Secret header)
+RAILWAY_WEBHOOK_SECRET = os.getenv("RAILWAY_WEBHOOK_SECRET")
+MONITOR_STANDBY_INTERVAL = 15  # How often a worker not running the monitor checks for its lease
+
+# Shared by the poller and the webhook; kept in step across workers by "monitor" events
+poll_scheduler = PollScheduler()
+last_checked = {}  # Track last deployment status per repo
+project_repo_index = {}  # Railway project ID -> repository ID
+
+def apply_follower_event(event: dict):
+    """Event bus handler: keep every process's follower routing in sync"""
+    if event["op"] == "attach":
+        follower_registry.attach(event["leader_id"], event["follower_id"])
+    else:
+        follower_registry.release(event["leader_id"])
+
+def apply_monitor_event(event: dict):
+    """Event bus handler: deployment status and webhook activity seen by any worker"""
+    if event["op"] == "deployment_status":
+        last_checked[event["repo_id"]] = {"id": event["deployment_id"], "status": event["status"]}
+    elif event["op"] == "webhook":
+        # Webhooks are flowing for this repo, so polling only needs to reconcile missed events
+        poll_scheduler.use_reconciliation(event["repo_id"], RAILWAY_RECONCILE_INTERVAL, RAILWAY_RECONCILE_TTL)
+
 async def monitor_railway_deployments():
-    """Background task to periodically check Railway deployment status"""
+    """Background task that polls each repo's Railway deployment on its own schedule"""
     await asyncio.sleep(10)  # Wait for app to fully start
     print("🚀 Railway monitoring task started")
     
-    last_checked = {}  # Track last deployment status per repo
+    scheduler = poll_scheduler
+    repos_by_id = {}
+    repos_loaded_at = None
     
     while True:
         try:
+            # One worker polls Railway; the others stand by to take over its lease
+            if not event_bus.acquire_leadership("railway-monitor"):
+                repos_loaded_at = None
+                await asyncio.sleep(MONITOR_STANDBY_INTERVAL)
+                continue
+            
             if not railway_client:
                 print("⚠️  Railway client not configured. Add RAILWAY_API_KEY to .env")
                 await asyncio.sleep(300)
                 continue
             
-            # Get all repos with Railway project names
-            db = next(get_db())
-            try:
-                repos = db.query(Repository).filter(
-                    Repository.railway_project_name.isnot(None)
-                ).all()
-                
-                if not repos:
-                    await asyncio.sleep(60)
-                    continue
-                
-                for repo in repos:
-                    try:
-                        # Get project by name
-                        project = railway_client.get_project_by_name(repo.railway_project_name)
-                        if not project:
-                            print(f"⚠️  Railway project '{repo.railway_project_name}' not found")
-                            continue
-                        
-                        # Get latest deployment
-                        deployment = railway_client.get_deployment_status(project["id"])
-                        if not deployment:
-                            continue
-                        
-                        deployment_status = deployment.get("status", "").lower()
-                        deployment_id = deployment.get("id")
-                        
-                        # Check if we've seen this deployment before
-                        last_status = last_checked.get(repo.id, {})
-                        
-                        if last_status.get("id") != deployment_id and deployment_status in ["failed", "crashed"]:
-                            # New failed/crashed deployment detected!
-                            print(f"🔴 Deployment {deployment_status.upper()} for {repo.owner}/{repo.name}")
-                            
-                            # Trigger investigation automatically
-                            error_message = deployment.get("error", f"Railway deployment {deployment_status}")
-                            
-                            # Create investigation in new session
-                            db_inv = next(get_db())
-                            try:
-                                investigation = Investigation(
-                                    repository_id=repo.id,
-                                    status="investigating",
-                                    error_message=f"Railway deployment {deployment_status}: {error_message}",
-                                    deployment_logs=error_message,
-                                    commit_sha=""  # Could get from deployment metadata
-                                )
-                                db_inv.add(investigation)
-                                db_inv.commit()
-                                db_inv.refresh(investigation)
-                                
-                                investigation_id = investigation.id
-                                
-                                print(f"🔍 Starting auto-investigation #{investigation_id}")
-                                
-                                # Run investigation in background with new session
-                                async def run_auto_investigation():
-                                    db_task = next(get_db())
-                                    try:
-                                        await run_investigation(
-                                            investigation_id,
-                                            repo,
-                                            error_message,
-                                            error_message,
-                                            "",
-                                            db_task
-                                        )
-                                    finally:
-                                        db_task.close()
-                                
-                                asyncio.create_task(run_auto_investigation())
-                            finally:
-                                db_inv.close()
-                            
-                            # Update last checked
-                            last_checked[repo.id] = {"id": deployment_id, "status": deployment_status}
-                        else:
-                            # Update tracking
-                            last_checked[repo.id] = {"id": deployment_id, "status": deployment_status}
-                            
-                    except Exception as e:
-                        print(f"Error checking repo {repo.id}: {e}")
-            finally:
-                db.close()
+            # Reload the set of repos with Railway project names now and then
+            now = time.monotonic()
+            if repos_loaded_at is None or now - repos_loaded_at > RAILWAY_REPO_REFRESH_INTERVAL:
+                db = next(get_db())
+                try:
+                    repos = db.query(Repository).filter(
+                        Repository.railway_project_name.isnot(None)
+                    ).all()
+                finally:
+                    db.close()
+                repos_by_id = {repo.id: repo for repo in repos}
+                scheduler.sync(repos_by_id)
+                repos_loaded_at = now
             
-            await asyncio.sleep(60)  # Check every minute
+            scheduler.rate_limited(railway_client.rate_limited_until)
+            due = [repos_by_id[repo_id] for repo_id in scheduler.pop_due() if repo_id in repos_by_id]
+            if due:
+                statuses = await check_railway_repos(due)
+                for repo in due:
+                    scheduler.record(repo.id, statuses.get(repo.id))
+            
+            wait = scheduler.seconds_until_next()
+            if wait is None:
+                wait = RAILWAY_REPO_REFRESH_INTERVAL
+            await asyncio.sleep(min(max(wait, 0.5), RAILWAY_REPO_REFRESH_INTERVAL))
                 
         except Exception as e:
             print(f"Monitoring error: {e}")
-            await asyncio.sleep(60)
+            await asyncio.sleep(RAILWAY_REPO_REFRESH_INTERVAL)
+
+async def check_railway_repos(repos: List[Repository]) -> dict:
+    """Check the latest Railway deployment of every repository in one batched query.
+
+    Returns repo ID -> deployment status for every repo that could be checked.
+    """
+    project_ids = {}
+    for repo in repos:
+        # Served from the cached project directory
+        project = await railway_client.get_project_by_name_async(repo.railway_project_name)
+        if not project:
+            print(f"⚠️  Railway project '{repo.railway_project_name}' not found")
+            continue
+        project_ids[repo.id] = project["id"]
+        project_repo_index[project["id"]] = repo.id
+    
+    if not project_ids:
+        return {}
+    
+    deployments = await railway_client.get_deployment_statuses_async(
+        list(project_ids.values()),
+        concurrency=RAILWAY_POLL_CONCURRENCY
+    )
+    
+    statuses = {}
+    for repo in repos:
+        project_id = project_ids.get(repo.id)
+        if project_id not in deployments:
+            continue
+        try:
+            deployment = deployments[project_id]
+            if deployment:
+                handle_deployment_status(repo, deployment)
+                statuses[repo.id] = deployment.get("status", "")
+            else:
+                statuses[repo.id] = ""  # Project has no deployments yet
+        except Exception as e:
+            print(f"Error checking repo {repo.id}: {e}")
+    return statuses
+
+def claim_failed_deployment(deployment_id: Optional[str]) -> bool:
+    """Return True the first time a failed deployment is seen (by any worker), False for duplicates"""
+    if not deployment_id:
+        return True
+    return event_bus.claim(f"railway-deployment:{deployment_id}")
+
+def handle_deployment_status(repo: Repository, deployment: dict, commit_sha: str = "") -> Optional[int]:
+    """Start an investigation if this is a newly seen failed deployment.
+
+    Returns the new investigation ID, or None if nothing was started.
+    """
+    deployment_status = deployment.get("status", "").lower()
+    deployment_id = deployment.get("id")
+    
+    # Update tracking
+    event_bus.publish("monitor", {
+        "op": "deployment_status", "repo_id": repo.id, "deployment_id": deployment_id, "status": deployment_status
+    })
+    
+    # Dedupe on deployment ID so the poller and webhook retries don't double-start
+    if deployment_status not in ["failed", "crashed"] or not claim_failed_deployment(deployment_id):
+        return None
+    
+    # New failed/crashed deployment detected!
+    print(f"🔴 Deployment {deployment_status.upper()} for {repo.owner}/{repo.name}")
+    railway_error = deployment.get("error") or ""
+    error_message = railway_error or f"Railway deployment {deployment_status}"
+    commit_sha = commit_sha or (deployment.get("meta") or {}).get("commitHash") or ""
+    return start_auto_investigation(repo, deployment_status, error_message, commit_sha, railway_error)
+
+def start_auto_investigation(repo: Repository, deployment_status: str, error_message: str,
+                             commit_sha: str = "", deployment_logs: str = "") -> int:
+    """Create an investigation for a failed deployment and queue it.
+
+    deployment_logs is only what Railway reported: a made-up status message
+    passed as logs would look like an error line and fingerprint every bare
+    failure of the repo identically.
+    """
+    db_inv = next(get_db())
+    try:
+        # Production failures jump ahead of manual investigations
+        investigation, queued = create_investigation(
+            db_inv,
+            repo,
+            f"Railway deployment {deployment_status}: {error_message}",
+            deployment_logs,
+            commit_sha,
+            PRIORITY_AUTO
+        )
+        investigation_id = investigation.id
+    finally:
+        db_inv.close()
+    
+    print(f"🔍 Queued auto-investigation #{investigation_id} ({queued} waiting)")
+    return investigation_id
+
+async def resolve_railway_repository(db: Session, project_id: Optional[str],
+                                     project_name: Optional[str] = None) -> Optional[Repository]:
+    """Find the repository monitoring a Railway project, via the project ID index"""
+    if project_id and project_id not in project_repo_index and railway_client:
+        # Rebuild the index from the cached project directory
+        repos = db.query(Repository).filter(Repository.railway_project_name.isnot(None)).all()
+        for repo in repos:
+            project = await railway_client.get_project_by_name_async(repo.railway_project_name)
+            if project:
+                project_repo_index[project["id"]] = repo.id
+    
+    repo_id = project_repo_index.get(project_id)
+    if repo_id is not None:
+        return db.query(Repository).filter(Repository.id == repo_id).first()
+    if project_name:
+        return db.query(Repository).filter(Repository.railway_project_name == project_name).first()
+    return None
+
+def parse_railway_webhook(payload: dict) -> Optional[dict]:
+    """Normalize a Railway webhook payload into a deployment event.
+
+    Accepts both the legacy `{"event": "deployment.failed", "data": {...}}`
+    shape and Railway's native `{"type": "DEPLOY", "status": ..., "project":
+    {...}, "deployment": {...}}` shape.
+    """
+    if "event" in payload:
+        event_type = payload.get("event", "")
+        if not event_type.startswith("deployment."):
+            return None
+        data = payload.get("data", {})
+        return {
+            "status": event_type.split(".", 1)[1],
+            "deployment_id": data.get("deployment_id") or data.get("id"),
+            "project_id": data.get("project_id"),
+            "project_name": data.get("project_name"),
+            "commit_sha": data.get("commit_sha") or "",
+            "error": data.get("error"),
+        }
+    
+    if payload.get("type") == "DEPLOY":
+        project = payload.get("project") or {}
+        deployment = payload.get("deployment") or {}
+        meta = deployment.get("meta") or {}
+        return {
+            "status": (payload.get("status") or "").lower(),
+            "deployment_id": deployment.get("id"),
+            "project_id": project.get("id"),
+            "project_name": project.get("name"),
+            "commit_sha": meta.get("commitHash") or "",
+            "error": None,
+        }
+    return None
 
 @app.get("/")
 async def root():
@@ -175,35 +360,55 @@ async def debug_railway():
     if not railway_client:
         return {"error": "Railway client not configured. Add RAILWAY_API_KEY to .env"}
     
-    print("Debug: Calling list_all_projects()...")
-    projects = railway_client.list_all_projects()
-    print(f"Debug: Got {len(projects)} projects: {projects}")
+    projects = await railway_client.list_all_projects_async()
+    directory = railway_client.project_directory
     
     return {
         "configured": True,
         "projects": projects,
-        "count": len(projects)
+        "count": len(projects),
+        "directory_refreshes": directory.refresh_count,
+        "last_checked": last_checked
     }
 
+def check_webhook_secret(token: Optional[str], header: Optional[str]):
+    """Reject webhooks without the shared secret (they can start paid LLM investigations)"""
+    if not RAILWAY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Railway webhooks are disabled: set RAILWAY_WEBHOOK_SECRET")
+    supplied = token or header or ""
+    if not hmac.compare_digest(supplied.encode("utf-8"), RAILWAY_WEBHOOK_SECRET.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
 # Railway webhook endpoint
 @app.post("/api/webhooks/railway")
-async def railway_webhook(request: dict):
+async def railway_webhook(
+    request: dict,
+    token: Optional[str] = None,
+    x_webhook_secret: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Receive Railway deployment webhooks"""
+    check_webhook_secret(token, x_webhook_secret)
     try:
-        event_type = request.get("event")
+        event = parse_railway_webhook(request)
+        if not event:
+            return {"status": "ignored"}
         
-        if event_type == "deployment.failed":
-            # Extract deployment info
-            deployment = request.get("data", {})
-            error_message = deployment.get("error", "Deployment failed")
-            project_id = deployment.get("project_id")
-            commit_sha = deployment.get("commit_sha")
-            
-            # Find repository associated with this Railway project
-            # For now, we'll trigger investigation manually
-            # In production, you'd match project_id to your repos
-            
-            return {"status": "received"}
+        repo = await resolve_railway_repository(db, event["project_id"], event["project_name"])
+        if not repo:
+            print(f"⚠️  Webhook for unknown Railway project {event['project_id']}")
+            return {"status": "unknown_project"}
+        
+        # The worker running the monitor may be another process
+        event_bus.publish("monitor", {"op": "webhook", "repo_id": repo.id})
+        
+        deployment = {"id": event["deployment_id"], "status": event["status"]}
+        if event["error"]:
+            deployment["error"] = event["error"]
+        investigation_id = handle_deployment_status(repo, deployment, event["commit_sha"])
+        if investigation_id is not None:
+            investigation = db.query(Investigation).filter(Investigation.id == investigation_id).first()
+            return {"status": investigation.status, "investigation_id": investigation_id}
             
     except Exception as e:
         print(f"Webhook error: {e}")
@@ -273,71 +478,86 @@ async def get_repository(repo_id: int, db: Session = Depends(get_db)):
         "created_at": repo.created_at.isoformat()
     }
 
-# Document upload endpoint
+# Document upload endpoints
+def document_summary(doc: Document) -> dict:
+    return {
+        "id": doc.id,
+        "filename": doc.filename,
+        "file_type": doc.file_type,
+        "size_bytes": doc.size_bytes,
+        "status": doc.status or "ready",
+        "error": doc.error,
+        "uploaded_at": doc.uploaded_at.isoformat(),
+        "ingested_at": doc.ingested_at.isoformat() if doc.ingested_at else None
+    }
+
+async def store_document(db: Session, repo_id: int, file: UploadFile) -> Document:
+    """Stream an upload to disk and queue it for background extraction and indexing"""
+    file_path = upload_path(repo_id, file.filename)
+    size = await save_upload(file, file_path)
+    doc = Document(
+        repository_id=repo_id,
+        filename=os.path.basename(file.filename or "upload"),
+        file_path=file_path,
+        file_type=file.filename.split(".")[-1].lower() if file.filename else "",
+        size_bytes=size,
+        status="pending"
+    )
+    db.add(doc)
+    db.commit()
+    db.refresh(doc)
+    document_ingestor.submit(doc.id)
+    return doc
+
 @app.post("/api/repositories/{repo_id}/documents")
 async def upload_document(
     repo_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    """Upload documentation for a repository"""
+    """Upload documentation for a repository (ingested in the background)"""
     repo = db.query(Repository).filter(Repository.id == repo_id).first()
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
     
-    # Save file
-    os.makedirs("uploads", exist_ok=True)
-    file_path = f"uploads/{repo_id}_{file.filename}"
-    content = await file.read()
-    
-    with open(file_path, "wb") as f:
-        f.write(content)
+    try:
+        doc = await store_document(db, repo_id, file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return document_summary(doc)
+
+@app.post("/api/repositories/{repo_id}/documents/bulk")
+async def upload_documents(
+    repo_id: int,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """Upload several documents at once; files over the size limit are reported, not fatal"""
+    repo = db.query(Repository).filter(Repository.id == repo_id).first()
+    if not repo:
+        raise HTTPException(status_code=404, detail="Repository not found")
     
-    # Extract text content
-    text_content = ""
-    if file.filename.endswith(".pdf"):
-        try:
-            import PyPDF2
-            pdf_reader = PyPDF2.PdfReader(file_path)
-            text_content = "\n".join([page.extract_text() for page in pdf_reader.pages])
-        except:
-            pass
-    elif file.filename.endswith((".md", ".txt")):
+    results = []
+    for file in files:
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                text_content = f.read()
-        except:
-            pass
-    
-    # Save to database
-    doc = Document(
-        repository_id=repo_id,
-        filename=file.filename,
-        file_path=file_path,
-        content=text_content,
-        file_type=file.filename.split(".")[-1]
-    )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
-    
-    return {
-        "id": doc.id,
-        "filename": doc.filename,
-        "file_type": doc.file_type,
-        "uploaded_at": doc.uploaded_at.isoformat()
-    }
+            results.append(document_summary(await store_document(db, repo_id, file)))
+        except UploadTooLarge as e:
+            results.append({"filename": file.filename, "status": "rejected", "error": str(e)})
+    return results
 
 @app.get("/api/repositories/{repo_id}/documents")
 async def get_documents(repo_id: int, db: Session = Depends(get_db)):
     """Get all documents for a repository"""
     docs = db.query(Document).filter(Document.repository_id == repo_id).all()
-    return [{
-        "id": d.id,
-        "filename": d.filename,
-        "file_type": d.file_type,
-        "uploaded_at": d.uploaded_at.isoformat()
-    } for d in docs]
+    return [document_summary(d) for d in docs]
+
+@app.get("/api/documents/{doc_id}")
+async def get_document(doc_id: int, db: Session = Depends(get_db)):
+    """Ingestion status of a document"""
+    doc = db.query(Document).filter(Document.id == doc_id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document_summary(doc)
 
 # Investigation endpoints
 @app.post("/api/repositories/{repo_id}/investigate")
@@ -356,24 +576,207 @@ async def start_investigation(
     if not investigator:
         raise HTTPException(status_code=500, detail="Investigator not configured")
     
-    # Create investigation record
+    investigation, queued = create_investigation(
+        db, repo, error_message, deployment_logs, commit_sha, PRIORITY_MANUAL
+    )
+    
+    response = {
+        "investigation_id": investigation.id,
+        "status": investigation.status,
+        "queue_depth": queued
+    }
+    if investigation.coalesced_into_id:
+        response["coalesced_into"] = investigation.coalesced_into_id
+    prior_match = prior_match_summary(investigation)
+    if prior_match:
+        response["prior_match"] = prior_match
+    return response
+
+def create_investigation(
+    db: Session,
+    repo: Repository,
+    error_message: str,
+    deployment_logs: str,
+    commit_sha: str,
+    priority: int
+):
+    """Create an investigation record and queue it, or attach it to an identical one in flight.
+
+    Returns (investigation, queue depth). A duplicate of an investigation
+    that is still queued/investigating for the same repository, commit and
+    error fingerprint doesn't get a job of its own: it follows the leader,
+    receives its WebSocket updates and is completed with its result.
+    
+    Otherwise the similarity index is consulted: an identical fingerprint
+    of the same commit with a completed analysis is answered from it
+    without an LLM call; any other match is recorded as the prior match,
+    sent to viewers at once, and the full analysis is queued at background
+    priority.
+    
+    An uninformative fingerprint (no error type, frame or log error, e.g.
+    a failed deployment Railway reported without an error) is neither
+    coalesced nor matched: it would merge unrelated failures.
+    """
+    error_print = fingerprint(error_message, deployment_logs)
+    informative = error_print["informative"]
+    key = coalesce_key(repo.id, commit_sha, error_print["hash"]) if informative else None
+    leader = None
+    if informative:
+        leader = db.query(Investigation).filter(
+            Investigation.repository_id == repo.id,
+            Investigation.coalesce_key == key,
+            Investigation.coalesced_into_id.is_(None),
+            Investigation.status.in_(["queued", "investigating"])
+        ).order_by(Investigation.id).first()
+    
+    match = None
+    if informative and not leader:
+        match = similarity_index.lookup(repo.id, error_print["hash"], error_print["signature"])
+    prior = None
+    if match:
+        prior = db.query(Investigation).filter(Investigation.id == match["investigation_id"]).first()
+    # Only the same failure of the same commit is answered without a new analysis
+    same_commit = bool(prior) and (prior.commit_sha or "").strip().lower() == (commit_sha or "").strip().lower()
+    reuse = bool(prior and match["exact"] and same_commit and SIMILARITY_REUSE_EXACT)
+    
     investigation = Investigation(
-        repository_id=repo_id,
-        status="investigating",
+        repository_id=repo.id,
+        status="completed" if reuse else (leader.status if leader else "queued"),
+        root_cause=prior.root_cause if reuse else None,
+        suggested_fix=prior.suggested_fix if reuse else None,
+        completed_at=datetime.utcnow() if reuse else None,
+        prior_match_id=prior.id if prior else None,
+        prior_match_score=match["score"] if prior else None,
         error_message=error_message,
         deployment_logs=deployment_logs,
-        commit_sha=commit_sha
+        commit_sha=commit_sha,
+        error_fingerprint=error_print["hash"] if informative else None,
+        error_signature=error_print["signature"],
+        coalesce_key=key,
+        coalesced_into_id=leader.id if leader else None
     )
     db.add(investigation)
     db.commit()
     db.refresh(investigation)
     
-    # Start investigation in background
-    asyncio.create_task(run_investigation(investigation.id, repo, error_message, deployment_logs, commit_sha, db))
+    if leader:
+        event_bus.publish("followers", {"op": "attach", "leader_id": leader.id, "follower_id": investigation.id})
+        print(f"🔗 Investigation #{investigation.id} coalesced into #{leader.id}")
+        return investigation, investigation_queue.depth
+    
+    # Surface the similar prior incident right away, before any analysis
+    prior_match = prior_match_summary(investigation)
+    if prior_match:
+        manager.post(str(investigation.id), {
+            "type": "step_update",
+            "message": f"Found similar prior incident #{prior.id}",
+            "data": {"step": "prior_match", "result": prior_match}
+        })
     
+    if reuse:
+        print(f"♻️  Investigation #{investigation.id} answered from identical #{prior.id}")
+        manager.post(str(investigation.id), {
+            "type": "step_update",
+            "message": f"Answered from identical prior incident #{prior.id}",
+            "data": {"step": "completed", "result": {
+                "root_cause": prior.root_cause,
+                "suggested_fix": prior.suggested_fix,
+                "reused_from": prior.id
+            }}
+        })
+        return investigation, investigation_queue.depth
+    
+    if prior:
+        print(f"🧭 Investigation #{investigation.id} resembles #{prior.id} (score {match['score']})")
+        priority = max(priority, PRIORITY_BACKGROUND)
+    
+    # Queue investigation for the worker pool
+    return investigation, investigation_queue.submit(investigation.id, priority, db=db)
+
+def prior_match_summary(investigation: Investigation) -> Optional[dict]:
+    """The prior investigation this one matched, for API responses and WebSocket updates"""
+    prior = investigation.prior_match
+    if not prior:
+        return None
     return {
-        "investigation_id": investigation.id,
-        "status": "investigating"
+        "investigation_id": prior.id,
+        "score": investigation.prior_match_score,
+        "exact": investigation.prior_match_score == 1.0,
+        "root_cause": prior.root_cause,
+        "suggested_fix": prior.suggested_fix,
+    }
+
+def sync_followers(db: Session, leader: Investigation):
+    """Copy a leader's status and result onto the duplicates attached to it"""
+    followers = db.query(Investigation).filter(Investigation.coalesced_into_id == leader.id).all()
+    for follower in followers:
+        follower.status = leader.status
+        follower.root_cause = leader.root_cause
+        follower.suggested_fix = leader.suggested_fix
+        follower.completed_at = leader.completed_at
+    if followers:
+        db.commit()
+    if leader.status in ("completed", "failed"):
+        event_bus.publish("followers", {"op": "release", "leader_id": leader.id})
+
+async def execute_investigation_job(investigation_id: int, final_attempt: bool):
+    """Queue handler: run one claimed investigation job in its own session"""
+    db_task = next(get_db())
+    try:
+        investigation = db_task.query(Investigation).filter(Investigation.id == investigation_id).first()
+        if not investigation or not investigation.repository:
+            return
+        investigation.status = "investigating"
+        db_task.commit()
+        sync_followers(db_task, investigation)
+        
+        deployment_logs = investigation.deployment_logs or ""
+        await run_investigation(
+            investigation_id,
+            investigation.repository,
+            investigation.error_message or "",
+            deployment_logs,
+            investigation.commit_sha or "",
+            db_task,
+            retryable=not final_attempt
+        )
+    finally:
+        db_task.close()
+
+def record_llm_usage(investigation: Investigation, result: dict):
+    """Store the model routing decision and token/prompt cache accounting of an analysis"""
+    routing = result.get("routing")
+    if routing:
+        investigation.routing_decision = routing.get("decision")
+        investigation.routing_reason = routing.get("reason")
+        investigation.triage_category = routing.get("category")
+        investigation.triage_confidence = routing.get("confidence")
+    usage = result.get("usage")
+    if not usage:
+        return
+    investigation.llm_model = usage.get("model")
+    investigation.input_tokens = usage.get("input_tokens")
+    investigation.output_tokens = usage.get("output_tokens")
+    investigation.cache_read_tokens = usage.get("cache_read_input_tokens")
+    investigation.cache_write_tokens = usage.get("cache_creation_input_tokens")
+    investigation.first_token_ms = usage.get("time_to_first_token_ms")
+
+def llm_usage_summary(investigation: Investigation) -> Optional[dict]:
+    if investigation.input_tokens is None:
+        return None
+    return {
+        "model": investigation.llm_model,
+        "input_tokens": investigation.input_tokens,
+        "output_tokens": investigation.output_tokens,
+        "cache_read_tokens": investigation.cache_read_tokens,
+        "cache_write_tokens": investigation.cache_write_tokens,
+        "first_token_ms": investigation.first_token_ms,
+        "routing": {
+            "decision": investigation.routing_decision,
+            "reason": investigation.routing_reason,
+            "category": investigation.triage_category,
+            "confidence": investigation.triage_confidence
+        } if investigation.routing_decision else None
     }
 
 async def run_investigation(
@@ -382,16 +785,22 @@ async def run_investigation(
     error_message: str,
     deployment_logs: str,
     commit_sha: str,
-    db: Session
+    db: Session,
+    retryable: bool = False
 ):
-    """Run investigation in background"""
+    """Run investigation in background.
+
+    With retryable, errors (including Anthropic API errors) put the
+    investigation back to "queued" and are re-raised so the job queue
+    schedules another attempt; only the final attempt records a failure.
+    """
     try:
         print(f"Starting investigation {investigation_id} for repo {repo.owner}/{repo.name}")
         
-        # Get documents
-        docs = db.query(Document).filter(Document.repository_id == repo.id).all()
-        doc_contents = [d.content for d in docs if d.content]
-        print(f"Loaded {len(doc_contents)} documents")
+        # Retrieve the documentation chunks most relevant to this error (SQLite/BM25 work, off the loop)
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, docindex.retrieve, repo.id, error_message, deployment_logs)
+        print(f"Retrieved {len(chunks)} documentation chunks")
         
         if not investigator:
             raise ValueError("Investigator not initialized. Check API keys in .env file")
@@ -404,7 +813,7 @@ async def run_investigation(
             error_message=error_message,
             deployment_logs=deployment_logs,
             commit_sha=commit_sha,
-            documents=doc_contents,
+            documents=chunks,
             websocket_manager=manager
         )
         
@@ -417,18 +826,31 @@ async def run_investigation(
             investigation.root_cause = result.get("root_cause", "")[:1000]  # Limit length
             investigation.suggested_fix = result.get("suggested_fix", "")[:2000]  # Limit length
             investigation.completed_at = datetime.utcnow()
+            record_llm_usage(investigation, result)
             db.commit()
+            sync_followers(db, investigation)
+            similarity_index.add(investigation)
             
     except Exception as e:
         import traceback
         error_msg = f"Investigation error: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
         
+        db.rollback()
         investigation = db.query(Investigation).filter(Investigation.id == investigation_id).first()
         if investigation:
-            investigation.status = "failed"
-            investigation.root_cause = f"Error: {str(e)}"
+            investigation.status = "queued" if retryable else "failed"
+            if not retryable:
+                investigation.root_cause = f"Error: {str(e)}"
             db.commit()
+            sync_followers(db, investigation)
+        await manager.send_message(str(investigation_id), {
+            "type": "step_update",
+            "message": "Investigation attempt failed, retrying" if retryable else "Investigation failed",
+            "data": {"step": "retrying" if retryable else "failed", "error": str(e)}
+        })
+        if retryable:
+            raise
 
 @app.get("/api/investigations")
 async def list_investigations(db: Session = Depends(get_db)):
@@ -444,6 +866,70 @@ async def list_investigations(db: Session = Depends(get_db)):
         "repository_id": inv.repository_id
     } for inv in investigations]
 
+@app.get("/api/investigations/queue")
+async def get_investigation_queue():
+    """Get investigation worker pool depth and wait-time stats"""
+    return investigation_queue.stats()
+
+@app.get("/api/search-cache")
+async def get_search_cache_stats():
+    """Get web search cache hit/miss counters"""
+    return search_cache.stats()
+
+@app.get("/api/prompt-cache")
+async def get_prompt_cache_stats(db: Session = Depends(get_db)):
+    """Get Anthropic prompt cache hit rates across investigations"""
+    analyzed = Investigation.input_tokens.isnot(None)
+    totals = db.query(
+        func.count(Investigation.id),
+        func.coalesce(func.sum(Investigation.input_tokens), 0),
+        func.coalesce(func.sum(Investigation.cache_read_tokens), 0),
+        func.coalesce(func.sum(Investigation.cache_write_tokens), 0)
+    ).filter(analyzed).one()
+    count, uncached, read, written = totals
+    hits = db.query(func.count(Investigation.id)).filter(analyzed, Investigation.cache_read_tokens > 0).scalar()
+
+    def avg_first_token(hit: bool):
+        condition = Investigation.cache_read_tokens > 0 if hit else func.coalesce(Investigation.cache_read_tokens, 0) == 0
+        value = db.query(func.avg(Investigation.first_token_ms)).filter(analyzed, condition).scalar()
+        return round(value) if value is not None else None
+
+    prompt_tokens = uncached + read + written
+    return {
+        "investigations": count,
+        "cache_hits": hits,
+        "cache_read_tokens": read,
+        "cache_write_tokens": written,
+        "uncached_tokens": uncached,
+        "cached_token_ratio": round(read / prompt_tokens, 3) if prompt_tokens else 0.0,
+        "first_token_ms": {"cache_hit": avg_first_token(True), "cache_miss": avg_first_token(False)}
+    }
+
+@app.get("/api/model-routing")
+async def get_model_routing_stats(db: Session = Depends(get_db)):
+    """Get how many analyses the triage model answered vs escalated, with average cost"""
+    rows = db.query(
+        Investigation.routing_decision,
+        Investigation.triage_category,
+        func.count(Investigation.id),
+        func.avg(Investigation.input_tokens + Investigation.cache_read_tokens + Investigation.cache_write_tokens),
+        func.avg(Investigation.output_tokens),
+        func.avg(func.julianday(Investigation.completed_at) - func.julianday(Investigation.created_at))
+    ).filter(Investigation.routing_decision.isnot(None)).group_by(
+        Investigation.routing_decision, Investigation.triage_category
+    ).all()
+    stats = {}
+    for decision, category, count, prompt_tokens, output_tokens, days in rows:
+        stats.setdefault(decision, {"investigations": 0, "categories": {}})
+        stats[decision]["investigations"] += count
+        stats[decision]["categories"][category] = {
+            "investigations": count,
+            "avg_prompt_tokens": round(prompt_tokens) if prompt_tokens is not None else None,
+            "avg_output_tokens": round(output_tokens) if output_tokens is not None else None,
+            "avg_duration_seconds": round(days * 86400, 1) if days is not None else None
+        }
+    return stats
+
 @app.get("/api/investigations/{investigation_id}")
 async def get_investigation(investigation_id: int, db: Session = Depends(get_db)):
     """Get investigation details"""
@@ -457,20 +943,52 @@ async def get_investigation(investigation_id: int, db: Session = Depends(get_db)
         "error_message": investigation.error_message,
         "root_cause": investigation.root_cause,
         "suggested_fix": investigation.suggested_fix,
+        "error_fingerprint": investigation.error_fingerprint,
+        "prior_match": prior_match_summary(investigation),
+        "llm_usage": llm_usage_summary(investigation),
         "created_at": investigation.created_at.isoformat() if investigation.created_at else None,
         "completed_at": investigation.completed_at.isoformat() if investigation.completed_at else None
     }
 
+@app.get("/api/investigations/{investigation_id}/steps")
+async def get_investigation_steps(investigation_id: int, db: Session = Depends(get_db)):
+    """Get the recorded progress events of an investigation"""
+    investigation = db.query(Investigation).filter(Investigation.id == investigation_id).first()
+    if not investigation:
+        raise HTTPException(status_code=404, detail="Investigation not found")
+    await step_log.flush()
+    source_id = investigation.coalesced_into_id or investigation.id
+    steps = db.query(InvestigationStep).filter(
+        InvestigationStep.investigation_id == source_id
+    ).order_by(InvestigationStep.step_number, InvestigationStep.id).all()
+    return [{
+        "step_number": step.step_number,
+        "description": step.description,
+        "status": step.status,
+        "details": json.loads(step.details) if step.details else None,
+        "created_at": step.created_at.isoformat()
+    } for step in steps]
+
+@app.get("/api/websockets")
+async def get_websocket_stats():
+    """Get WebSocket connection, queue and eviction counters, and event bus state"""
+    return dict(manager.stats(), event_bus=event_bus.stats())
+
 @app.websocket("/ws/investigation/{investigation_id}")
 async def websocket_endpoint(websocket: WebSocket, investigation_id: str):
-    await manager.connect(websocket, investigation_id)
+    connection = await manager.connect(websocket, investigation_id, paused=True)
     try:
+        # Everything that happened before this viewer joined, then live updates
+        history = await step_log.history(int(investigation_id)) if investigation_id.isdigit() else []
+        connection.start(history)
         while True:
             data = await websocket.receive_text()
-            # Echo for now
-            await websocket.send_json({"message": data})
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, investigation_id)
+            # Echo for now (through the queue; only the writer task sends)
+            connection.enqueue({"message": data})
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Client left, or the hub evicted the socket
+    finally:
+        await manager.disconnect(connection)
 
 if __name__ == "__main__":
     import uvicorn
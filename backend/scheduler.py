@@ -0,0 +1,125 @@
+import os
+import heapq
+import itertools
+import random
+import time
+from typing import Dict, List, Optional, Iterable
+
+# Poll intervals in seconds
+POLL_ACTIVE_INTERVAL = float(os.getenv("RAILWAY_POLL_ACTIVE_INTERVAL", "5"))
+POLL_IDLE_MIN_INTERVAL = float(os.getenv("RAILWAY_POLL_IDLE_MIN_INTERVAL", "30"))
+POLL_IDLE_MAX_INTERVAL = float(os.getenv("RAILWAY_POLL_IDLE_MAX_INTERVAL", "300"))
+POLL_ERROR_INTERVAL = float(os.getenv("RAILWAY_POLL_ERROR_INTERVAL", "120"))
+POLL_JITTER = float(os.getenv("RAILWAY_POLL_JITTER", "0.1"))
+
+# Railway statuses that mean a deployment is still in flight
+ACTIVE_STATUSES = {"building", "deploying", "initializing", "queued", "waiting"}
+
+class PollScheduler:
+    """Per-repository poll scheduler driven by a next-due-time priority queue.
+
+    Repos with a deployment in flight are polled every few seconds; idle
+    repos back off exponentially up to the idle cap. Every interval gets
+    random jitter so repos don't re-synchronise, and a global "not before"
+    time honours Railway rate limits. Repos whose webhooks are arriving only
+    get a slow reconciliation poll.
+    """
+    def __init__(self):
+        self._heap: List[tuple] = []  # (due_at, generation, repo_id)
+        self._generation: Dict[int, int] = {}  # Latest heap entry per repo
+        self._counter = itertools.count()
+        self.intervals: Dict[int, float] = {}
+        self.statuses: Dict[int, str] = {}
+        self.not_before = 0.0
+        self._reconcile: Dict[int, tuple] = {}  # repo_id -> (interval, monotonic expiry)
+
+    def sync(self, repo_ids: Iterable[int]):
+        """Add newly configured repos as due now and drop removed ones"""
+        repo_ids = set(repo_ids)
+        for repo_id in repo_ids - set(self._generation):
+            self._push(repo_id, time.monotonic())
+        for repo_id in set(self._generation) - repo_ids:
+            del self._generation[repo_id]  # Heap entry is discarded lazily
+            self.intervals.pop(repo_id, None)
+            self.statuses.pop(repo_id, None)
+            self._reconcile.pop(repo_id, None)
+
+    def _push(self, repo_id: int, due_at: float):
+        generation = next(self._counter)
+        self._generation[repo_id] = generation
+        heapq.heappush(self._heap, (due_at, generation, repo_id))
+
+    def pop_due(self, now: Optional[float] = None) -> List[int]:
+        """Remove and return every repo whose poll is due"""
+        now = time.monotonic() if now is None else now
+        if now < self.not_before:
+            return []
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, generation, repo_id = heapq.heappop(self._heap)
+            if self._generation.get(repo_id) == generation:
+                due.append(repo_id)
+        return due
+
+    def seconds_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next poll is due, or None if nothing is scheduled"""
+        now = time.monotonic() if now is None else now
+        while self._heap and self._generation.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(self._heap[0][0], self.not_before) - now
+
+    def record(self, repo_id: int, status: Optional[str]):
+        """Schedule the next poll of a repo from the status it just reported.
+
+        A None status means the check itself failed (project missing, API
+        error) and is retried at the error interval.
+        """
+        if repo_id not in self._generation:
+            return
+        previous = self.intervals.get(repo_id)
+        if status is not None:
+            status = status.lower()
+        idle_min, idle_max = self._idle_bounds(repo_id)
+
+        if status is None:
+            interval = POLL_ERROR_INTERVAL
+        elif status in ACTIVE_STATUSES:
+            interval = POLL_ACTIVE_INTERVAL
+        elif status != self.statuses.get(repo_id) or previous is None or previous < idle_min:
+            interval = idle_min
+        else:
+            interval = min(previous * 2, idle_max)
+
+        self.intervals[repo_id] = interval
+        if status is not None:
+            self.statuses[repo_id] = status
+        jitter = interval * random.uniform(-POLL_JITTER, POLL_JITTER)
+        self._push(repo_id, time.monotonic() + interval + jitter)
+
+    def use_reconciliation(self, repo_id: int, interval: float, ttl: float):
+        """Stretch a repo's idle polling to a slow reconciliation pass for `ttl` seconds.
+
+        Renewed by every webhook from the repo's project, so a repo whose
+        webhooks stop goes back to normal polling when the TTL runs out.
+        """
+        self._reconcile[repo_id] = (interval, time.monotonic() + ttl)
+
+    def reconciling(self, repo_id: int) -> bool:
+        reconcile = self._reconcile.get(repo_id)
+        if reconcile and reconcile[1] <= time.monotonic():
+            del self._reconcile[repo_id]
+            reconcile = None
+        return reconcile is not None
+
+    def _idle_bounds(self, repo_id: int) -> tuple:
+        """(min, max) idle interval of a repo"""
+        if not self.reconciling(repo_id):
+            return POLL_IDLE_MIN_INTERVAL, POLL_IDLE_MAX_INTERVAL
+        interval = self._reconcile[repo_id][0]
+        return max(POLL_IDLE_MIN_INTERVAL, interval), max(POLL_IDLE_MAX_INTERVAL, interval)
+
+    def rate_limited(self, until: float):
+        """Hold every poll until a monotonic deadline from a rate limit response"""
+        self.not_before = max(self.not_before, until)
@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from database import SessionLocal, SearchCacheEntry
+from fingerprint import mask_volatile
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+SEARCH_CACHE_MEMORY_ENTRIES = int(os.getenv("SEARCH_CACHE_MEMORY_ENTRIES", "256"))
+EVICT_EVERY = 50  # Writes between size-based eviction passes
+
+def normalize_query(query: str) -> str:
+    """Mask volatile tokens (timestamps, IDs, ports...) and drop surrounding punctuation"""
+    return mask_volatile(query).strip(" .,:;\"'")
+
+class SearchCache:
+    """Web search results cache: in-memory LRU in front of a SQLite table.
+
+    Entries are keyed on the normalized query, expire after the TTL and
+    are evicted least-recently-used once the table exceeds its size cap.
+    The async methods answer memory hits inline and do the SQLite work in
+    the default thread pool, so async searches never block the event loop.
+    """
+    def __init__(self, ttl: int = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+                 memory_entries: int = SEARCH_CACHE_MEMORY_ENTRIES):
+        self.ttl = timedelta(seconds=ttl)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created_at, results)
+        self._lock = threading.Lock()  # Sync searches may run in executor threads
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, max_results: int) -> str:
+        return hashlib.sha1(f"{normalize_query(query)}|{max_results}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, created_at: datetime, results: List[Dict]):
+        with self._lock:
+            self._memory[key] = (created_at, results)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _get_memory(self, key: str, now: datetime) -> Optional[List[Dict]]:
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and now - cached[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return cached[1]
+            self._memory.pop(key, None)
+        return None
+
+    def _get_disk(self, key: str, now: datetime) -> Optional[List[Dict]]:
+        db = SessionLocal()
+        try:
+            entry = db.query(SearchCacheEntry).filter(SearchCacheEntry.key == key).first()
+            if not entry or now - entry.created_at > self.ttl:
+                self.misses += 1
+                return None
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_used_at = now
+            db.commit()
+            results = json.loads(entry.results)
+            created_at = entry.created_at
+        except Exception as e:
+            print(f"Search cache read error: {e}")
+            self.misses += 1
+            return None
+        finally:
+            db.close()
+
+        self.disk_hits += 1
+        self._remember(key, created_at, results)
+        return results
+
+    def get(self, query: str, max_results: int) -> Optional[List[Dict]]:
+        key = self.key(query, max_results)
+        now = datetime.utcnow()
+        cached = self._get_memory(key, now)
+        if cached is not None:
+            return cached
+        return self._get_disk(key, now)
+
+    async def get_async(self, query: str, max_results: int) -> Optional[List[Dict]]:
+        key = self.key(query, max_results)
+        now = datetime.utcnow()
+        cached = self._get_memory(key, now)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._get_disk, key, now)
+
+    def _put_disk(self, key: str, query: str, results: List[Dict], now: datetime):
+        db = SessionLocal()
+        try:
+            db.merge(SearchCacheEntry(
+                key=key,
+                query=normalize_query(query),
+                results=json.dumps(results),
+                hits=0,
+                created_at=now,
+                last_used_at=now
+            ))
+            db.commit()
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % EVICT_EVERY == 0
+            if evict:
+                self._evict(db)
+        except Exception as e:
+            print(f"Search cache write error: {e}")
+        finally:
+            db.close()
+
+    def put(self, query: str, max_results: int, results: List[Dict]):
+        if not results:
+            return  # Don't cache failures/empty searches
+        key = self.key(query, max_results)
+        now = datetime.utcnow()
+        self._remember(key, now, results)
+        self._put_disk(key, query, results, now)
+
+    async def put_async(self, query: str, max_results: int, results: List[Dict]):
+        if not results:
+            return
+        key = self.key(query, max_results)
+        now = datetime.utcnow()
+        self._remember(key, now, results)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._put_disk, key, query, results, now)
+
+    def _evict(self, db):
+        """Drop expired entries, then the least recently used beyond the size cap"""
+        db.query(SearchCacheEntry).filter(
+            SearchCacheEntry.created_at < datetime.utcnow() - self.ttl
+        ).delete(synchronize_session=False)
+        overflow = db.query(SearchCacheEntry).count() - self.max_entries
+        if overflow > 0:
+            stale = db.query(SearchCacheEntry.key).order_by(
+                SearchCacheEntry.last_used_at
+            ).limit(overflow).subquery()
+            db.query(SearchCacheEntry).filter(
+                SearchCacheEntry.key.in_(stale.select())
+            ).delete(synchronize_session=False)
+        db.commit()
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+# Global cache instance
+search_cache = SearchCache()
@@ -0,0 +1,137 @@
+import os
+import re
+import zlib
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from database import SessionLocal, Investigation
+
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+SIMILARITY_MAX_PER_REPO = int(os.getenv("SIMILARITY_MAX_PER_REPO", "500"))
+
+NUM_PERM = 64
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows each
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1337)  # Fixed so signatures are stable across restarts
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_TOKEN = re.compile(r"<\w+>|[a-z0-9_]+", re.I)
+
+def shingles(signature: str) -> set:
+    """Word unigrams and bigrams of a (masked) error signature"""
+    tokens = _TOKEN.findall(signature.lower())
+    grams = set(tokens)
+    grams.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return grams
+
+def minhash(signature: str) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(signature)] or [0]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+def estimated_similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERM
+
+class _RepoIndex:
+    def __init__(self):
+        self.by_fingerprint: Dict[str, int] = {}  # fingerprint -> newest investigation ID
+        self.entries: "OrderedDict[int, Tuple[str, Tuple[int, ...]]]" = OrderedDict()  # id -> (fingerprint, minhash)
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}  # (band, rows) -> investigation IDs
+
+    @staticmethod
+    def _bands(signature: Tuple[int, ...]):
+        rows = NUM_PERM // BANDS
+        for band in range(BANDS):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def add(self, investigation_id: int, fingerprint: str, signature_text: str):
+        if investigation_id in self.entries:
+            return
+        signature = minhash(signature_text)
+        self.entries[investigation_id] = (fingerprint, signature)
+        self.by_fingerprint[fingerprint] = investigation_id
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, set()).add(investigation_id)
+        while len(self.entries) > SIMILARITY_MAX_PER_REPO:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, investigation_id: int):
+        fingerprint, signature = self.entries.pop(investigation_id)
+        if self.by_fingerprint.get(fingerprint) == investigation_id:
+            del self.by_fingerprint[fingerprint]
+        for key in self._bands(signature):
+            bucket = self.buckets.get(key)
+            if bucket:
+                bucket.discard(investigation_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def lookup(self, fingerprint: str, signature_text: str, threshold: float) -> Optional[Dict]:
+        if fingerprint in self.by_fingerprint:
+            return {"investigation_id": self.by_fingerprint[fingerprint], "score": 1.0, "exact": True}
+        signature = minhash(signature_text)
+        candidates = set()
+        for key in self._bands(signature):
+            candidates.update(self.buckets.get(key, ()))
+        best = None
+        for candidate in candidates:
+            score = estimated_similarity(signature, self.entries[candidate][1])
+            if score >= threshold and (best is None or (score, candidate) > (best["score"], best["investigation_id"])):
+                best = {"investigation_id": candidate, "score": round(score, 3), "exact": False}
+        return best
+
+class SimilarityIndex:
+    """Per-repository index of completed investigations for reusing prior root causes.
+
+    Exact matches go through a fingerprint dict; near duplicates through
+    MinHash signatures bucketed with LSH, so a lookup only compares against
+    the few prior incidents that share a band.
+    """
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._repos: Dict[int, _RepoIndex] = {}
+
+    @staticmethod
+    def reusable(investigation: Investigation) -> bool:
+        """Only successful analyses with a fingerprint are worth reusing"""
+        return bool(
+            investigation.status == "completed"
+            and investigation.error_fingerprint
+            and investigation.root_cause
+            and not investigation.root_cause.startswith("Error")
+        )
+
+    def load(self):
+        """Build the index from completed investigations in the database"""
+        db = SessionLocal()
+        try:
+            investigations = db.query(Investigation).filter(
+                Investigation.status == "completed",
+                Investigation.error_fingerprint.isnot(None)
+            ).order_by(Investigation.id).all()
+            for investigation in investigations:
+                self.add(investigation)
+        finally:
+            db.close()
+        print(f"🧭 Similarity index loaded {sum(len(r.entries) for r in self._repos.values())} investigations")
+
+    def add(self, investigation: Investigation):
+        if self.reusable(investigation):
+            self._repos.setdefault(investigation.repository_id, _RepoIndex()).add(
+                investigation.id,
+                investigation.error_fingerprint,
+                investigation.error_signature or ""
+            )
+
+    def lookup(self, repository_id: int, fingerprint: str, signature: str,
+               exclude_id: Optional[int] = None) -> Optional[Dict]:
+        """Best prior match for an error as {"investigation_id", "score", "exact"}, or None"""
+        index = self._repos.get(repository_id)
+        if not index or not fingerprint:
+            return None
+        match = index.lookup(fingerprint, signature or "", self.threshold)
+        if match and match["investigation_id"] == exclude_id:
+            return None
+        return match
+
+# Global index instance
+similarity_index = SimilarityIndex()
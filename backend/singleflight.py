@@ -0,0 +1,29 @@
+import hashlib
+from typing import Dict, List, Set
+
+def coalesce_key(repository_id: int, commit_sha: str, error_fingerprint: str) -> str:
+    """Identity of an investigation: (repository, commit SHA, error fingerprint)"""
+    raw = f"{repository_id}|{(commit_sha or '').strip().lower()}|{error_fingerprint}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class FollowerRegistry:
+    """Leader investigation ID -> duplicate investigation IDs attached to it.
+
+    Used to fan a leader's WebSocket updates out to viewers of its
+    duplicates. The durable link is Investigation.coalesced_into_id; this
+    is just the in-memory routing table.
+    """
+    def __init__(self):
+        self._followers: Dict[str, Set[str]] = {}
+
+    def attach(self, leader_id, follower_id):
+        self._followers.setdefault(str(leader_id), set()).add(str(follower_id))
+
+    def followers(self, leader_id) -> List[str]:
+        return list(self._followers.get(str(leader_id), ()))
+
+    def release(self, leader_id) -> List[str]:
+        return list(self._followers.pop(str(leader_id), ()))
+
+# Global registry instance
+follower_registry = FollowerRegistry()
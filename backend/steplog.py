@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from database import SessionLocal, Investigation, InvestigationStep
+
+STEP_FLUSH_INTERVAL = float(os.getenv("STEP_FLUSH_INTERVAL", "0.5"))
+STEP_BATCH_SIZE = int(os.getenv("STEP_BATCH_SIZE", "200"))
+STEP_WRITE_RETRIES = int(os.getenv("STEP_WRITE_RETRIES", "5"))  # Failed writes of a batch before it is dropped
+
+# Event sequence numbers are wall-clock microseconds, strictly increasing within a
+# process, so events of the API processes on one host sort together without a
+# database read on the hot path; origin tells the processes' events apart.
+STEP_ORIGIN = uuid.uuid4().hex[:8]
+_last_sequence = 0
+
+def next_sequence() -> int:
+    global _last_sequence
+    _last_sequence = max(_last_sequence + 1, time.time_ns() // 1000)
+    return _last_sequence
+
+def step_status(message: Dict) -> str:
+    step = (message.get("data") or {}).get("step")
+    if step == "completed":
+        return "completed"
+    if step in ("error", "failed"):
+        return "failed"
+    return "in_progress"
+
+class StepLog:
+    """Write-behind log of the WebSocket events of each investigation.
+
+    record() stamps an event with a sequence number and appends it to an
+    in-memory buffer; a background task writes the buffer to the
+    investigation_steps table in batches from a thread, so publishers never
+    wait on SQLite. Streamed analysis deltas are merged per batch. Stored
+    events are replayed to late-joining viewers.
+
+    With shared set (several API processes on one event bus), history()
+    first waits out the other processes' flush interval, since events they
+    published before the viewer joined may not be written yet.
+    """
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        self._buffer: Deque[Tuple[int, Dict]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._failures = 0
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the background writer (call from the running event loop)"""
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def record(self, investigation_id: int, message: Dict) -> Dict:
+        """Stamp an event with its sequence number and buffer it for writing"""
+        message = dict(message, seq=next_sequence(), origin=STEP_ORIGIN)
+        self._buffer.append((investigation_id, message))
+        if self._wakeup is not None and len(self._buffer) >= STEP_BATCH_SIZE:
+            self._wakeup.set()
+        return message
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), STEP_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Step log write error: {e}")
+
+    async def flush(self):
+        """Write everything buffered so far (and wait for a write already in progress).
+
+        A failed write (e.g. the database is locked) puts the batch back at
+        the front of the buffer for the next flush; after STEP_WRITE_RETRIES
+        consecutive failures the events are dropped so the buffer can't grow
+        without bound.
+        """
+        async with self._lock or asyncio.Lock():
+            batch = []
+            while self._buffer:
+                batch.append(self._buffer.popleft())
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, batch)
+            except Exception as e:
+                self._failures += 1
+                if self._failures < STEP_WRITE_RETRIES:
+                    print(f"Step log write error (attempt {self._failures}, will retry): {e}")
+                    self._buffer.extendleft(reversed(batch))
+                else:
+                    print(f"Step log write error, dropping {len(batch)} events after {self._failures} attempts: {e}")
+                    self.dropped += len(batch)
+                    self._failures = 0
+                return
+            self._failures = 0
+
+    @staticmethod
+    def _merge(batch: List[Tuple[int, Dict]]) -> List[Tuple[int, Dict]]:
+        """Fold consecutive analysis deltas of an investigation into one event"""
+        merged: List[Tuple[int, Dict]] = []
+        last_index: Dict[int, int] = {}
+        for investigation_id, message in batch:
+            index = last_index.get(investigation_id)
+            if (index is not None and message.get("type") == "analysis_delta"
+                    and merged[index][1].get("type") == "analysis_delta"):
+                previous = merged[index][1]
+                merged[index] = (investigation_id, dict(
+                    previous, text=previous.get("text", "") + message.get("text", ""), seq=message["seq"]
+                ))
+                continue
+            last_index[investigation_id] = len(merged)
+            merged.append((investigation_id, message))
+        return merged
+
+    def _write(self, batch: List[Tuple[int, Dict]]):
+        db = SessionLocal()
+        try:
+            events = self._merge(batch)
+            ids = {investigation_id for investigation_id, _ in events}
+            numbers = dict(db.query(
+                InvestigationStep.investigation_id, func.max(InvestigationStep.step_number)
+            ).filter(InvestigationStep.investigation_id.in_(ids)).group_by(InvestigationStep.investigation_id).all())
+            for investigation_id, message in events:
+                numbers[investigation_id] = (numbers.get(investigation_id) or 0) + 1
+                db.add(InvestigationStep(
+                    investigation_id=investigation_id,
+                    step_number=numbers[investigation_id],
+                    description=message.get("message") or message.get("text", "")[:200],
+                    status=step_status(message),
+                    details=json.dumps(message)
+                ))
+            db.commit()
+            self.written += len(events)
+        finally:
+            db.close()
+
+    async def history(self, investigation_id: int) -> List[Dict]:
+        """Stored events of an investigation in sequence order (a coalesced duplicate replays its leader's)"""
+        await self.flush()
+        if self.shared:
+            await asyncio.sleep(2 * STEP_FLUSH_INTERVAL)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._load, investigation_id)
+
+    @staticmethod
+    def _load(investigation_id: int) -> List[Dict]:
+        db = SessionLocal()
+        try:
+            investigation = db.query(Investigation).filter(Investigation.id == investigation_id).first()
+            if investigation is None:
+                return []
+            source_id = investigation.coalesced_into_id or investigation.id
+            steps = db.query(InvestigationStep).filter(
+                InvestigationStep.investigation_id == source_id
+            ).order_by(InvestigationStep.step_number, InvestigationStep.id).all()
+            events = [json.loads(step.details) for step in steps if step.details]
+            # Rows are in write order, which differs from event order across processes
+            return sorted(events, key=lambda event: event.get("seq") or 0)
+        finally:
+            db.close()
+
+# Global step log instance
+step_log = StepLog()
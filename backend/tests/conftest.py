@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+# Backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+@pytest.fixture
+def db_engine(tmp_path, monkeypatch):
+    """Point every SessionLocal at a fresh oncall.db in a temporary directory"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'oncall.db'}", connect_args={"check_same_thread": False})
+    original = database.SessionLocal.kw["bind"]
+    monkeypatch.setattr(database, "engine", engine)
+    database.SessionLocal.configure(bind=engine)
+    database.init_db()
+    yield engine
+    database.SessionLocal.configure(bind=original)
+    engine.dispose()
+
+@pytest.fixture
+def db(db_engine):
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def repo(db):
+    repository = database.Repository(owner="acme", name="api", railway_project_name="acme-api")
+    db.add(repository)
+    db.commit()
+    db.refresh(repository)
+    return repository
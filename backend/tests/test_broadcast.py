@@ -0,0 +1,115 @@
+import asyncio
+
+import broadcast
+from broadcast import BroadcastHub
+
+class FakeSocket:
+    def __init__(self, fail: bool = False):
+        self.sent = []
+        self.fail = fail
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+def test_full_queue_drops_oldest_and_tells_the_client():
+    async def run():
+        hub = BroadcastHub(max_queue=3)
+        socket = FakeSocket()
+        connection = await hub.connect(socket, "7", paused=True)
+        for i in range(5):
+            hub.publish("7", {"type": "step_update", "n": i})
+        assert [m["n"] for m in connection.queue] == [2, 3, 4]
+        connection.start()
+        await settle()
+        await hub.disconnect(connection)
+        return hub, socket
+
+    hub, socket = asyncio.run(run())
+    assert socket.sent[0] == {"type": "messages_dropped", "count": 2}
+    assert [m["n"] for m in socket.sent[1:]] == [2, 3, 4]
+    assert hub.dropped == 2
+
+def test_consecutive_deltas_are_merged():
+    async def run():
+        hub = BroadcastHub()
+        connection = await hub.connect(FakeSocket(), "7", paused=True)
+        for text in ("Root ", "cause", ": config"):
+            hub.publish("7", {"type": "analysis_delta", "text": text})
+        hub.publish("7", {"type": "step_update", "message": "done"})
+        return list(connection.queue)
+
+    queue = asyncio.run(run())
+    assert queue == [{"type": "analysis_delta", "text": "Root cause: config"},
+                     {"type": "step_update", "message": "done"}]
+
+def test_failing_socket_is_evicted_without_affecting_others():
+    async def run():
+        hub = BroadcastHub()
+        healthy, broken = FakeSocket(), FakeSocket(fail=True)
+        await hub.connect(healthy, "7")
+        await hub.connect(broken, "7")
+        assert hub.publish("7", {"type": "step_update"}) == 2
+        await settle()
+        return hub, healthy, broken
+
+    hub, healthy, broken = asyncio.run(run())
+    assert healthy.sent == [{"type": "step_update"}]
+    assert broken.closed and hub.evicted == 1
+    assert hub.stats()["connections"] == 1
+
+def test_replay_skips_live_messages_already_in_the_history():
+    async def run():
+        hub = BroadcastHub()
+        socket = FakeSocket()
+        connection = await hub.connect(socket, "7", paused=True)
+        hub.publish("7", {"type": "step_update", "seq": 2})  # Arrived while history loaded
+        hub.publish("7", {"type": "step_update", "seq": 3})
+        connection.start([{"type": "step_update", "seq": 1}, {"type": "step_update", "seq": 2}])
+        await settle()
+        await hub.disconnect(connection)
+        return socket
+
+    assert [m["seq"] for m in asyncio.run(run()).sent] == [1, 2, 3]
+
+def test_replay_keeps_other_processes_unwritten_events_in_order():
+    async def run():
+        hub = BroadcastHub()
+        socket = FakeSocket()
+        connection = await hub.connect(socket, "7", paused=True)
+        # Worker "b" published seq 20 before worker "a" wrote seq 30; "b" hadn't written it yet
+        hub.publish("7", {"type": "step_update", "seq": 20, "origin": "b"})
+        hub.publish("7", {"type": "step_update", "seq": 30, "origin": "a"})
+        hub.publish("7", {"type": "step_update", "seq": 40, "origin": "b"})
+        connection.start([{"type": "step_update", "seq": 10, "origin": "b"},
+                          {"type": "step_update", "seq": 30, "origin": "a"}])
+        await settle()
+        await hub.disconnect(connection)
+        return socket
+
+    assert [m["seq"] for m in asyncio.run(run()).sent] == [10, 20, 30, 40]
+
+def test_idle_connections_are_pinged(monkeypatch):
+    monkeypatch.setattr(broadcast, "WS_HEARTBEAT_INTERVAL", 0.01)
+
+    async def run():
+        hub = BroadcastHub()
+        socket = FakeSocket()
+        connection = await hub.connect(socket, "7")
+        await asyncio.sleep(0.05)
+        await hub.disconnect(connection)
+        return socket
+
+    assert {"type": "ping"} in asyncio.run(run()).sent
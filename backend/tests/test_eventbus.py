@@ -0,0 +1,87 @@
+import time
+from datetime import datetime, timedelta
+
+import eventbus
+import main
+from database import BusEvent, BusLease
+from eventbus import InProcessBus, SQLiteBus, create_event_bus
+
+def pair():
+    """Two "processes" sharing the test database, both past the existing events"""
+    first, second = SQLiteBus(), SQLiteBus()
+    first._cursor = first._prepare()
+    second._cursor = second._prepare()
+    return first, second
+
+def test_events_reach_other_processes_but_not_the_publisher(db_engine):
+    first, second = pair()
+    seen = []
+    first.subscribe("websocket", lambda payload: seen.append(("first", payload)))
+    first.publish("websocket", {"n": 1})  # Delivered locally at once
+    first._exchange()
+    assert second._exchange() == [("websocket", {"n": 1})]
+    assert first._exchange() == []
+    assert seen == [("first", {"n": 1})]
+
+def test_events_survive_the_retention_prune(db_engine, monkeypatch):
+    first, second = pair()
+    for n in range(5):
+        first.publish("monitor", {"n": n})
+    first._exchange()
+    assert len(second._exchange()) == 5
+
+    monkeypatch.setattr(eventbus, "PRUNE_EVERY", 1)
+    monkeypatch.setattr(eventbus, "EVENT_BUS_RETENTION", 0)
+    time.sleep(0.01)
+    first._exchange()
+    second._exchange()  # Prunes everything past retention
+    first.publish("monitor", {"n": 5})
+    first._exchange()
+    assert second._exchange() == [("monitor", {"n": 5})]
+
+def test_event_ids_are_never_reused(db, db_engine):
+    bus = SQLiteBus()
+    bus.publish("monitor", {})
+    bus._exchange()
+    newest = db.query(BusEvent).one().id
+    db.query(BusEvent).delete()
+    db.commit()
+    bus.publish("monitor", {})
+    bus._exchange()
+    assert db.query(BusEvent).one().id > newest
+
+def test_claims_are_won_once_across_processes(db_engine):
+    first, second = pair()
+    assert first.claim("railway-deployment:d1")
+    assert not second.claim("railway-deployment:d1")
+    assert not first.claim("railway-deployment:d1")
+    local = InProcessBus()
+    assert local.claim("x") and not local.claim("x")
+
+def test_leadership_is_exclusive_until_released_or_expired(db, db_engine):
+    first, second = pair()
+    assert first.acquire_leadership("railway-monitor")
+    assert first.acquire_leadership("railway-monitor")  # Renewal
+    assert not second.acquire_leadership("railway-monitor")
+
+    first.release_leadership("railway-monitor")
+    assert second.acquire_leadership("railway-monitor")
+
+    db.query(BusLease).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    assert first.acquire_leadership("railway-monitor")
+    assert not second.acquire_leadership("railway-monitor")
+    assert second.stats()["leases"] == []
+
+def test_factory():
+    assert isinstance(create_event_bus("sqlite"), SQLiteBus)
+    assert type(create_event_bus("local")) is InProcessBus
+
+def test_webhook_event_switches_the_monitor_to_reconciliation(monkeypatch):
+    monkeypatch.setattr(main, "poll_scheduler", main.PollScheduler())
+    published = []
+    monkeypatch.setattr(main.event_bus, "publish", lambda topic, payload: published.append(payload))
+    main.apply_monitor_event({"op": "webhook", "repo_id": 5})
+    assert main.poll_scheduler.reconciling(5)
+    assert not main.poll_scheduler.reconciling(6)
+    assert published == []  # Handling the event doesn't publish it again
@@ -0,0 +1,43 @@
+from fingerprint import fingerprint, mask_volatile, top_frame
+
+PY_TRACE = """2024-05-01T12:00:01Z Starting worker pid=4242
+Traceback (most recent call last):
+  File "/app/server.py", line 88, in <module>
+    main()
+  File "/app/db/pool.py", line 12, in connect
+    raise ConnectionError("refused")
+ConnectionError: could not connect to 10.0.3.4:5432 (attempt 3)
+"""
+
+def test_mask_volatile_replaces_ids_and_numbers():
+    masked = mask_volatile(
+        "2024-05-01T12:00:01Z req 3f2b8c1e-1d2a-4c3b-9e8f-0a1b2c3d4e5f from 10.0.0.1:8080 "
+        "sha deadbeef123 in /srv/app/main.py took 512ms"
+    )
+    assert masked == "<ts> req <uuid> from <ip> sha <hex> in <path> took <n>ms"
+
+def test_same_failure_fingerprints_identically_across_deploys():
+    other = PY_TRACE.replace("12:00:01", "18:42:17").replace("10.0.3.4", "10.0.9.9").replace("attempt 3", "attempt 7")
+    assert fingerprint("Deploy crashed", PY_TRACE)["hash"] == fingerprint("Deploy crashed", other)["hash"]
+
+def test_different_failures_fingerprint_differently():
+    other = PY_TRACE.replace("ConnectionError: could not connect", "KeyError: 'DATABASE_URL'")
+    assert fingerprint("", PY_TRACE)["hash"] != fingerprint("", other)["hash"]
+
+def test_fingerprint_parts():
+    result = fingerprint("", PY_TRACE)
+    assert result["error_type"] == "ConnectionError"
+    assert result["top_frame"] == "pool.py:connect"
+    assert result["informative"]
+
+def test_top_frame_across_languages():
+    assert top_frame("TypeError: x is undefined\n    at handler (/app/src/routes.js:10:5)") == "routes.js:handler"
+    assert top_frame("java.lang.NullPointerException\n\tat com.acme.Api.handle(Api.java:42)") == "Api.java:handle"
+    assert top_frame("panic: boom\n\t/go/src/app/main.go:17 +0x1d") == "main.go"
+    assert top_frame("nothing to see") is None
+
+def test_bare_status_message_is_not_informative():
+    # What the poller and webhooks produce when Railway reports no error
+    assert not fingerprint("Railway deployment failed")["informative"]
+    assert not fingerprint("Railway deployment crashed", "Starting build\nBuild done")["informative"]
+    assert fingerprint("Railway deployment failed", "npm ERR! missing script: start\nerror Command failed")["informative"]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+from integrations.github import GitHubClient
+
+HEAD = "a" * 40
+NODES = [{"oid": HEAD, "message": "Pin Node 20", "committedDate": "2026-10-01T00:00:00Z", "url": "", "author": {"name": "Ann"}}]
+
+class Response:
+    def __init__(self, status_code, text="", json_data=None, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self._json = json_data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+class FakeSession:
+    """Answers the default-branch head with an ETag and the GraphQL history"""
+    def __init__(self):
+        self.head = HEAD
+        self.gets = []
+        self.queries = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.gets.append(dict(headers or {}))
+        etag = f'"{self.head}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return Response(304)
+        return Response(200, text=self.head, headers={"ETag": etag})
+
+    def post(self, url, json=None, timeout=None):
+        self.queries.append(json["variables"])
+        nodes = [dict(NODES[0], oid=self.head)]
+        return Response(200, json_data={"data": {"repository": {
+            "defaultBranchRef": {"target": {"history": {"nodes": nodes}}}
+        }}})
+
+def client():
+    github = GitHubClient("token")
+    github.session = FakeSession()
+    github.get_repo = lambda owner, name: SimpleNamespace(default_branch="main")
+    return github
+
+def test_history_is_reused_while_the_head_is_unchanged():
+    github = client()
+    first = github.get_investigation_context("acme", "api")
+    second = github.get_investigation_context("acme", "api")
+    assert first["recent_commits"] == second["recent_commits"]
+    assert second["recent_commits"][0]["sha"] == HEAD
+    assert len(github.session.queries) == 1  # The second context cost one 304
+    assert github.session.gets[1]["If-None-Match"] == f'"{HEAD}"'
+
+def test_history_is_refetched_when_the_head_moves():
+    github = client()
+    github.get_investigation_context("acme", "api")
+    github.session.head = "b" * 40
+    context = github.get_investigation_context("acme", "api")
+    assert len(github.session.queries) == 2
+    assert context["recent_commits"][0]["sha"] == "b" * 40
+
+def test_target_commit_query_skips_the_cached_history():
+    github = client()
+    github._get_commit_files = lambda owner, name, sha: []
+    github.get_investigation_context("acme", "api")
+    github.get_investigation_context("acme", "api", sha="c" * 40)
+    assert github.session.queries[1]["withHistory"] is False
+    assert github.session.queries[1]["hasSha"] is True
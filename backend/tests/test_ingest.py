@@ -0,0 +1,86 @@
+import asyncio
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+import ingest
+from database import Document
+from ingest import UploadSizeLimit, UploadTooLarge, save_upload, upload_path
+
+def upload(name: str, data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=name)
+
+def test_uploads_with_the_same_name_get_their_own_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "UPLOAD_DIR", str(tmp_path))
+    first, second = upload_path(1, "runbook.md"), upload_path(1, "../../runbook.md")
+    assert first != second
+    assert os.path.dirname(second) == str(tmp_path) and second.endswith("_runbook.md")
+
+    async def run():
+        await asyncio.gather(save_upload(upload("runbook.md", b"one"), first),
+                             save_upload(upload("runbook.md", b"two"), second))
+
+    asyncio.run(run())
+    assert open(first, "rb").read() == b"one"
+    assert open(second, "rb").read() == b"two"
+
+def test_oversized_upload_is_rejected_and_removed(tmp_path):
+    path = str(tmp_path / "big.txt")
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_upload(upload("big.txt", b"x" * 2048), path, max_bytes=1024))
+    assert os.listdir(tmp_path) == []
+
+def test_documents_leased_by_another_worker_are_left_to_it(db, repo):
+    doc = Document(repository_id=repo.id, filename="runbook.md", file_path="uploads/runbook.md", file_type="md",
+                   status="processing", lease_owner="other-worker",
+                   lease_expires_at=datetime.utcnow() + timedelta(seconds=60))
+    db.add(doc)
+    db.commit()
+    ingestor = ingest.DocumentIngestor()
+    assert ingestor._claim(doc.id) == (None, True)
+
+    # The other worker died: its lease runs out and the document is taken over once
+    doc.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert ingestor._claim(doc.id) == (("uploads/runbook.md", "md"), False)
+    assert ingest.DocumentIngestor()._claim(doc.id) == (None, True)
+    db.refresh(doc)
+    assert doc.lease_owner == ingestor.owner
+
+def limited_app():
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimit)
+    received = []
+
+    @app.post("/api/repositories/{repo_id}/documents")
+    async def upload_document(repo_id: int, file: UploadFile = File(...)):
+        received.append(len(await file.read()))
+        return {"size": received[-1]}
+
+    return TestClient(app), received
+
+def test_oversized_upload_is_refused_before_the_endpoint_runs(monkeypatch):
+    monkeypatch.setattr(ingest, "DOC_MAX_UPLOAD_MB", 1 / 1024)  # 1 KiB + multipart overhead
+    monkeypatch.setattr(ingest, "MULTIPART_OVERHEAD_BYTES", 1024)
+    client, received = limited_app()
+    assert client.post("/api/repositories/1/documents", files={"file": ("a.md", b"x" * 100)}).status_code == 200
+
+    # Declared too large: answered without reading the body
+    response = client.post("/api/repositories/1/documents", files={"file": ("a.md", b"x" * 4096)})
+    assert response.status_code == 413
+
+    # Chunked, so no Content-Length: stopped once the limit is crossed
+    def body():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.md\"\r\n\r\n"
+        for _ in range(64):
+            yield b"x" * 1024
+        yield b"\r\n--b--\r\n"
+
+    response = client.post("/api/repositories/1/documents", content=body(),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert received == [100]
@@ -0,0 +1,113 @@
+import asyncio
+
+import main
+from database import Investigation, InvestigationJob
+from jobs import PRIORITY_AUTO, PRIORITY_MANUAL, PRIORITY_BACKGROUND
+from similarity import SimilarityIndex
+from steplog import StepLog
+
+TRACE = """Traceback (most recent call last):
+  File "/app/settings.py", line 3, in load
+    url = os.environ["DATABASE_URL"]
+KeyError: 'DATABASE_URL'
+"""
+
+def create(db, repo, error_message, logs="", commit_sha="", priority=PRIORITY_MANUAL):
+    investigation, _ = main.create_investigation(db, repo, error_message, logs, commit_sha, priority)
+    return investigation
+
+def test_identical_in_flight_investigations_coalesce(db, repo):
+    leader = create(db, repo, "Deploy crashed", TRACE, "aaaaaaa1")
+    follower = create(db, repo, "Deploy crashed", TRACE, "aaaaaaa1")
+    assert follower.coalesced_into_id == leader.id
+    assert db.query(InvestigationJob).count() == 1
+
+def test_failures_without_error_content_are_not_merged(db, repo, monkeypatch):
+    monkeypatch.setattr(main, "similarity_index", SimilarityIndex())
+    first = create(db, repo, "Railway deployment failed", commit_sha="", priority=PRIORITY_AUTO)
+    second = create(db, repo, "Railway deployment failed", commit_sha="", priority=PRIORITY_AUTO)
+    assert second.coalesced_into_id is None
+    assert first.coalesce_key is None and first.error_fingerprint is None
+    assert db.query(InvestigationJob).count() == 2
+
+def test_railway_commit_is_taken_from_deployment_meta(db, repo, monkeypatch):
+    started = []
+    monkeypatch.setattr(main, "claim_failed_deployment", lambda deployment_id: True)
+    monkeypatch.setattr(main, "start_auto_investigation", lambda *args: started.append(args) or 1)
+    main.handle_deployment_status(repo, {"id": "d1", "status": "FAILED", "meta": {"commitHash": "bbbbbbb2"}})
+    assert started[0][3] == "bbbbbbb2"
+
+def test_bare_railway_failures_are_neither_matched_nor_reused(db, repo, monkeypatch):
+    index = SimilarityIndex()
+    monkeypatch.setattr(main, "similarity_index", index)
+    monkeypatch.setattr(main, "step_log", StepLog())
+    monkeypatch.setattr(main, "claim_failed_deployment", lambda deployment_id: True)
+
+    def poll(deployment_id, status, commit_sha):
+        deployment = {"id": deployment_id, "status": status, "meta": {"commitHash": commit_sha}}
+        return db.get(Investigation, main.handle_deployment_status(repo, deployment))
+
+    first = poll("d1", "FAILED", "aaaaaaa1")
+    assert first.error_fingerprint is None and first.deployment_logs == ""
+    completed(db, first, index)
+
+    other_commit = poll("d2", "FAILED", "bbbbbbb2")
+    redeploy = poll("d3", "FAILED", "aaaaaaa1")
+    crashed = poll("d4", "CRASHED", "bbbbbbb2")
+    for investigation in (other_commit, redeploy, crashed):
+        assert investigation.status == "queued" and investigation.root_cause is None
+        assert investigation.prior_match_id is None
+        job = db.query(InvestigationJob).filter(InvestigationJob.investigation_id == investigation.id).one()
+        assert job.priority == PRIORITY_AUTO
+
+def completed(db, investigation, index):
+    investigation.status = "completed"
+    investigation.root_cause = "DATABASE_URL is not set"
+    investigation.suggested_fix = "Set DATABASE_URL"
+    db.commit()
+    index.add(investigation)
+
+def test_exact_reuse_needs_the_same_commit(db, repo, monkeypatch):
+    index = SimilarityIndex()
+    monkeypatch.setattr(main, "similarity_index", index)
+    monkeypatch.setattr(main, "step_log", StepLog())
+    first = create(db, repo, "Deploy crashed", TRACE, "aaaaaaa1")
+    completed(db, first, index)
+
+    other_commit = create(db, repo, "Deploy crashed", TRACE, "bbbbbbb2")
+    assert other_commit.status == "queued" and other_commit.root_cause is None
+    assert other_commit.prior_match_id == first.id
+    job = db.query(InvestigationJob).filter(InvestigationJob.investigation_id == other_commit.id).one()
+    assert job.priority == PRIORITY_BACKGROUND
+
+    same_commit = create(db, repo, "Deploy crashed", TRACE, "aaaaaaa1")
+    assert same_commit.status == "completed"
+    assert same_commit.root_cause == "DATABASE_URL is not set"
+
+    # Viewers get the prior match at creation, and the reused answer
+    steps = [(investigation_id, message["data"]["step"]) for investigation_id, message in main.step_log._buffer]
+    assert steps == [
+        (other_commit.id, "prior_match"),
+        (same_commit.id, "prior_match"),
+        (same_commit.id, "completed"),
+    ]
+
+def test_webhooks_for_different_commits_are_analyzed_separately(db, repo, monkeypatch):
+    index = SimilarityIndex()
+    monkeypatch.setattr(main, "similarity_index", index)
+    monkeypatch.setattr(main, "step_log", StepLog())
+    monkeypatch.setattr(main, "RAILWAY_WEBHOOK_SECRET", "s3cret")
+
+    def webhook(deployment_id, commit_sha):
+        payload = {"event": "deployment.failed", "data": {
+            "deployment_id": deployment_id, "project_name": repo.railway_project_name, "commit_sha": commit_sha
+        }}
+        return asyncio.run(main.railway_webhook(payload, token="s3cret", x_webhook_secret=None, db=db))
+
+    first = webhook(f"dep-{repo.id}-1", "aaaaaaa1")
+    assert first["status"] == "queued"
+    completed(db, db.get(Investigation, first["investigation_id"]), index)
+
+    second = webhook(f"dep-{repo.id}-2", "bbbbbbb2")
+    assert second["status"] == "queued"
+    assert db.get(Investigation, second["investigation_id"]).root_cause is None
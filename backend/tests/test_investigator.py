@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+from anthropic import APIConnectionError
+
+import main
+from agent import investigator as investigator_module
+from agent.investigator import OnCallInvestigator
+from database import Investigation
+
+class FailingMessages:
+    def stream(self, **kwargs):
+        raise APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+    async def create(self, **kwargs):
+        raise APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+class FailingClient:
+    messages = FailingMessages()
+
+def failing_investigator() -> OnCallInvestigator:
+    agent = OnCallInvestigator(anthropic_api_key="test-key")
+    agent.client = FailingClient()
+    return agent
+
+def test_api_errors_propagate(monkeypatch):
+    monkeypatch.setattr(investigator_module, "TRIAGE_ENABLED", False)
+    agent = failing_investigator()
+    with pytest.raises(APIConnectionError):
+        asyncio.run(agent._analyze_with_claude("1", None, "acme", "api", "boom", "", [], [], [], []))
+
+@pytest.mark.parametrize("retryable, status", [(True, "queued"), (False, "failed")])
+def test_run_investigation_retries_api_errors(db, repo, monkeypatch, retryable, status):
+    monkeypatch.setattr(investigator_module, "TRIAGE_ENABLED", False)
+    monkeypatch.setattr(main, "investigator", failing_investigator())
+    monkeypatch.setattr(investigator_module, "get_github_client", lambda: None)
+    monkeypatch.setattr(investigator_module, "parallel_client", None)
+    investigation = Investigation(repository_id=repo.id, status="investigating", error_message="boom")
+    db.add(investigation)
+    db.commit()
+
+    async def run():
+        await main.run_investigation(investigation.id, repo, "boom", "", "", db, retryable=retryable)
+
+    if retryable:
+        with pytest.raises(APIConnectionError):
+            asyncio.run(run())
+    else:
+        asyncio.run(run())
+    db.expire_all()
+    stored = db.get(Investigation, investigation.id)
+    assert stored.status == status
+    # Only the final attempt records a result
+    assert (stored.root_cause is None) == retryable
+
+def test_documentation_is_retrieved_off_the_event_loop(db, repo, monkeypatch):
+    threads = []
+
+    def retrieve(repository_id, error_message, deployment_logs):
+        threads.append(threading.get_ident())
+        return []
+
+    monkeypatch.setattr(main.docindex, "retrieve", retrieve)
+    monkeypatch.setattr(main, "investigator", None)  # Stop right after retrieval
+    investigation = Investigation(repository_id=repo.id, status="investigating", error_message="boom")
+    db.add(investigation)
+    db.commit()
+
+    async def run():
+        await main.run_investigation(investigation.id, repo, "boom", "", "", db)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 1 and threads[0] != loop_thread
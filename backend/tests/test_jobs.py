@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import jobs
+from database import Investigation, InvestigationJob
+from jobs import InvestigationQueue, PRIORITY_AUTO, PRIORITY_MANUAL
+
+def add_investigation(db, repo, status="queued"):
+    investigation = Investigation(repository_id=repo.id, status=status, error_message="boom")
+    db.add(investigation)
+    db.commit()
+    return investigation.id
+
+def test_claim_leases_each_job_once_in_priority_order(db, repo):
+    queue = InvestigationQueue(num_workers=1)
+    manual = add_investigation(db, repo)
+    auto = add_investigation(db, repo)
+    queue.submit(manual, PRIORITY_MANUAL)
+    assert queue.submit(auto, PRIORITY_AUTO) == 2
+
+    first = queue._claim()
+    assert first.investigation_id == auto
+    assert first.attempts == 1 and first.lease_owner == queue.owner
+    assert queue._claim().investigation_id == manual
+    assert InvestigationQueue()._claim() is None
+
+def test_submit_is_idempotent(db, repo):
+    queue = InvestigationQueue(num_workers=1)
+    investigation_id = add_investigation(db, repo)
+    queue.submit(investigation_id)
+    queue.submit(investigation_id)
+    assert db.query(InvestigationJob).count() == 1
+
+def test_expired_lease_is_claimable_by_another_worker(db, repo):
+    dead, alive = InvestigationQueue(), InvestigationQueue()
+    investigation_id = add_investigation(db, repo)
+    dead.submit(investigation_id)
+    job = dead._claim()
+    db.query(InvestigationJob).filter(InvestigationJob.id == job.id).update(
+        {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+
+    reclaimed = alive._claim()
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2 and reclaimed.lease_owner == alive.owner
+    # The old owner can no longer finish it, and doesn't count it as finished
+    assert dead._finish(job) is None
+    db.expire_all()
+    assert db.get(InvestigationJob, job.id).status == "running"
+
+def test_failed_attempts_back_off_then_fail(db, repo, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    queue = InvestigationQueue()
+    queue.submit(add_investigation(db, repo))
+
+    job = queue._claim()
+    assert queue._finish(job, "overloaded") == "queued"
+    db.expire_all()
+    retry = db.get(InvestigationJob, job.id)
+    assert retry.available_at > datetime.utcnow() + timedelta(seconds=jobs.JOB_RETRY_BACKOFF - 5)
+    assert queue._claim() is None  # Not due yet
+
+    retry.available_at = datetime.utcnow()
+    db.commit()
+    job = queue._claim()
+    assert job.attempts == 2
+    assert queue._finish(job, "overloaded") == "failed"
+
+def test_recover_queues_orphaned_investigations(db, repo):
+    orphan = add_investigation(db, repo, status="investigating")
+    add_investigation(db, repo, status="completed")
+    queue = InvestigationQueue()
+    assert queue.recover() == 1
+    db.expire_all()
+    assert [job.investigation_id for job in db.query(InvestigationJob).all()] == [orphan]
+    assert db.get(Investigation, orphan).status == "queued"
+
+def test_recovered_jobs_keep_their_priority(db, repo):
+    queue = InvestigationQueue()
+    auto = add_investigation(db, repo, status="investigating")
+    queue.submit(auto, PRIORITY_AUTO)
+    db.query(InvestigationJob).delete()  # Lost, e.g. the job row predates the queue
+    db.commit()
+    # Rows without a stored priority
+    manual = add_investigation(db, repo, status="investigating")
+    legacy_auto = Investigation(repository_id=repo.id, status="queued",
+                                error_message="Railway deployment crashed: Railway deployment crashed")
+    db.add(legacy_auto)
+    db.commit()
+
+    assert queue.recover() == 3
+    db.expire_all()
+    priorities = {job.investigation_id: job.priority for job in db.query(InvestigationJob).all()}
+    assert priorities == {auto: PRIORITY_AUTO, manual: PRIORITY_MANUAL, legacy_auto.id: PRIORITY_AUTO}
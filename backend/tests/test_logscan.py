@@ -0,0 +1,45 @@
+from logscan import LogScanner, excerpt_logs, line_severity
+
+def build_log() -> str:
+    # Distinct lines, so nothing collapses
+    lines = [f"synced {chr(97 + i % 26)}{chr(97 + i // 26 % 26)}{chr(97 + i // 676)} ok" for i in range(5000)]
+    lines[1200:1200] = [
+        "Traceback (most recent call last):",
+        '  File "/app/worker.py", line 40, in run',
+        "    job()",
+        '  File "/app/jobs/sync.py", line 9, in job',
+        "    raise ValueError('bad payload')",
+        "ValueError: bad payload",
+    ]
+    lines.append("npm ERR! Killed: out of memory")
+    lines.append("Stopping container")
+    return "\n".join(lines)
+
+def test_severity():
+    assert line_severity("Segmentation fault (core dumped)") == 3
+    assert line_severity("TypeError: x is undefined") == 2
+    assert line_severity("DeprecationWarning: use foo") == 1
+    assert line_severity("listening on :8080") == 0
+
+def test_repeated_lines_collapse():
+    scanner = LogScanner().feed_all(f"retry {i}/50 connecting" for i in range(50))
+    assert scanner.collapsed == 49
+    assert "[repeated 50 times]" in scanner.excerpt()
+
+def test_excerpt_keeps_trace_fatal_line_and_tail_within_budget():
+    excerpt = excerpt_logs(build_log(), budget_bytes=3000)
+    assert len(excerpt.encode("utf-8")) <= 3000 + 200  # Header line is outside the budget
+    assert "Traceback (most recent call last):" in excerpt
+    assert "ValueError: bad payload" in excerpt
+    assert "out of memory" in excerpt
+    assert excerpt.rstrip().endswith("Stopping container")
+
+def test_excerpt_is_in_log_order_with_gaps_marked():
+    excerpt = excerpt_logs(build_log(), budget_bytes=3000)
+    numbers = [int(line.split("|")[0]) for line in excerpt.splitlines()[1:] if "|" in line]
+    assert numbers == sorted(numbers)
+    assert "    ..." in excerpt
+
+def test_accepts_byte_lines_and_empty_input():
+    assert excerpt_logs("") == ""
+    assert "boom" in excerpt_logs([b"starting\n", b"fatal: boom\n"])
@@ -0,0 +1,54 @@
+from agent.investigator import OnCallInvestigator
+from agent.prompt import Section, allocate, estimate_tokens, fit_sections, truncate_to_tokens
+
+def words(n: int) -> str:
+    return " ".join(["word"] * n)
+
+def test_estimate_and_truncate():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello, world") == 2 + 1 + 2
+    text = words(1000)
+    assert estimate_tokens(truncate_to_tokens(text, 100)) <= 100
+    assert truncate_to_tokens(text, 100, keep="end").startswith("...")
+    assert truncate_to_tokens("short", 100) == "short"
+
+def test_allocate_splits_by_relevance_when_everything_is_oversized():
+    sections = [Section("A", [words(1000)], 3.0), Section("B", [words(1000)], 1.0)]
+    grants = allocate(sections, 400)
+    assert grants == [300, 100]
+
+def test_allocate_hands_surplus_to_the_sections_that_need_it():
+    small = Section("small", [words(10)], 3.0)
+    large = Section("large", [words(1000)], 1.0)
+    grants = allocate([small, large], 400)
+    assert grants[0] == small.demand
+    assert grants[0] + grants[1] == 400
+
+def test_allocate_skips_empty_sections_and_never_overspends():
+    sections = [Section("empty", [], 5.0), Section("A", [words(50)], 1.0), Section("B", [words(500)], 2.0)]
+    grants = allocate(sections, 300)
+    assert grants[0] == 0
+    assert sum(grants) <= 300
+
+def test_fit_sections_stays_within_budget_and_reports_usage():
+    sections = [
+        Section("LOGS", [words(2000)], 3.0, keep="end"),
+        Section("DOCS", [words(30), words(30)], 1.0),
+        Section("WEB", [], 1.0),
+    ]
+    blocks, report = fit_sections(sections, 500)
+    assert sum(estimate_tokens(block) for block in blocks) <= 500
+    assert report["DOCS"]["used"] == report["DOCS"]["demand"]
+    assert blocks[0].startswith("LOGS:\n...")
+    assert blocks[2] == "WEB:\nNone available"
+
+def test_better_documentation_matches_get_more_of_the_prefix():
+    commits = [{"sha": f"{i:07d}", "message": words(40)} for i in range(20)]
+
+    def docs_used(score: float) -> int:
+        documents = [{"filename": "runbook.md", "text": words(3000), "score": score}]
+        _, _, report = OnCallInvestigator._build_prompt("acme", "api", "boom", "", commits, [], documents, [])
+        return report["UPLOADED DOCUMENTATION"]["used"]
+
+    assert docs_used(10.0) > docs_used(0.5)
+    assert docs_used(0.5) == docs_used(0.5)  # Deterministic, so the prefix can cache
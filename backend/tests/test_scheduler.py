@@ -0,0 +1,91 @@
+import scheduler
+from scheduler import PollScheduler
+
+def test_new_repos_are_due_immediately(monkeypatch):
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: 100.0)
+    poll = PollScheduler()
+    poll.sync([1, 2])
+    assert sorted(poll.pop_due()) == [1, 2]
+    assert poll.pop_due() == []
+    assert poll.seconds_until_next() is None
+
+def test_active_deployments_poll_fast_and_idle_repos_back_off(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(scheduler, "POLL_JITTER", 0.0)
+    poll = PollScheduler()
+    poll.sync([1])
+    poll.pop_due()
+
+    poll.record(1, "BUILDING")
+    assert poll.intervals[1] == scheduler.POLL_ACTIVE_INTERVAL
+
+    intervals = []
+    for _ in range(6):
+        poll.record(1, "success")
+        intervals.append(poll.intervals[1])
+    assert intervals[0] == scheduler.POLL_IDLE_MIN_INTERVAL
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == scheduler.POLL_IDLE_MAX_INTERVAL
+
+    # A status change resets the backoff
+    poll.record(1, "failed")
+    assert poll.intervals[1] == scheduler.POLL_IDLE_MIN_INTERVAL
+
+def test_failed_check_uses_error_interval(monkeypatch):
+    monkeypatch.setattr(scheduler, "POLL_JITTER", 0.0)
+    poll = PollScheduler()
+    poll.sync([1])
+    poll.record(1, None)
+    assert poll.intervals[1] == scheduler.POLL_ERROR_INTERVAL
+
+def test_only_the_latest_entry_of_a_repo_counts(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(scheduler, "POLL_JITTER", 0.0)
+    poll = PollScheduler()
+    poll.sync([1])
+    poll.record(1, "building")  # Supersedes the "due now" entry
+    assert poll.pop_due() == []
+    now[0] = scheduler.POLL_ACTIVE_INTERVAL
+    assert poll.pop_due() == [1]
+
+def test_removed_repos_are_dropped_lazily(monkeypatch):
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: 0.0)
+    poll = PollScheduler()
+    poll.sync([1, 2])
+    poll.sync([2])
+    assert poll.pop_due() == [2]
+    poll.record(1, "success")  # Unknown repo: ignored
+    assert 1 not in poll.intervals
+
+def test_rate_limit_holds_every_poll(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    poll = PollScheduler()
+    poll.sync([1])
+    poll.rate_limited(30.0)
+    assert poll.pop_due() == []
+    assert poll.seconds_until_next() == 30.0
+    now[0] = 30.0
+    assert poll.pop_due() == [1]
+
+def test_reconciliation_is_per_repo_and_expires(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(scheduler, "POLL_JITTER", 0.0)
+    poll = PollScheduler()
+    poll.sync([1, 2])
+    poll.use_reconciliation(1, 900, ttl=3600)
+
+    poll.record(1, "success")
+    poll.record(2, "success")
+    assert poll.intervals[1] == 900
+    assert poll.intervals[2] == scheduler.POLL_IDLE_MIN_INTERVAL
+    poll.record(1, "deploying")  # In-flight deployments are still followed closely
+    assert poll.intervals[1] == scheduler.POLL_ACTIVE_INTERVAL
+
+    now[0] = 3601.0
+    assert not poll.reconciling(1)
+    poll.record(1, "success")
+    assert poll.intervals[1] == scheduler.POLL_IDLE_MIN_INTERVAL
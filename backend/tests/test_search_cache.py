@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from search_cache import SearchCache
+
+RESULTS = [{"title": "Fix", "url": "https://example.com", "snippet": "...", "content": ""}]
+
+def test_volatile_tokens_share_a_key():
+    assert SearchCache.key("timeout at 10.0.0.1:5432 after 30s", 5) == SearchCache.key(
+        "timeout at 10.0.0.7:6543 after 45s", 5
+    )
+
+def test_async_lookups_do_sqlite_work_off_the_event_loop(db_engine):
+    cache = SearchCache()
+    loop_thread = threading.get_ident()
+    disk_threads = []
+    get_disk, put_disk = cache._get_disk, cache._put_disk
+
+    def spy(fn):
+        def wrapper(*args):
+            disk_threads.append(threading.get_ident())
+            return fn(*args)
+        return wrapper
+
+    cache._get_disk, cache._put_disk = spy(get_disk), spy(put_disk)
+
+    async def run():
+        assert await cache.get_async("boom", 5) is None
+        await cache.put_async("boom", 5, RESULTS)
+        assert await cache.get_async("boom", 5) == RESULTS  # Served from memory, inline
+
+    asyncio.run(run())
+    assert len(disk_threads) == 2
+    assert loop_thread not in disk_threads
+    assert (cache.misses, cache.memory_hits, cache.disk_hits) == (1, 1, 0)
+
+    # A fresh process finds the entry on disk
+    fresh = SearchCache()
+    assert asyncio.run(fresh.get_async("boom", 5)) == RESULTS
+    assert fresh.disk_hits == 1
+
+def test_empty_results_are_not_cached(db_engine):
+    cache = SearchCache()
+    asyncio.run(cache.put_async("boom", 5, []))
+    assert asyncio.run(cache.get_async("boom", 5)) is None
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import similarity
+from fingerprint import fingerprint
+from similarity import SimilarityIndex, minhash, estimated_similarity
+
+def investigation(id, repository_id, error, logs="", status="completed", root_cause="Pool exhausted"):
+    print_ = fingerprint(error, logs)
+    return SimpleNamespace(
+        id=id, repository_id=repository_id, status=status, root_cause=root_cause,
+        error_fingerprint=print_["hash"], error_signature=print_["signature"]
+    )
+
+ERROR = "TimeoutError: could not acquire connection from pool db-primary within 30s"
+
+def lookup(index, repository_id, error):
+    print_ = fingerprint(error)
+    return index.lookup(repository_id, print_["hash"], print_["signature"])
+
+def test_exact_match_by_fingerprint():
+    index = SimilarityIndex()
+    index.add(investigation(1, 10, ERROR))
+    match = lookup(index, 10, ERROR.replace("30s", "45s"))
+    assert match == {"investigation_id": 1, "score": 1.0, "exact": True}
+
+def test_near_duplicate_found_through_lsh_buckets():
+    index = SimilarityIndex(threshold=0.5)
+    index.add(investigation(1, 10, ERROR))
+    index.add(investigation(2, 10, "KeyError: 'STRIPE_SECRET_KEY' while loading settings"))
+    match = lookup(index, 10, "TimeoutError: could not acquire connection from pool db-replica within 30s")
+    assert match["investigation_id"] == 1 and not match["exact"]
+    assert 0.5 <= match["score"] < 1.0
+
+def test_matches_stay_within_a_repository_and_skip_failed_analyses():
+    index = SimilarityIndex()
+    index.add(investigation(1, 10, ERROR))
+    index.add(investigation(2, 20, ERROR, root_cause="Error: overloaded"))
+    index.add(investigation(3, 20, ERROR, status="failed"))
+    assert lookup(index, 20, ERROR) is None
+    assert index.lookup(10, fingerprint(ERROR)["hash"], "", exclude_id=1) is None
+
+def test_index_is_bounded_per_repository(monkeypatch):
+    monkeypatch.setattr(similarity, "SIMILARITY_MAX_PER_REPO", 2)
+    index = SimilarityIndex()
+    for i, error in enumerate(["AError: one", "BError: two", "CError: three"]):
+        index.add(investigation(i, 10, error))
+    assert lookup(index, 10, "AError: one") is None
+    assert lookup(index, 10, "CError: three")["investigation_id"] == 2
+
+def test_minhash_estimates_jaccard():
+    same = minhash("timeouterror|could not acquire connection|pool.py:get")
+    assert estimated_similarity(same, same) == 1.0
+    assert estimated_similarity(same, minhash("keyerror|missing env var|settings.py:load")) < 0.3
@@ -0,0 +1,112 @@
+import asyncio
+
+import steplog
+from database import Investigation
+from steplog import StepLog
+
+def delta(text, seq):
+    return {"type": "analysis_delta", "text": text, "seq": seq}
+
+def test_merge_folds_consecutive_deltas_per_investigation():
+    batch = [
+        (1, delta("Root ", 1)),
+        (2, delta("Other", 2)),
+        (1, delta("cause", 3)),
+        (1, {"type": "step_update", "seq": 4}),
+        (1, delta("tail", 5)),
+    ]
+    merged = StepLog._merge(batch)
+    assert merged == [
+        (1, delta("Root cause", 3)),
+        (2, delta("Other", 2)),
+        (1, {"type": "step_update", "seq": 4}),
+        (1, delta("tail", 5)),
+    ]
+
+def test_history_replays_in_order_and_follows_the_leader(db, repo):
+    leader = Investigation(repository_id=repo.id, status="investigating")
+    db.add(leader)
+    db.commit()
+    follower = Investigation(repository_id=repo.id, status="investigating", coalesced_into_id=leader.id)
+    db.add(follower)
+    db.commit()
+
+    async def run():
+        log = StepLog()
+        log.record(leader.id, {"type": "step_update", "message": "Fetching", "data": {"step": "github_context"}})
+        log.record(leader.id, {"type": "analysis_delta", "text": "Root "})
+        log.record(leader.id, {"type": "analysis_delta", "text": "cause"})
+        return await log.history(follower.id), log.written
+
+    history, written = asyncio.run(run())
+    assert written == 2
+    assert [m["type"] for m in history] == ["step_update", "analysis_delta"]
+    assert history[1]["text"] == "Root cause"
+    assert history[0]["seq"] < history[1]["seq"]
+
+def test_failed_writes_are_retried_then_dropped(db, repo, monkeypatch):
+    monkeypatch.setattr(steplog, "STEP_WRITE_RETRIES", 3)
+    investigation = Investigation(repository_id=repo.id, status="investigating")
+    db.add(investigation)
+    db.commit()
+    log = StepLog()
+    write = log._write
+    failures = [2]
+
+    def flaky(batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError("database is locked")
+        write(batch)
+
+    log._write = flaky
+
+    async def run():
+        log.record(investigation.id, {"type": "step_update", "message": "one"})
+        await log.flush()
+        log.record(investigation.id, {"type": "step_update", "message": "two"})
+        await log.flush()
+        assert len(log._buffer) == 2  # Both kept, in order
+        await log.flush()
+        return await log.history(investigation.id)
+
+    history = asyncio.run(run())
+    assert [m["message"] for m in history] == ["one", "two"]
+
+    failures[0] = 3
+
+    async def run_dropping():
+        log.record(investigation.id, {"type": "step_update", "message": "lost"})
+        for _ in range(3):
+            await log.flush()
+        return len(log._buffer)
+
+    assert asyncio.run(run_dropping()) == 0
+    assert log.dropped == 1
+
+def test_sequence_follows_the_clock_across_processes(monkeypatch):
+    now = [1_000_000_000_000]
+    monkeypatch.setattr(steplog.time, "time_ns", lambda: now[0])
+    monkeypatch.setattr(steplog, "_last_sequence", 0)
+    first, second = steplog.next_sequence(), steplog.next_sequence()
+    assert second == first + 1  # Strictly increasing within a microsecond
+    # A process started later stamps by the clock, not by how many events it sent
+    monkeypatch.setattr(steplog, "_last_sequence", 0)
+    now[0] += 5_000
+    assert steplog.next_sequence() == first + 5
+
+def test_shared_history_waits_for_other_workers_to_flush(db, repo, monkeypatch):
+    monkeypatch.setattr(steplog, "STEP_FLUSH_INTERVAL", 0.05)
+    investigation = Investigation(repository_id=repo.id, status="investigating")
+    db.add(investigation)
+    db.commit()
+
+    async def run():
+        viewer, other = StepLog(shared=True), StepLog(shared=True)
+        other.start()  # The other worker's write-behind loop
+        other.record(investigation.id, {"type": "step_update", "message": "Fetching"})
+        history = await viewer.history(investigation.id)
+        await other.stop()
+        return history
+
+    assert [m["message"] for m in asyncio.run(run())] == ["Fetching"]
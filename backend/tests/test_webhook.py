@@ -0,0 +1,22 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+
+def test_webhook_requires_configured_secret(monkeypatch):
+    monkeypatch.setattr(main, "RAILWAY_WEBHOOK_SECRET", None)
+    with pytest.raises(HTTPException) as error:
+        main.check_webhook_secret("anything", None)
+    assert error.value.status_code == 503
+
+def test_webhook_rejects_wrong_secret(monkeypatch):
+    monkeypatch.setattr(main, "RAILWAY_WEBHOOK_SECRET", "s3cret")
+    for token, header in ((None, None), ("wrong", None), (None, "wrong")):
+        with pytest.raises(HTTPException) as error:
+            main.check_webhook_secret(token, header)
+        assert error.value.status_code == 401
+
+def test_webhook_accepts_secret_in_query_or_header(monkeypatch):
+    monkeypatch.setattr(main, "RAILWAY_WEBHOOK_SECRET", "s3cret")
+    main.check_webhook_secret("s3cret", None)
+    main.check_webhook_secret(None, "s3cret")
@@ -271,6 +271,15 @@ export default function InvestigationDetailPage() {
           </div>
         )}
 
+        {investigation.status === 'queued' && (
+          <div className="bg-gray-500/10 border border-gray-500/50 rounded-xl p-4 mb-6">
+            <div className="flex items-center gap-3">
+              <div className="text-2xl">⏳</div>
+              <p className="text-gray-300 font-medium">Queued - waiting for a free investigation worker...</p>
+            </div>
+          </div>
+        )}
+
         {investigation.status === 'failed' && (
           <div className="bg-red-500/10 border border-red-500/50 rounded-xl p-4 mb-6">
             <div className="flex items-center gap-3">
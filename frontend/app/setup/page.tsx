@@ -49,17 +49,23 @@ export default function SetupPage() {
     
     setUploading(true);
     try {
+      const formData = new FormData();
       for (const file of files) {
-        const formData = new FormData();
-        formData.append('file', file);
-        
-        await fetch(`http://localhost:8000/api/repositories/${repoId}/documents`, {
-          method: 'POST',
-          body: formData
-        });
+        formData.append('files', file);
       }
       
-      alert('Files uploaded successfully!');
+      const response = await fetch(`http://localhost:8000/api/repositories/${repoId}/documents/bulk`, {
+        method: 'POST',
+        body: formData
+      });
+      const results = await response.json();
+      const rejected = results.filter((r: { status: string }) => r.status === 'rejected');
+      
+      if (rejected.length > 0) {
+        alert(`Uploaded ${results.length - rejected.length} files; rejected: ${rejected.map((r: { filename: string }) => r.filename).join(', ')}`);
+      } else {
+        alert('Files uploaded successfully! They will be indexed in the background.');
+      }
       router.push('/');
     } catch (error) {
       console.error('Error uploading files:', error);